@@ -0,0 +1,101 @@
+"""
+Append-only answer journal.
+
+/student/update-question appends one small record per answer instead of
+rewriting the whole progress document. Reads fold the journal over the
+last progress snapshot; once JOURNAL_COMPACT_AFTER records pile up the
+folded result is written back as the new snapshot and the journal is
+cleared.
+
+Run `python answer_journal.py` to compact every journal (e.g. from cron
+or before a backup).
+"""
+
+import json
+import time
+from pathlib import Path
+
+from write_behind import get_writer
+
+
+def make_record(lesson_id: str, question_id: str, correct: bool, time_taken: int) -> dict:
+    return {
+        "lesson_id": lesson_id,
+        "question_id": question_id,
+        "correct": bool(correct),
+        "time_taken": time_taken,
+        "ts": time.time(),
+    }
+
+
+def apply_answer(progress: dict, record: dict) -> bool:
+    """Apply one journal record to a progress document, same rules as update-question."""
+    lesson = progress.get("lessons", {}).get(record["lesson_id"])
+    if not lesson:
+        return False
+
+    for questions in lesson["questions"].values():
+        for q in questions:
+            if q["id"] == record["question_id"]:
+                q["correct"] = record["correct"]
+                q["time_taken"] = record["time_taken"]
+                return True
+    return False
+
+
+def apply_answer_copy(progress: dict, record: dict) -> dict:
+    """
+    Like apply_answer, but leaves progress untouched and returns a new document.
+    Only the dicts and lists on the path to the question are copied, the rest is shared.
+    """
+    lesson = progress.get("lessons", {}).get(record["lesson_id"])
+    if not lesson:
+        return progress
+
+    for level, questions in lesson["questions"].items():
+        for i, q in enumerate(questions):
+            if q["id"] == record["question_id"]:
+                new_questions = list(questions)
+                new_questions[i] = {**q, "correct": record["correct"], "time_taken": record["time_taken"]}
+                new_lesson = {**lesson, "questions": {**lesson["questions"], level: new_questions}}
+                return {**progress, "lessons": {**progress["lessons"], record["lesson_id"]: new_lesson}}
+    return progress
+
+
+def fold(progress: dict, records: list) -> dict:
+    for record in records:
+        apply_answer(progress, record)
+    return progress
+
+
+def read_records(path: Path) -> list:
+    if not path.exists():
+        return []
+
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # torn last line from a crash mid-append
+                continue
+    return records
+
+
+def append_record(path: Path, record: dict) -> int:
+    """Append a record and return how many records the journal now holds."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a+", encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+        f.seek(0)
+        count = sum(1 for _ in f)
+    get_writer().sync(path)
+    return count
+
+
+if __name__ == "__main__":
+    from storage import get_storage
+
+    compacted = get_storage().compact_all_progress()
+    print(f"Compacted {compacted} answer journals")
@@ -1,25 +1,18 @@
-import csv
-import shutil
 from flask import Flask, jsonify, request, Response
 from flask_cors import CORS
-import os
-from pathlib import Path
 import json
-from constants import (
-    CLASSES_CSV,
-    CLASSES_FOLDER,
-    USERSFOLDER,
-    AUTH_TABLE,
-    QUESTION_GENERATORS,
-    HTML_CONTENT_SRC,
-)
 from helpers import (
     get_user_if_valid,
-    load_json,
-    write_json,
     hash_password,
-    generate_practice_problems,
+    theming_stats,
+    question_details,
 )
+from constants import DEFAULT_CLASS_ID, LESSON_CACHE_MAX_AGE, AVAILABLE_THEMES
+from storage import get_storage
+from locks import progress_lock, class_meta_lock, profile_lock, lock_stats
+from content_store import put_stream, lesson_digest, read_blob, read_variant, VARIANTS
+from write_behind import get_writer
+from leaderboard import window_days, iso_day
 from user_utils import change_password
 from setup_new_user import signup
 from collections import OrderedDict
@@ -29,7 +22,14 @@ from class_utils import (
     join_teacher_class,
     leave_class,
     get_class_progress,
+    enqueue_theming,
 )
+from jobs import get_queue, get_job
+from theme_cache import get_theme_cache
+from theme_batcher import get_theme_batcher
+from dispatcher import get_dispatcher
+from llm import model_available
+from prefetch import maybe_prefetch_next_lesson, swap_in_prefetched, prefetch_stats
 from user_utils import get_user_profile, get_user_classes
 
 app = Flask(__name__)
@@ -50,6 +50,12 @@ def ensure_data_files():
 # Run initialization check on startup
 ensure_data_files()
 
+# warn now, not on the first theming job, if the model isn't configured
+model_available()
+
+# run queued background jobs (left over from a restart too) in this process
+get_queue().start()
+
 
 @app.route("/new-user-setup", methods=["POST"])
 def new_user_setup():
@@ -148,9 +154,7 @@ def forgot_password():
         return jsonify({"success": False, "message": "All fields are required"}), 400
 
     # Find user in auth table
-    with open(AUTH_TABLE, newline="") as f:
-        reader = csv.DictReader(f)
-        user_row = next((r for r in reader if r["username"] == username), None)
+    user_row = get_storage().get_user_by_username(username)
 
     if not user_row:
         return jsonify({"success": False, "message": "User not found"}), 404
@@ -163,7 +167,7 @@ def forgot_password():
             if hash_password(answer) == user_row[a_col]:
                 # Correct answer, update password
                 new_hashed_pw = hash_password(new_password)
-                update_password_in_csv(username, new_hashed_pw)
+                get_storage().set_password(username, new_hashed_pw)
                 return jsonify(
                     {"success": True, "message": "Password reset successfully"}
                 )
@@ -173,22 +177,6 @@ def forgot_password():
     return jsonify({"success": False, "message": "No security question found"}), 400
 
 
-def update_password_in_csv(username, new_hashed_pw):
-    """Overwrite the CSV row for a user with a new password."""
-    rows = []
-    with open(AUTH_TABLE, newline="") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            if row["username"] == username:
-                row["hashed_password"] = new_hashed_pw
-            rows.append(row)
-
-    with open(AUTH_TABLE, "w", newline="") as f:
-        writer = csv.DictWriter(f, fieldnames=reader.fieldnames)
-        writer.writeheader()
-        writer.writerows(rows)
-
-
 @app.route("/forgot-password/question", methods=["POST"])
 def forgot_password_question():
     """
@@ -201,9 +189,7 @@ def forgot_password_question():
         return jsonify({"success": False, "message": "Missing username"}), 400
 
     # Find user
-    with open(AUTH_TABLE, newline="") as f:
-        reader = csv.DictReader(f)
-        user_row = next((r for r in reader if r["username"] == username), None)
+    user_row = get_storage().get_user_by_username(username)
 
     if not user_row:
         return jsonify({"success": False, "message": "User not found"}), 404
@@ -220,19 +206,7 @@ def forgot_password_question():
 # list of possible themes a user can pick from, we can add more or have it read from a file
 @app.route("/available-themes")
 def available_themes():
-    return jsonify(
-        [
-            "Soccer",
-            "Hockey",
-            "Toys",
-            "Pokemon",
-            "Video Games",
-            "Cars",
-            "Fairies",
-            "Horses",
-            "Dolls",
-        ]
-    )
+    return jsonify(AVAILABLE_THEMES)
 
 
 # get or update user theme
@@ -246,24 +220,21 @@ def user_theme():
     if not userid:
         return jsonify({"success": False, "message": "Missing userid"}), 400
 
-    user_folder = USERSFOLDER / userid
-    profile_file = user_folder / "profile.json"
-
-    # Load profile
-    profile = {}
-    if profile_file.exists():
-        profile = load_json(profile_file)
-
     if request.method == "POST":
         # Update theme
         theme = data.get("theme")
         if not theme:
             return jsonify({"success": False, "message": "Missing theme"}), 400
 
-        profile["theme"] = theme
-        write_json(profile_file, profile)
+        with profile_lock(userid):
+            profile = get_storage().get_profile(userid) or {}
+            profile["theme"] = theme
+            get_storage().save_profile(userid, profile)
         return jsonify({"success": True, "message": f"Theme updated to {theme}"})
 
+    # Load profile
+    profile = get_storage().get_profile(userid) or {}
+
     # return current theme
     current_theme = profile.get("theme", None)
 
@@ -274,24 +245,20 @@ def user_theme():
 
 # ---------- CLASS CREATION + LESSON CONTENT ----------
 
-# use the existing default class as the template for all new classes
-DEFAULT_TEMPLATE_CLASS = "default_math"
+# use the shared default class as the template for all new classes
+DEFAULT_TEMPLATE_CLASS = DEFAULT_CLASS_ID
 
 
 def _load_default_template():
     """
     Load the questions template for the default class
-    (e.g., classes/default_math/template.json).
+    (classes/default_math/template.json).
     """
-    template_dir = CLASSES_FOLDER / DEFAULT_TEMPLATE_CLASS
-    template_json = template_dir / "template.json"
+    template_questions = get_storage().get_class_template(DEFAULT_TEMPLATE_CLASS)
 
-    if not template_json.exists():
+    if template_questions is None:
         raise FileNotFoundError(f"Template class '{DEFAULT_TEMPLATE_CLASS}' not found")
 
-    with open(template_json, "r", encoding="utf-8") as f:
-        template_questions = json.load(f)
-
     return template_questions
 
 
@@ -355,15 +322,12 @@ def upload_teacher_class():
     # create a new class id for the class the prof created
     class_id = register_class(class_name, description, template_questions, teacher_userid)
 
-    # create the content folder for each class
-    class_folder = CLASSES_FOLDER / class_id
-    content_folder = class_folder / "content"
-    content_folder.mkdir(parents=True, exist_ok=True)
-
-    # Save all HTML files
+    # Store all HTML files in the content store, hashing while we save
+    manifest = {}
     for key, file in request.files.items():
         if key.startswith("lesson_") and file.filename.endswith(".html"):
-            file.save(content_folder / file.filename)
+            manifest[file.filename[:-len(".html")]] = put_stream(file.stream)
+    get_storage().save_class_manifest(class_id, manifest)
 
     return jsonify({"success": True, "class_id": class_id})
 
@@ -372,27 +336,51 @@ def upload_teacher_class():
 def get_lesson_content():
     """
     Return HTML lesson content.
-    All classes share the same lessons, loaded from HTML_CONTENT_SRC.
+    Classes using the default lessons all share the same blobs in the content store.
     """
     data = request.get_json() or {}
-    class_id = data.get("class_id")  # kept for API compatibility, not used
+    class_id = data.get("class_id")
     lesson_id = data.get("lesson_id")
 
     if not class_id or not lesson_id:
         return jsonify({"success": False, "message": "Missing class_id or lesson_id"}), 400
 
-    # Always load from global source folder
-    content_path = CLASSES_FOLDER / f"{class_id}/content/{lesson_id}.html"  # f"{lesson_id}.html"
+    # Look the lesson up through the class manifest
+    digest = lesson_digest(class_id, lesson_id)
+    if digest is None:
+        return jsonify({"success": False, "message": "Lesson not found"}), 404
+
+    html = read_blob(digest).decode("utf-8")
+    return jsonify({"success": True, "lesson_id": lesson_id, "html": html})
 
-    print(content_path)
 
-    if not content_path.exists():
+@app.route("/lesson-content/<class_id>/<lesson_id>", methods=["GET"])
+def get_lesson_html(class_id, lesson_id):
+    """
+    Serve the lesson HTML itself, like a static file: precompressed when the
+    browser accepts it, and 304 Not Modified while its ETag still matches.
+    """
+    digest = lesson_digest(class_id, lesson_id)
+    if digest is None:
         return jsonify({"success": False, "message": "Lesson not found"}), 404
 
-    with open(content_path, "r", encoding="utf-8") as f:
-        html = f.read()
+    # the first encoding the client accepts, ours in order of preference
+    encoding = next((e for e in VARIANTS if request.accept_encodings[e] > 0), None)
+    # strong ETag per representation; the blob is content-addressed so it never goes stale
+    etag = digest + VARIANTS[encoding][0] if encoding else digest
 
-    return jsonify({"success": True, "lesson_id": lesson_id, "html": html})
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        body = read_variant(digest, encoding) if encoding else read_blob(digest)
+        response = Response(body, mimetype="text/html")
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = f"public, max-age={LESSON_CACHE_MAX_AGE}"
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
 
 
 # for viewing list of students in a class
@@ -406,12 +394,10 @@ def teacher_students():
     if not class_id:
         return jsonify({"success": False, "message": "Missing class_id"}), 400
 
-    meta_file = CLASSES_FOLDER / class_id / "meta.json"
-    if not meta_file.exists():
+    meta = get_storage().get_class_meta(class_id)
+    if meta is None:
         return jsonify({"success": False, "message": "Class not found"}), 404
 
-    with open(meta_file) as f:
-        meta = json.load(f)
     students = meta.get("enrolled_students", [])
 
     print(students)
@@ -430,13 +416,10 @@ def teacher_progress():
     if not class_id:
         return jsonify({"success": False, "message": "Missing class_id"}), 400
 
-    meta_file = CLASSES_FOLDER / class_id / "meta.json"
-    if not meta_file.exists():
+    meta = get_storage().get_class_meta(class_id)
+    if meta is None:
         return jsonify({"success": False, "message": "Class not found"}), 404
 
-    with open(meta_file) as f:
-        meta = json.load(f)
-
     students_progress = {}
     for student_id in meta.get("enrolled_students", []):
         students_progress[student_id] = get_class_progress(student_id, class_id)
@@ -559,13 +542,7 @@ def teacher_classes():
     if not teacher_userid:
         return jsonify({"success": False, "message": "Missing userid"}), 400
 
-    classes_list = []
-    if CLASSES_CSV.exists():
-        with open(CLASSES_CSV, newline="") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if row.get("teacher_id") == teacher_userid:
-                    classes_list.append(row)
+    classes_list = get_storage().list_classes(teacher_id=teacher_userid)
 
     print(classes_list)
 
@@ -582,41 +559,23 @@ def teacher_delete_class():
     if not teacher_userid or not class_id:
         return jsonify({"success": False, "message": "Missing userid or class_id"}), 400
 
-    rows = []
-    deleted = False
-
-    if CLASSES_CSV.exists():
-        with open(CLASSES_CSV, newline="") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if row["class_id"] == class_id:
-                    if row.get("teacher_userid") != teacher_userid:
-                        return jsonify({"success": False, "message": "Not authorized"}), 403
-                    deleted = True
-                    continue
-                rows.append(row)
-
-        with open(CLASSES_CSV, "w", newline="") as f:
-            writer = csv.DictWriter(f, fieldnames=reader.fieldnames)
-            writer.writeheader()
-            writer.writerows(rows)
+    storage = get_storage()
+    class_row = _get_class_row(class_id)
+    if class_row and class_row["teacher_id"] != teacher_userid:
+        return jsonify({"success": False, "message": "Not authorized"}), 403
 
     # Load meta.json to remove student references
-    meta_file = CLASSES_FOLDER / class_id / "meta.json"
-    if meta_file.exists():
-        with open(meta_file) as f:
-            meta = json.load(f)
-
-        # Remove class from each student's enrolled classes
-        for student_id in meta.get("enrolled_students", []):
-            student_class_folder = USERSFOLDER / student_id / "classes" / class_id
-            if student_class_folder.exists():
-                shutil.rmtree(student_class_folder)
-
-    # Delete the class folder itself
-    class_folder = CLASSES_FOLDER / class_id
-    if class_folder.exists():
-        shutil.rmtree(class_folder)
+    with class_meta_lock(class_id):
+        meta = storage.get_class_meta(class_id) or {}
+
+    # Remove class from each student's enrolled classes
+    for student_id in meta.get("enrolled_students", []):
+        with progress_lock(student_id, class_id):
+            storage.delete_progress(student_id, class_id)
+
+    # Delete the class row, meta and template
+    with class_meta_lock(class_id):
+        deleted = storage.delete_class(class_id)
 
     if deleted:
         return jsonify({"success": True, "message": f"Class {class_id} deleted"})
@@ -632,11 +591,10 @@ def parent_students():
     if not parent_id:
         return jsonify({"success": False, "message": "Missing parent_userid"}), 400
 
-    profile_file = USERSFOLDER / parent_id / "profile.json"
-    if not profile_file.exists():
+    profile = get_storage().get_profile(parent_id)
+    if profile is None:
         return jsonify({"success": False, "message": "Parent profile not found"}), 404
 
-    profile = load_json(profile_file)
     student_ids = profile.get("student_ids", [])
 
     return jsonify({"success": True, "students": student_ids})
@@ -674,40 +632,32 @@ def update_question():
     except (ValueError, TypeError):
         time_taken = 0
 
-    progress_file = USERSFOLDER / userid / "classes" / class_id / "progress.json"
-    if not progress_file.exists():
+    # no lock for the checks, record_answer() takes it (a record for a question
+    # that is gone by then is skipped when the journal is folded)
+    storage = get_storage()
+    progress = storage.read_progress(userid, class_id)
+    if progress is None:
         return jsonify({"success": False, "message": "Progress not found"}), 404
 
-    progress = load_json(progress_file)
     lesson = progress["lessons"].get(lesson_id)
     if not lesson:
         return jsonify({"success": False, "message": "Lesson not found"}), 404
 
-    found = False
-    for lvl, questions in lesson["questions"].items():
-        for q in questions:
-            if q["id"] == question_id:
-                q["correct"] = bool(correct)
-                q["time_taken"] = time_taken
-                found = True
-                break
-        if found:
-            break
-
+    found = any(
+        q["id"] == question_id for questions in lesson["questions"].values() for q in questions
+    )
     if not found:
         return jsonify({"success": False, "message": "Question not found"}), 404
 
-    write_json(progress_file, progress)
-    return jsonify({"success": True, "message": f"Question {question_id} updated", "time_taken": time_taken})
+    # append to the answer journal instead of rewriting progress.json
+    storage.record_answer(userid, class_id, lesson_id, question_id, correct, time_taken)
 
-
-
-def write_json_atomic(path: Path, data):
-    """Write JSON atomically using a temporary file."""
-    temp_path = path.with_suffix(".tmp")
-    with open(temp_path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
-    os.replace(temp_path, path)  # atomic on most OS
+    # far enough into the lesson, start theming the next one (see prefetch.py)
+    try:
+        maybe_prefetch_next_lesson(userid, class_id, lesson_id)
+    except Exception as e:
+        print(f"[WARN] Prefetching the lesson after {lesson_id} for {userid} failed: {e}")
+    return jsonify({"success": True, "message": f"Question {question_id} updated", "time_taken": time_taken})
 
 
 # mark a lesson as complete, will unlock the next one if it exists
@@ -729,41 +679,48 @@ def complete_lesson():
             {"success": False, "message": "Missing userid, class_id, or lesson_id"}
         ), 400
 
-    progress_file = USERSFOLDER / userid / "classes" / class_id / "progress.json"
-    if not progress_file.exists():
-        return jsonify({"success": False, "message": "Progress not found"}), 404
-    profile_file = USERSFOLDER / userid / "profile.json"
-    if not profile_file.exists():
+    storage = get_storage()
+    profile = storage.get_profile(userid)
+    if profile is None:
         return jsonify({"success": False, "message": "Profile not found"}), 404
 
-    progress = load_json(progress_file)
-    profile = load_json(profile_file)
-    lesson_keys = list(progress["lessons"].keys())
+    with progress_lock(userid, class_id):
+        progress = storage.get_progress(userid, class_id)
+        if progress is None:
+            return jsonify({"success": False, "message": "Progress not found"}), 404
 
-    if lesson_id not in lesson_keys:
-        return jsonify({"success": False, "message": "Lesson not found"}), 404
+        lesson_keys = list(progress["lessons"].keys())
 
-    # Mark this lesson as completed
-    lesson = progress["lessons"][lesson_id]
-    lesson["completed"] = True
+        if lesson_id not in lesson_keys:
+            return jsonify({"success": False, "message": "Lesson not found"}), 404
 
-    # Unlock the next lesson (if any)
-    unlocked_lesson_id = None
-    idx = lesson_keys.index(lesson_id)
-    if idx + 1 < len(lesson_keys):
-        next_lesson_id = lesson_keys[idx + 1]
-        progress["lessons"][next_lesson_id]["unlocked"] = True
-        unlocked_lesson_id = next_lesson_id
+        # Mark this lesson as completed
+        lesson = progress["lessons"][lesson_id]
+        lesson["completed"] = True
 
-    # Atomic write
-    write_json_atomic(progress_file, progress)
+        # Unlock the next lesson (if any)
+        unlocked_lesson_id = None
+        prefetch = None
+        idx = lesson_keys.index(lesson_id)
+        if idx + 1 < len(lesson_keys):
+            next_lesson_id = lesson_keys[idx + 1]
+            next_lesson = progress["lessons"][next_lesson_id]
+            if not next_lesson.get("unlocked"):
+                # questions themed ahead of time go in with the unlock
+                prefetch = swap_in_prefetched(next_lesson, profile["theme"])
+            next_lesson["unlocked"] = True
+            unlocked_lesson_id = next_lesson_id
 
-    question_theme = profile["theme"]
-    generate_practice_problems(userid, class_id, unlocked_lesson_id, question_theme)
+        # Atomic write
+        storage.save_progress(userid, class_id, progress)
 
     resp = {"success": True, "completed_lesson": lesson_id}
     if unlocked_lesson_id:
+        # theme the next lesson in the background; its base questions show until the job is done
+        resp["theming_job"] = enqueue_theming(userid, class_id, unlocked_lesson_id, profile["theme"])
         resp["unlocked_lesson"] = unlocked_lesson_id
+        if prefetch:
+            resp["prefetch"] = prefetch
         resp["message"] = (
             f"Lesson {lesson_id} completed, next lesson {unlocked_lesson_id} unlocked"
         )
@@ -779,14 +736,92 @@ def get_progress():
     userid = request.args.get("userid")
     class_id = request.args.get("class_id")
 
-    progress_file = USERSFOLDER / userid / "classes" / class_id / "progress.json"
-    if not progress_file.exists():
+    progress = get_storage().read_progress(userid, class_id)
+    if progress is None:
         return jsonify({"success": False, "message": "Progress not found"}), 404
 
-    progress = load_json(progress_file)
     return jsonify({"success": True, "progress": progress})
 
 
+@app.route("/student/lesson-questions", methods=["GET"])
+def lesson_questions():
+    """
+    One lesson's questions while they are being themed: which ones are
+    themed so far and whether theming is still running. Poll it after
+    complete-lesson instead of fetching the whole progress.
+    """
+    userid = request.args.get("userid")
+    class_id = request.args.get("class_id")
+    lesson_id = request.args.get("lesson_id")
+    if not userid or not class_id or not lesson_id:
+        return jsonify({"success": False, "message": "Missing userid, class_id or lesson_id"}), 400
+
+    progress = get_storage().read_progress(userid, class_id)
+    if progress is None:
+        return jsonify({"success": False, "message": "Progress not found"}), 404
+    lesson = progress["lessons"].get(lesson_id)
+    if lesson is None:
+        return jsonify({"success": False, "message": "Lesson not found"}), 404
+
+    questions = [q for level in lesson.get("questions", {}).values() for q in level]
+    themed_ids = [q["id"] for q in questions if q.get("themed")]
+    return jsonify({
+        "success": True,
+        "lesson_id": lesson_id,
+        "theming": lesson.get("theming", "not_started"),
+        "themed": len(themed_ids),
+        "total": len(questions),
+        "themed_ids": themed_ids,
+        "questions": lesson.get("questions", {}),
+    })
+
+
+def _question_details_request():
+    """(question, error response) for /student/hint and /student/solution."""
+    data = request.get_json() or {}
+    userid = data.get("userid")
+    class_id = data.get("class_id")
+    lesson_id = data.get("lesson_id")
+    question_id = data.get("question_id")
+    if None in [userid, class_id, lesson_id, question_id]:
+        return None, (jsonify({"success": False, "message": "Missing required fields"}), 400)
+
+    question = question_details(userid, class_id, lesson_id, question_id)
+    if question is None:
+        return None, (jsonify({"success": False, "message": "Question not found"}), 404)
+    return question, None
+
+
+@app.route("/student/hint", methods=["POST"])
+def student_hint():
+    """
+    Hints for one question. Themed questions get theirs written the first
+    time a student asks (shared with everyone who gets the same question).
+    Expected JSON: {"userid", "class_id", "lesson_id", "question_id"}
+    """
+    question, error = _question_details_request()
+    if error:
+        return error
+    return jsonify({"success": True, "question_id": question["id"], "hints": question.get("hints", [])})
+
+
+@app.route("/student/solution", methods=["POST"])
+def student_solution():
+    """
+    Step-by-step solution for one question, written on first request like
+    the hints. Expected JSON: {"userid", "class_id", "lesson_id", "question_id"}
+    """
+    question, error = _question_details_request()
+    if error:
+        return error
+    return jsonify({
+        "success": True,
+        "question_id": question["id"],
+        "solution": question["solution"],
+        "solution_feedback": question.get("solution_feedback"),
+    })
+
+
 @app.route("/parent/add-student", methods=["POST"])
 def parent_add_student():
     data = request.get_json() or {}
@@ -798,19 +833,19 @@ def parent_add_student():
             {"success": False, "message": "Missing parent_userid or student_id"}
         ), 400
 
-    profile_file = USERSFOLDER / parent_id / "profile.json"
-    if not profile_file.exists():
-        return jsonify({"success": False, "message": "Parent profile not found"}), 404
+    with profile_lock(parent_id):
+        profile = get_storage().get_profile(parent_id)
+        if profile is None:
+            return jsonify({"success": False, "message": "Parent profile not found"}), 404
 
-    profile = load_json(profile_file)
-    student_ids = profile.get("student_ids", [])
+        student_ids = profile.get("student_ids", [])
 
-    if student_id in student_ids:
-        return jsonify({"success": False, "message": "Student already added"}), 400
+        if student_id in student_ids:
+            return jsonify({"success": False, "message": "Student already added"}), 400
 
-    student_ids.append(student_id)
-    profile["student_ids"] = student_ids
-    write_json(profile_file, profile)
+        student_ids.append(student_id)
+        profile["student_ids"] = student_ids
+        get_storage().save_profile(parent_id, profile)
 
     return jsonify({"success": True, "message": f"Student {student_id} added"})
 
@@ -826,19 +861,19 @@ def parent_remove_student():
             {"success": False, "message": "Missing parent_userid or student_id"}
         ), 400
 
-    profile_file = USERSFOLDER / parent_id / "profile.json"
-    if not profile_file.exists():
-        return jsonify({"success": False, "message": "Parent profile not found"}), 404
+    with profile_lock(parent_id):
+        profile = get_storage().get_profile(parent_id)
+        if profile is None:
+            return jsonify({"success": False, "message": "Parent profile not found"}), 404
 
-    profile = load_json(profile_file)
-    student_ids = profile.get("student_ids", [])
+        student_ids = profile.get("student_ids", [])
 
-    if student_id not in student_ids:
-        return jsonify({"success": False, "message": "Student not in parent list"}), 400
+        if student_id not in student_ids:
+            return jsonify({"success": False, "message": "Student not in parent list"}), 400
 
-    student_ids.remove(student_id)
-    profile["student_ids"] = student_ids
-    write_json(profile_file, profile)
+        student_ids.remove(student_id)
+        profile["student_ids"] = student_ids
+        get_storage().save_profile(parent_id, profile)
 
     return jsonify({"success": True, "message": f"Student {student_id} removed"})
 
@@ -851,11 +886,10 @@ def parent_students_progress():
     if not parent_id:
         return jsonify({"success": False, "message": "Missing parent_userid"}), 400
 
-    profile_file = USERSFOLDER / parent_id / "profile.json"
-    if not profile_file.exists():
+    profile = get_storage().get_profile(parent_id)
+    if profile is None:
         return jsonify({"success": False, "message": "Parent profile not found"}), 404
 
-    profile = load_json(profile_file)
     student_ids = profile.get("student_ids", [])
 
     students_progress = []
@@ -880,14 +914,8 @@ def parent_students_progress():
                 )
                 continue
 
-            progress_file = (
-                    USERSFOLDER / student_id / "classes" / class_id / "progress.json"
-            )
-            if progress_file.exists():
-                progress = load_json(progress_file)
-                progress_per_class[class_id] = progress
-            else:
-                progress_per_class[class_id] = None  # No progress yet
+            # None if there's no progress yet
+            progress_per_class[class_id] = get_storage().read_progress(student_id, class_id)
 
         students_progress.append(
             {
@@ -903,43 +931,9 @@ def parent_students_progress():
 # ---------- Leaderboard helpers + route (UPDATED) ----------
 
 
-def _compute_points_from_progress(progress: dict) -> int:
-    """
-    Shared scoring logic:
-    - 1 point per correct 'easy' question
-    - 2 points per correct 'medium' question
-    - 3 points per correct 'hard' question
-    """
-    lessons = progress.get("lessons", {})
-    total_points = 0
-
-    for lesson in lessons.values():
-        questions_by_level = lesson.get("questions", {})
-        for level, questions in questions_by_level.items():
-            if level == "easy":
-                weight = 1
-            elif level == "medium":
-                weight = 2
-            else:  # "hard" or anything else
-                weight = 3
-
-            for q in questions:
-                if q.get("correct") is True:
-                    total_points += weight
-
-    return total_points
-
-
 def _get_class_row(class_id: str):
-    """Return the row from CLASSES_CSV for a given class_id, or None."""
-    if not CLASSES_CSV.exists():
-        return None
-    with open(CLASSES_CSV, newline="") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            if row.get("class_id") == class_id:
-                return row
-    return None
+    """Return the class row for a given class_id, or None. Rows always use classid / teacher_id."""
+    return get_storage().get_class(class_id)
 
 
 @app.route("/leaderboard", methods=["GET"])
@@ -951,96 +945,65 @@ def leaderboard():
     If class_id is NOT provided:
       -> global leaderboard across ALL student accounts, summing
          points from all their classes.
-    """
-    class_id = request.args.get("class_id")
 
-    # Load auth table to map userid -> (username, role)
-    auth_rows = []
-    userid_to_username = {}
-
-    if AUTH_TABLE.exists():
-        with open(AUTH_TABLE, newline="") as f:
-            reader = csv.DictReader(f)
-            auth_rows = list(reader)
-            for row in auth_rows:
-                uid = row.get("userid") or row.get("user_id") or row.get("id")
-                if not uid:
-                    continue
-                userid_to_username[uid] = row.get("username", uid)
-
-    def compute_points_for_class(userid: str, cid: str) -> int:
-        progress_file = USERSFOLDER / userid / "classes" / cid / "progress.json"
-        if not progress_file.exists():
-            return 0
-        progress = load_json(progress_file)
-        return _compute_points_from_progress(progress)
-
-    def compute_points_global(userid: str) -> int:
-        """
-        Sum points across ALL classes for a user.
-        """
-        user_classes_dir = USERSFOLDER / userid / "classes"
-        if not user_classes_dir.exists():
-            return 0
-
-        total = 0
-        for class_dir in user_classes_dir.iterdir():
-            if not class_dir.is_dir():
-                continue
-            progress_file = class_dir / "progress.json"
-            if not progress_file.exists():
-                continue
-            progress = load_json(progress_file)
-            total += _compute_points_from_progress(progress)
-        return total
+    Optional:
+      ?limit=K&offset=N  -> one page of the ranking (default: everyone)
+      ?userid=...        -> also return that student's own rank as "me"
+      ?window=today|week|term|7d, or ?start=YYYY-MM-DD&end=YYYY-MM-DD
+                         -> rank by points won in that window instead of all time
 
-    leaderboard_rows = []
+    Totals come from the leaderboard view (leaderboard.py), which is kept up
+    to date as answers are recorded, so no progress files are read here.
+    """
+    class_id = request.args.get("class_id")
+    userid = request.args.get("userid")
+    try:
+        offset = max(int(request.args.get("offset", 0)), 0)
+        limit = request.args.get("limit")
+        limit = max(int(limit), 0) if limit is not None else None
+    except ValueError:
+        return jsonify({"success": False, "message": "limit and offset must be integers"}), 400
+
+    window, start, end = request.args.get("window"), request.args.get("start"), request.args.get("end")
+    days = None
+    if window or start or end:
+        try:
+            days = window_days(window, start, end)
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+
+    storage = get_storage()
+
+    def username_for(uid: str) -> str:
+        row = storage.get_user_by_id(uid)
+        return row.get("username", uid) if row else uid
 
     # ----- CLASS-SPECIFIC LEADERBOARD -----
     if class_id:
-        meta_file = CLASSES_FOLDER / class_id / "meta.json"
-        if not meta_file.exists():
+        meta = storage.get_class_meta(class_id)
+        if meta is None:
             return jsonify({"success": False, "message": "Class not found"}), 404
 
-        meta = load_json(meta_file)
-        student_ids = meta.get("enrolled_students", [])
-
-        for sid in student_ids:
-            points = compute_points_for_class(sid, class_id)
-            leaderboard_rows.append(
-                {
-                    "userid": sid,
-                    "username": userid_to_username.get(sid, sid),
-                    "points": points,
-                }
-            )
-
-    # ----- GLOBAL LEADERBOARD (all students) -----
-    else:
-        for row in auth_rows:
-            role = (row.get("role") or "").upper()
-            if role != "STUDENT":
-                continue
-
-            uid = row.get("userid") or row.get("user_id") or row.get("id")
-            if not uid:
-                continue
-
-            username = row.get("username", uid)
-            points = compute_points_global(uid)
-
-            leaderboard_rows.append(
-                {
-                    "userid": uid,
-                    "username": username,
-                    "points": points,
-                }
-            )
-
+    # ----- GLOBAL LEADERBOARD (all students) when class_id is None -----
     # Highest score first
-    leaderboard_rows.sort(key=lambda r: r["points"], reverse=True)
-
-    return jsonify({"success": True, "leaderboard": leaderboard_rows})
+    total, leaderboard_rows, me = storage.leaderboard.page(class_id, offset, limit, days=days, userid=userid)
+    for row in leaderboard_rows:
+        row["username"] = username_for(row["userid"])
+
+    response = {
+        "success": True,
+        "leaderboard": leaderboard_rows,
+        "total": total,
+        "offset": offset,
+        "limit": limit,
+    }
+    if days is not None:
+        response["window"] = {"start": iso_day(days[0]), "end": iso_day(days[1])}
+    if userid:
+        if me is not None:
+            me["username"] = username_for(userid)
+        response["me"] = me
+    return jsonify(response)
 
 
 @app.route("/teacher/set-deadline", methods=["POST"])
@@ -1069,19 +1032,19 @@ def teacher_set_deadline():
     if not class_row:
         return jsonify({"success": False, "message": "Class not found"}), 404
 
-    if class_row.get("teacher_userid") != teacher_userid:
+    if class_row["teacher_id"] != teacher_userid:
         return jsonify({"success": False, "message": "Not authorized"}), 403
 
-    meta_file = CLASSES_FOLDER / class_id / "meta.json"
-    if not meta_file.exists():
-        return jsonify({"success": False, "message": "Class meta not found"}), 404
+    with class_meta_lock(class_id):
+        meta = get_storage().get_class_meta(class_id)
+        if meta is None:
+            return jsonify({"success": False, "message": "Class meta not found"}), 404
 
-    meta = load_json(meta_file)
-    deadlines = meta.get("deadlines", {})
-    deadlines[lesson_id] = deadline
-    meta["deadlines"] = deadlines
+        deadlines = meta.get("deadlines", {})
+        deadlines[lesson_id] = deadline
+        meta["deadlines"] = deadlines
 
-    write_json(meta_file, meta)
+        get_storage().save_class_meta(class_id, meta)
 
     return jsonify({"success": True, "message": "Deadline updated", "deadlines": deadlines})
 
@@ -1103,16 +1066,56 @@ def teacher_class_meta():
     if not class_row:
         return jsonify({"success": False, "message": "Class not found"}), 404
 
-    if class_row.get("teacher_userid") != teacher_userid:
+    if class_row["teacher_id"] != teacher_userid:
         return jsonify({"success": False, "message": "Not authorized"}), 403
 
-    meta_file = CLASSES_FOLDER / class_id / "meta.json"
-    if not meta_file.exists():
+    meta = get_storage().get_class_meta(class_id)
+    if meta is None:
         return jsonify({"success": False, "message": "Meta not found"}), 404
 
-    meta = load_json(meta_file)
     return jsonify({"success": True, "meta": meta})
 
 
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    """Poll a background job, e.g. the theming_job returned by /student/complete-lesson."""
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Job not found"}), 404
+
+    return jsonify({
+        "success": True,
+        "job": {
+            "id": job["id"],
+            "kind": job["kind"],
+            "status": job["status"],
+            "attempts": job["attempts"],
+            "max_attempts": job["max_attempts"],
+            "created_at": job["created_at"],
+            "updated_at": job["updated_at"],
+            "result": job["result"],
+            "error": job["error"],
+        },
+    })
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Runtime counters for this worker process."""
+    return jsonify({
+        "success": True,
+        "locks": lock_stats(),
+        "writes": get_writer().stats(),
+        "progress_cache": get_storage().progress_cache.stats(),
+        "leaderboard": get_storage().leaderboard.stats(),
+        "jobs": get_queue().stats(),
+        "theme_cache": get_theme_cache().stats(),
+        "llm": get_dispatcher().stats(),
+        "theming": theming_stats.stats(),
+        "prefetch": prefetch_stats.stats(),
+        "theme_batches": get_theme_batcher().stats(),
+    })
+
+
 if __name__ == "__main__":
     app.run(debug=True)
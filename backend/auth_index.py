@@ -0,0 +1,124 @@
+"""
+In-memory index over auth_table.csv.
+
+The table is loaded once into dicts keyed by username, userid and role.
+Every lookup stats the file and reloads only if its mtime/size changed
+(someone edited it outside this process). Writes made through the index
+update it in place and remember the new mtime/size, so they never force
+a reload.
+"""
+
+import csv
+import os
+import threading
+from pathlib import Path
+
+from locks import lock
+
+AUTH_FIELDS = [
+    "userid", "username", "hashed_password", "role",
+    "question1", "answer1_hash",
+    "question2", "answer2_hash",
+    "question3", "answer3_hash",
+    "parent_id",
+]
+
+
+class AuthIndex:
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._stamp = None
+        self.reloads = 0
+        self.fieldnames = list(AUTH_FIELDS)
+        self.by_username = {}
+        self.by_userid = {}
+        self.by_role = {}
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _index(self, row: dict):
+        self.by_username[row["username"]] = row
+        self.by_userid[row["userid"]] = row
+        role = (row.get("role") or "").upper()
+        self.by_role.setdefault(role, {})[row["userid"]] = row
+
+    def _refresh(self):
+        stamp = self._file_stamp()
+        if stamp == self._stamp:
+            return
+
+        self.by_username, self.by_userid, self.by_role = {}, {}, {}
+        self.fieldnames = list(AUTH_FIELDS)
+        if stamp is not None:
+            with open(self.path, newline="") as f:
+                reader = csv.DictReader(f)
+                self.fieldnames = reader.fieldnames or self.fieldnames
+                for row in reader:
+                    self._index(row)
+        self._stamp = stamp
+        self.reloads += 1
+
+    # ---------- reads ----------
+
+    def get_by_username(self, username: str):
+        with self._lock:
+            self._refresh()
+            row = self.by_username.get(username)
+            return dict(row) if row else None
+
+    def get_by_userid(self, userid: str):
+        with self._lock:
+            self._refresh()
+            row = self.by_userid.get(userid)
+            return dict(row) if row else None
+
+    def list(self, role: str = None) -> list:
+        with self._lock:
+            self._refresh()
+            if role:
+                rows = self.by_role.get(role.upper(), {}).values()
+            else:
+                rows = self.by_userid.values()
+            return [dict(r) for r in rows]
+
+    # ---------- writes ----------
+
+    def add(self, row: dict):
+        """Append a user to the CSV and the index."""
+        with lock("auth_table"), self._lock:
+            self._refresh()
+            write_header = self._stamp is None
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", newline="") as f:
+                writer = csv.writer(f)
+                if write_header:
+                    writer.writerow(self.fieldnames)
+                writer.writerow([row.get(k) or "" for k in self.fieldnames])
+
+            self._index({k: row.get(k) or "" for k in self.fieldnames})
+            self._stamp = self._file_stamp()
+
+    def set_password(self, username: str, hashed_pw: str) -> bool:
+        """Rewrite the CSV with a new password for one user, updating the index in place."""
+        with lock("auth_table"), self._lock:
+            self._refresh()
+            row = self.by_username.get(username)
+            if row is None:
+                return False
+            row["hashed_password"] = hashed_pw
+
+            temp_path = self.path.with_suffix(".tmp")
+            with open(temp_path, "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=self.fieldnames, extrasaction="ignore")
+                writer.writeheader()
+                writer.writerows(self.by_userid.values())
+            os.replace(temp_path, self.path)
+
+            self._stamp = self._file_stamp()
+            return True
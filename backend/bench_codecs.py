@@ -0,0 +1,60 @@
+"""
+Bytes on disk and encode/decode time per codec, measured on the real
+progress files under users/.
+
+    python bench_codecs.py [paths...]
+"""
+
+import sys
+import time
+from pathlib import Path
+
+from helpers import load_json
+from serialization import available_codecs, encode, decode
+
+
+def _load_documents(paths: list) -> list:
+    docs = []
+    for root in map(Path, paths):
+        files = [root] if root.is_file() else root.rglob("progress.json")
+        for path in files:
+            try:
+                docs.append(load_json(path))
+            except ValueError:
+                continue
+    return docs
+
+
+def bench(docs: list, repeat: int = 5) -> dict:
+    results = {}
+    for codec in available_codecs():
+        encoded = [encode(d, codec) for d in docs]
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for d in docs:
+                encode(d, codec)
+        encode_ms = (time.perf_counter() - start) / repeat * 1000
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for raw in encoded:
+                decode(raw)
+        decode_ms = (time.perf_counter() - start) / repeat * 1000
+
+        results[codec] = {
+            "bytes": sum(len(raw) for raw in encoded),
+            "encode_ms": encode_ms,
+            "decode_ms": decode_ms,
+        }
+    return results
+
+
+if __name__ == "__main__":
+    docs = _load_documents(sys.argv[1:] or ["users"])
+    results = bench(docs)
+
+    print(f"{len(docs)} progress documents")
+    print(f"{'codec':<20}{'bytes':>12}{'encode (ms)':>14}{'decode (ms)':>14}")
+    for codec, r in results.items():
+        print(f"{codec:<20}{r['bytes']:>12}{r['encode_ms']:>14.2f}{r['decode_ms']:>14.2f}")
@@ -0,0 +1,63 @@
+"""
+Side by side timing of the storage backends on the current users/ data.
+
+    python migrate_storage.py /tmp/bench.sqlite3
+    python bench_storage.py /tmp/bench.sqlite3
+
+Progress writes store back what was read, so the data is left unchanged.
+"""
+
+import sys
+import time
+from pathlib import Path
+
+from constants import SQLITE_DB
+from storage import FileStorage, SQLiteStorage
+
+
+def _time(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def bench(storage, repeat: int = 20) -> dict:
+    users = storage.list_users()
+    students = [u for u in users if (u.get("role") or "").upper() == "STUDENT"]
+    enrolments = [(s["userid"], cid) for s in students for cid in storage.list_user_class_ids(s["userid"])]
+
+    def login_lookups():
+        for u in users:
+            storage.get_user_by_username(u["username"])
+
+    def read_all_progress():
+        for userid, cid in enrolments:
+            storage.get_progress(userid, cid)
+
+    def write_all_progress():
+        for userid, cid in enrolments:
+            progress = storage.get_progress(userid, cid)
+            if progress is not None:
+                storage.save_progress(userid, cid, progress)
+
+    def profiles():
+        for s in students:
+            storage.get_profile(s["userid"])
+            storage.list_user_class_ids(s["userid"])
+
+    return {
+        "login lookups": _time(login_lookups, repeat),
+        "read all progress": _time(read_all_progress, repeat),
+        "rewrite all progress": _time(write_all_progress, max(1, repeat // 4)),
+        "profile + classes": _time(profiles, repeat),
+    }
+
+
+if __name__ == "__main__":
+    db_path = Path(sys.argv[1]) if len(sys.argv) > 1 else SQLITE_DB
+    results = {"file": bench(FileStorage()), "sqlite": bench(SQLiteStorage(db_path))}
+
+    print(f"{'operation':<24}{'file (ms)':>12}{'sqlite (ms)':>14}")
+    for op in results["file"]:
+        print(f"{op:<24}{results['file'][op]:>12.2f}{results['sqlite'][op]:>14.2f}")
@@ -0,0 +1,149 @@
+"""
+In-memory registry over classes.csv.
+
+Rows are indexed by class id and by teacher id. Like AuthIndex, the file
+is reloaded only when its mtime/size changed behind our back; adds are
+appended to the CSV and applied to the indexes in place, deletes rewrite
+the file once and update the indexes.
+
+Older rows and callers disagree on column names (classid / class_id,
+teacher_id / teacher_userid). normalize_class_row() maps every row onto
+CLASS_FIELDS so callers only ever see classid and teacher_id.
+"""
+
+import csv
+import os
+import threading
+from pathlib import Path
+
+from locks import lock
+
+CLASS_FIELDS = ["classid", "class_name", "teacher_id", "description", "created_at"]
+
+# alternative spellings found in older rows and callers
+COLUMN_ALIASES = {
+    "class_id": "classid",
+    "teacher_userid": "teacher_id",
+}
+
+
+def normalize_class_row(row: dict) -> dict:
+    normalized = {}
+    for key, value in row.items():
+        if key is None:
+            continue  # extra trailing values on a row
+        key = COLUMN_ALIASES.get(key, key)
+        if normalized.get(key) in (None, ""):
+            normalized[key] = value
+    for key in CLASS_FIELDS:
+        value = normalized.get(key)
+        normalized[key] = "" if value is None else str(value)
+    return normalized
+
+
+class ClassRegistry:
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._stamp = None
+        self.reloads = 0
+        self.fieldnames = list(CLASS_FIELDS)
+        self.by_classid = {}
+        self.by_teacher = {}
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _index(self, row: dict):
+        # a later row for the same class replaces the earlier one
+        self._unindex(row["classid"])
+        self.by_classid[row["classid"]] = row
+        self.by_teacher.setdefault(row["teacher_id"], {})[row["classid"]] = row
+
+    def _unindex(self, class_id: str):
+        row = self.by_classid.pop(class_id, None)
+        if row is not None:
+            self.by_teacher.get(row["teacher_id"], {}).pop(class_id, None)
+        return row
+
+    def _refresh(self):
+        stamp = self._file_stamp()
+        if stamp == self._stamp:
+            return
+
+        self.by_classid, self.by_teacher = {}, {}
+        self.fieldnames = list(CLASS_FIELDS)
+        if stamp is not None:
+            with open(self.path, newline="", encoding="utf-8") as f:
+                reader = csv.DictReader(f)
+                self.fieldnames = reader.fieldnames or self.fieldnames
+                for row in reader:
+                    self._index(normalize_class_row(row))
+        self._stamp = stamp
+        self.reloads += 1
+
+    # ---------- reads ----------
+
+    def get(self, class_id: str):
+        with self._lock:
+            self._refresh()
+            row = self.by_classid.get(class_id)
+            return dict(row) if row else None
+
+    def get_many(self, class_ids: list) -> list:
+        """Rows for the given ids, in that order, skipping unknown ids."""
+        with self._lock:
+            self._refresh()
+            return [dict(self.by_classid[c]) for c in class_ids if c in self.by_classid]
+
+    def list(self, teacher_id: str = None) -> list:
+        with self._lock:
+            self._refresh()
+            if teacher_id is not None:
+                rows = self.by_teacher.get(str(teacher_id), {}).values()
+            else:
+                rows = self.by_classid.values()
+            return [dict(r) for r in rows]
+
+    # ---------- writes ----------
+
+    def _csv_row(self, row: dict) -> dict:
+        # write under whatever column names the file already uses
+        return {name: row.get(COLUMN_ALIASES.get(name, name), "") for name in self.fieldnames}
+
+    def add(self, row: dict):
+        """Append a class to the CSV and the indexes."""
+        row = normalize_class_row(row)
+        with lock("classes_csv"), self._lock:
+            self._refresh()
+            write_header = self._stamp is None
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", newline="", encoding="utf-8") as f:
+                writer = csv.DictWriter(f, fieldnames=self.fieldnames, extrasaction="ignore")
+                if write_header:
+                    writer.writeheader()
+                writer.writerow(self._csv_row(row))
+
+            self._index(row)
+            self._stamp = self._file_stamp()
+
+    def delete(self, class_id: str) -> bool:
+        """Drop a class from the indexes and rewrite the CSV without it."""
+        with lock("classes_csv"), self._lock:
+            self._refresh()
+            if self._unindex(class_id) is None:
+                return False
+
+            temp_path = self.path.with_suffix(".tmp")
+            with open(temp_path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.DictWriter(f, fieldnames=self.fieldnames, extrasaction="ignore")
+                writer.writeheader()
+                writer.writerows(self._csv_row(r) for r in self.by_classid.values())
+            os.replace(temp_path, self.path)
+
+            self._stamp = self._file_stamp()
+            return True
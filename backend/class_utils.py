@@ -1,4 +1,4 @@
-from constants import QUESTION_GENERATORS
+from constants import QUESTION_GENERATORS, DEFAULT_CLASS_ID
 
 # Where we will store the default math template JSON
 DEFAULT_MATH_TEMPLATE = QUESTION_GENERATORS / "default_math_template.json"
@@ -7,11 +7,14 @@ import uuid
 import random
 from copy import deepcopy
 from datetime import datetime
-from shutil import copy2
 
-from constants import USERSFOLDER, CLASSES_CSV, CLASSES_FOLDER, HTML_CONTENT_SRC
-from helpers import append_csv, write_json, load_json, generate_practice_problems
+from content_store import default_manifest
+from helpers import generate_practice_problems
+from jobs import enqueue, register_handler
+from storage import get_storage
+from locks import progress_lock, class_meta_lock
 from ml_algo_mmr import assign_mmr_for_lesson
+from QuestionGenerators import generate_student_questions
 
 
 # def normalize_template(template_json):
@@ -198,26 +201,64 @@ def normalize_template(template_json):
 #             meta.setdefault("enrolled_students", []).append(userid)
 #             write_json(meta_file, meta)
 
+def resolve_class_template(userid: str, class_id: str):
+    """
+    The class template as this student sees it: the shared template with the
+    student's overlay (their own question instances per lesson) applied.
+    """
+    storage = get_storage()
+    template_json = storage.get_class_template(class_id)
+    if template_json is None:
+        return None
+
+    overlay = storage.get_class_overlay(userid, class_id)
+    if not overlay:
+        return template_json
+
+    template_json = deepcopy(template_json)
+    for lesson_id, questions in overlay.get("questions", {}).items():
+        if lesson_id in template_json:
+            template_json[lesson_id]["questions"] = questions
+    return template_json
+
+
+def make_question_overlay(template_questions: dict) -> dict:
+    """Overlay holding only a student's own questions, in the normalized template format."""
+    normalized = normalize_template(template_questions)
+    return {"questions": {lesson_id: lesson["questions"] for lesson_id, lesson in normalized.items()}}
+
+
+def ensure_default_class() -> str:
+    """Create the shared default math class the first time it's needed."""
+    storage = get_storage()
+    if storage.get_class_template(DEFAULT_CLASS_ID) is not None:
+        return DEFAULT_CLASS_ID
+
+    with class_meta_lock(DEFAULT_CLASS_ID):
+        # someone else may have created it while we waited
+        if storage.get_class_template(DEFAULT_CLASS_ID) is None:
+            register_class("default_math", teacher_userid=0, description="Default math class",
+                           template_questions=generate_student_questions(DEFAULT_CLASS_ID),
+                           copy_default_html=True, class_id=DEFAULT_CLASS_ID)
+    return DEFAULT_CLASS_ID
+
+
 def create_questions_for_student(userid: str, class_id: str):
     """
     Generate progress.json for a student using a lesson-only structure:
       - correct / time_taken / rating (MMR)
       - first lesson unlocked
     """
-    class_folder = CLASSES_FOLDER / class_id
-    student_class_folder = USERSFOLDER / userid / "classes" / class_id
-    student_class_folder.mkdir(parents=True, exist_ok=True)
+    storage = get_storage()
 
-    template_file = class_folder / "template.json"
-    if not template_file.exists():
+    template_json = resolve_class_template(userid, class_id)
+    if template_json is None:
         raise ValueError(f"Template not found for class {class_id}")
-    profile_file = USERSFOLDER / userid / "profile.json"
-    if not profile_file.exists():
+    profile_json = storage.get_profile(userid)
+    if profile_json is None:
         raise ValueError(f"Profile not found for user {userid}")
 
-    template_json = load_json(template_file)
     student_progress = {"lessons": {}}
-    profile_json = load_json(profile_file)
     question_theme = profile_json["theme"]
 
     # Track whether it's the first lesson to unlock
@@ -251,55 +292,55 @@ def create_questions_for_student(userid: str, class_id: str):
         student_progress["lessons"][lesson_id] = student_lesson
 
     # Save progress
-    write_json(student_class_folder / "progress.json", student_progress)
+    with progress_lock(userid, class_id):
+        storage.save_progress(userid, class_id, student_progress)
 
     # cannot hard code adding here, this is because if a teacher uploads their own lesson this doesnt work.
     # generate_practice_problems(userid, class_id, "Adding", question_theme)
 
-    # generate questions for first lesson id
+    # theme questions for the first lesson in the background, the base questions are usable meanwhile
     for lesson_id in student_progress["lessons"]:
-        generate_practice_problems(userid, class_id, lesson_id, question_theme)
+        enqueue_theming(userid, class_id, lesson_id, question_theme)
         break
 
+    # everyone is in the shared default class, don't keep a list of every student
+    if class_id == DEFAULT_CLASS_ID:
+        return
+
     # Update class meta to include student
-    meta_file = class_folder / "meta.json"
-    if meta_file.exists():
-        meta = load_json(meta_file)
-        if userid not in meta.get("enrolled_students", []):
-            meta.setdefault("enrolled_students", []).append(userid)
-            write_json(meta_file, meta)
+    with class_meta_lock(class_id):
+        meta = storage.get_class_meta(class_id)
+        if meta is not None:
+            if userid not in meta.get("enrolled_students", []):
+                meta.setdefault("enrolled_students", []).append(userid)
+                storage.save_class_meta(class_id, meta)
 
 
 def register_class(class_name: str, description="", template_questions=None, teacher_userid=None,
-                   copy_default_html=False) -> str:
-    class_id = str(uuid.uuid4())
-    append_csv(
-        CLASSES_CSV,
-        [class_id, class_name, teacher_userid, description, datetime.now().isoformat()],
-        header=["class_id", "class_name", "teacher_id", "description", "created_at"]
-    )
-
-    class_folder = CLASSES_FOLDER / class_id
-    class_folder.mkdir(parents=True, exist_ok=True)
+                   copy_default_html=False, class_id=None) -> str:
+    storage = get_storage()
+    class_id = class_id or str(uuid.uuid4())
+    storage.add_class({
+        "classid": class_id,
+        "class_name": class_name,
+        "teacher_id": teacher_userid,
+        "description": description,
+        "created_at": datetime.now().isoformat(),
+    })
 
     # Save class meta
-    write_json(class_folder / "meta.json", {
+    storage.save_class_meta(class_id, {
         "class_name": class_name,
         "enrolled_students": []
     })
 
-    # quick patch job to copy the default math content into the users class
+    # point the class at the shared default math lessons instead of copying them
     if copy_default_html:
-        content_folder = class_folder / "content"
-        content_folder.mkdir(parents=True, exist_ok=True)
-
-        for html_file in HTML_CONTENT_SRC.iterdir():
-            if html_file.suffix == ".html":
-                copy2(html_file, content_folder / html_file.name)
+        storage.save_class_manifest(class_id, default_manifest())
 
     if template_questions:
         normalized_template = normalize_template(template_questions)
-        write_json(class_folder / "template.json", normalized_template)
+        storage.save_class_template(class_id, normalized_template)
 
     return class_id
 
@@ -313,26 +354,23 @@ def upload_teacher_class(teacher_userid: str, class_name: str, template_question
 def leave_class(student_userid: str, class_id: str):
     """Student leaves a teacher class."""
 
-    # Remove from student folder
-    student_class_folder = USERSFOLDER / student_userid / "classes" / class_id
-    if student_class_folder.exists():
-        import shutil
-        shutil.rmtree(student_class_folder)
+    storage = get_storage()
+
+    # Remove the student's progress
+    with progress_lock(student_userid, class_id):
+        storage.delete_progress(student_userid, class_id)
 
     # Remove from class meta
-    meta_file = CLASSES_FOLDER / class_id / "meta.json"
-    if meta_file.exists():
-        meta = load_json(meta_file)
-        meta["enrolled_students"] = [s for s in meta.get("enrolled_students", []) if s != student_userid]
-        write_json(meta_file, meta)
+    with class_meta_lock(class_id):
+        meta = storage.get_class_meta(class_id)
+        if meta is not None:
+            meta["enrolled_students"] = [s for s in meta.get("enrolled_students", []) if s != student_userid]
+            storage.save_class_meta(class_id, meta)
 
 
 def get_class_progress(userid: str, class_id: str):
-    """Return progress.json for student"""
-    progress_file = USERSFOLDER / userid / "classes" / class_id / "progress.json"
-    if progress_file.exists():
-        return load_json(progress_file)
-    return None
+    """Return progress.json for student, read-only (see storage.read_progress)"""
+    return get_storage().read_progress(userid, class_id)
 
 
 def join_teacher_class(student_userid: str, class_id: str):
@@ -343,3 +381,30 @@ def join_teacher_class(student_userid: str, class_id: str):
     """
     create_questions_for_student(student_userid, class_id)
     print(f"Student {student_userid} joined class {class_id}")
+
+
+# ---------- background theming ----------
+
+def _theme_lesson_job(payload: dict):
+    generate_practice_problems(payload["userid"], payload["class_id"], payload["lesson_id"], payload["theme"],
+                               prefetch=payload.get("prefetch", False))
+
+
+register_handler("theme_lesson", _theme_lesson_job)
+
+
+def enqueue_theming(userid: str, class_id: str, lesson_id: str, theme: str, prefetch: bool = False):
+    """
+    Queue theming a lesson's questions for a student, return the job id (see
+    jobs.py). A prefetch (see prefetch.py) shares its dedupe key with the
+    job unlocking the lesson queues, so that one gets the prefetch's id while
+    it is still running. None for a student without a theme, who keeps the
+    base questions.
+    """
+    if not theme:
+        return None
+    return enqueue(
+        "theme_lesson",
+        {"userid": userid, "class_id": class_id, "lesson_id": lesson_id, "theme": theme, "prefetch": prefetch},
+        dedupe_key=f"theme_lesson:{userid}:{class_id}:{lesson_id}:{theme}",
+    )
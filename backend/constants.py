@@ -14,4 +14,168 @@ CLASSES_CSV = USERSFOLDER / "classes.csv"
 CLASSES_FOLDER = USERSFOLDER / "classes"  # central class templates
 
 QUESTION_GENERATORS = Path(__file__).parent / "QuestionGenerators"
-HTML_CONTENT_SRC = QUESTION_GENERATORS / "html_content_files"
\ No newline at end of file
+HTML_CONTENT_SRC = QUESTION_GENERATORS / "html_content_files"
+
+import os
+
+# Storage backend: "file" keeps the users/ folder layout, "sqlite" uses a single database file
+STORAGE_BACKEND = os.environ.get("EDU_STORAGE_BACKEND", "file").lower()
+SQLITE_DB = Path(os.environ.get("EDU_SQLITE_DB", USERSFOLDER / "edu.sqlite3"))
+
+# Answers are appended to a per-student, per-class journal and folded back
+# into progress.json once this many have piled up
+JOURNAL_COMPACT_AFTER = int(os.environ.get("EDU_JOURNAL_COMPACT_AFTER", 64))
+
+# Read-modify-write cycles are serialized through striped locks, shared
+# across processes with advisory locks on files in LOCKS_FOLDER
+LOCKS_FOLDER = USERSFOLDER / ".locks"
+LOCK_STRIPES = int(os.environ.get("EDU_LOCK_STRIPES", 64))
+LOCK_WAIT_WARN_SECONDS = float(os.environ.get("EDU_LOCK_WAIT_WARN", 0.5))
+
+# How persisted JSON documents are encoded: a serializer optionally followed
+# by a compressor, e.g. "json", "json-pretty", "orjson", "msgpack+zstd", "json+gzip"
+PERSIST_CODEC = os.environ.get("EDU_PERSIST_CODEC", "json")
+
+# How document writes reach the disk (see write_behind.py):
+#   strict  - fsync every write before returning
+#   grouped - writes within GROUP_COMMIT_MS share one fsync, callers wait for it
+#   relaxed - write in the background every RELAXED_FLUSH_SECONDS, no fsync (single worker only)
+DURABILITY_MODE = os.environ.get("EDU_DURABILITY", "grouped").lower()
+GROUP_COMMIT_MS = float(os.environ.get("EDU_GROUP_COMMIT_MS", 2))
+RELAXED_FLUSH_SECONDS = float(os.environ.get("EDU_RELAXED_FLUSH_SECONDS", 1.0))
+
+# How many parsed progress documents each worker keeps in memory
+PROGRESS_CACHE_SIZE = int(os.environ.get("EDU_PROGRESS_CACHE_SIZE", 2048))
+
+# Lesson HTML is stored once per distinct content, keyed by SHA-256
+CONTENT_STORE = USERSFOLDER / "content_store"
+
+# GET /lesson-content: how long browsers may reuse a lesson before revalidating
+# it with its ETag, and how many lesson blobs each worker keeps in memory
+LESSON_CACHE_MAX_AGE = int(os.environ.get("EDU_LESSON_CACHE_MAX_AGE", 300))
+LESSON_BLOB_CACHE_SIZE = int(os.environ.get("EDU_LESSON_BLOB_CACHE_SIZE", 256))
+
+# Point totals behind /leaderboard are appended to this log as answers come
+# in (see leaderboard.py); it is rewritten with just the current totals once
+# it holds LEADERBOARD_COMPACT_FACTOR times as many entries as there are totals
+LEADERBOARD_LOG = USERSFOLDER / "leaderboard.jsonl"
+LEADERBOARD_COMPACT_FACTOR = int(os.environ.get("EDU_LEADERBOARD_COMPACT_FACTOR", 4))
+
+# Windowed leaderboards (?window=today|week|term|<N>d, or start/end dates)
+# sum per-day point buckets; this many days are kept per student and class.
+# Weeks start on LEADERBOARD_WEEK_START (0 = Monday), the term on the ISO date
+# LEADERBOARD_TERM_START (empty: as far back as buckets are kept)
+LEADERBOARD_RETENTION_DAYS = int(os.environ.get("EDU_LEADERBOARD_RETENTION_DAYS", 120))
+LEADERBOARD_WEEK_START = int(os.environ.get("EDU_LEADERBOARD_WEEK_START", 0))
+LEADERBOARD_TERM_START = os.environ.get("EDU_LEADERBOARD_TERM_START", "")
+
+# Slow work after a request (theming questions with the model) runs as jobs
+# from a SQLite queue (see jobs.py): JOB_WORKERS threads per worker process,
+# failed jobs retried after JOB_RETRY_SECONDS, doubling each time, up to
+# JOB_MAX_ATTEMPTS; a running job's lease is renewed every third of
+# JOB_LEASE_SECONDS, and one not renewed for JOB_LEASE_SECONDS is assumed
+# dead and run again. Finished jobs are kept for JOB_KEEP_SECONDS. Theming
+# jobs mostly wait on the model, and only jobs that run at the same time can
+# share a model call (see theme_batcher.py), so there are a few more
+# threads than model calls allowed at once.
+JOBS_DB = Path(os.environ.get("EDU_JOBS_DB", USERSFOLDER / "jobs.sqlite3"))
+JOB_WORKERS = int(os.environ.get("EDU_JOB_WORKERS", 8))
+JOB_MAX_ATTEMPTS = int(os.environ.get("EDU_JOB_MAX_ATTEMPTS", 4))
+JOB_RETRY_SECONDS = float(os.environ.get("EDU_JOB_RETRY_SECONDS", 5))
+JOB_LEASE_SECONDS = float(os.environ.get("EDU_JOB_LEASE_SECONDS", 300))
+JOB_KEEP_SECONDS = float(os.environ.get("EDU_JOB_KEEP_SECONDS", 7 * 24 * 3600))
+
+# Themes students can pick for their word problems (/available-themes)
+AVAILABLE_THEMES = [
+    "Soccer",
+    "Hockey",
+    "Toys",
+    "Pokemon",
+    "Video Games",
+    "Cars",
+    "Fairies",
+    "Horses",
+    "Dolls",
+]
+
+# Themed versions of base questions are shared between students through a
+# cache (see theme_cache.py) keeping THEME_CACHE_VARIANTS variants for each
+# question and theme, and at most THEME_CACHE_MAX_ENTRIES questions/themes
+THEME_CACHE_DB = Path(os.environ.get("EDU_THEME_CACHE_DB", USERSFOLDER / "theme_cache.sqlite3"))
+THEME_CACHE_VARIANTS = int(os.environ.get("EDU_THEME_CACHE_VARIANTS", 3))
+THEME_CACHE_MAX_ENTRIES = int(os.environ.get("EDU_THEME_CACHE_MAX_ENTRIES", 50000))
+
+# Which model themes the questions (see llm.py): "gemini", or "stub" for a
+# local fake that needs no network. The stub takes LLM_STUB_LATENCY_MS per
+# call (log-normal with spread LLM_STUB_LATENCY_SIGMA) plus
+# LLM_STUB_PER_QUESTION_MS per full question block (less for shorter
+# answers, like a real model's output time), and gets the format or the answer
+# of a question wrong at the given rates; LLM_STUB_SEED makes it repeatable
+LLM_PROVIDER = os.environ.get("EDU_LLM_PROVIDER", "gemini").lower()
+# the Gemini key has no default, set EDU_GEMINI_API_KEY (or use the stub)
+GEMINI_API_KEY = os.environ.get("EDU_GEMINI_API_KEY")
+GEMINI_MODEL = os.environ.get("EDU_GEMINI_MODEL", "gemini-2.5-flash-lite")
+LLM_STUB_LATENCY_MS = float(os.environ.get("EDU_LLM_STUB_LATENCY_MS", 1500))
+LLM_STUB_LATENCY_SIGMA = float(os.environ.get("EDU_LLM_STUB_LATENCY_SIGMA", 0.4))
+LLM_STUB_PER_QUESTION_MS = float(os.environ.get("EDU_LLM_STUB_PER_QUESTION_MS", 150))
+LLM_STUB_FORMAT_ERROR_RATE = float(os.environ.get("EDU_LLM_STUB_FORMAT_ERROR_RATE", 0.0))
+LLM_STUB_WRONG_ANSWER_RATE = float(os.environ.get("EDU_LLM_STUB_WRONG_ANSWER_RATE", 0.0))
+LLM_STUB_SEED = os.environ.get("EDU_LLM_STUB_SEED") or None
+
+# Model calls wait in a dispatcher (see dispatcher.py): at most
+# LLM_MAX_CONCURRENCY run at once and LLM_RATE_PER_MINUTE start per minute
+# (in bursts of up to LLM_RATE_BURST), per worker process. Failed calls are
+# retried LLM_MAX_RETRIES times after up to LLM_BACKOFF_SECONDS, doubling
+# each time; a call that can't start within LLM_QUEUE_TIMEOUT_SECONDS fails
+LLM_MAX_CONCURRENCY = int(os.environ.get("EDU_LLM_MAX_CONCURRENCY", 4))
+LLM_RATE_PER_MINUTE = float(os.environ.get("EDU_LLM_RATE_PER_MINUTE", 120))
+LLM_RATE_BURST = int(os.environ.get("EDU_LLM_RATE_BURST", 10))
+LLM_MAX_RETRIES = int(os.environ.get("EDU_LLM_MAX_RETRIES", 3))
+LLM_BACKOFF_SECONDS = float(os.environ.get("EDU_LLM_BACKOFF_SECONDS", 1.0))
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.environ.get("EDU_LLM_QUEUE_TIMEOUT_SECONDS", 120))
+
+# Questions the model returns malformed or with a wrong answer are asked for
+# again on their own, in at most LLM_THEME_ATTEMPTS calls per batch in all
+LLM_THEME_ATTEMPTS = int(os.environ.get("EDU_LLM_THEME_ATTEMPTS", 3))
+
+# A lesson's questions are themed in concurrent chunks of at most
+# LLM_CHUNK_SIZE. A call slower than LLM_HEDGE_PERCENTILE of the last
+# LLM_LATENCY_WINDOW calls is sent a second time if the dispatcher has room,
+# once LLM_HEDGE_MIN_SAMPLES calls have been timed (percentile 0: no hedging)
+LLM_CHUNK_SIZE = int(os.environ.get("EDU_LLM_CHUNK_SIZE", 8))
+LLM_HEDGE_PERCENTILE = float(os.environ.get("EDU_LLM_HEDGE_PERCENTILE", 95))
+LLM_HEDGE_MIN_SAMPLES = int(os.environ.get("EDU_LLM_HEDGE_MIN_SAMPLES", 20))
+LLM_LATENCY_WINDOW = int(os.environ.get("EDU_LLM_LATENCY_WINDOW", 200))
+
+# Stream model responses and save each themed question to the student's
+# progress as soon as it arrives (no hedging then); "0" waits for whole responses
+LLM_STREAMING = os.environ.get("EDU_LLM_STREAMING", "1") != "0"
+
+# Start theming a student's next (still locked) lesson in the background once
+# they have answered LESSON_PREFETCH_THRESHOLD of the current lesson's
+# questions, so it's ready when they unlock it (see prefetch.py); "0" turns it off
+LESSON_PREFETCH = os.environ.get("EDU_LESSON_PREFETCH", "1") != "0"
+LESSON_PREFETCH_THRESHOLD = float(os.environ.get("EDU_LESSON_PREFETCH_THRESHOLD", 0.5))
+
+# Theming requests for the same theme that come in within THEME_BATCH_WINDOW_MS
+# of each other (a class unlocking a lesson together) go to the model as one
+# batch of their distinct questions, up to THEME_BATCH_MAX_QUESTIONS, and the
+# results are shared out (see theme_batcher.py); 0 sends each on its own
+THEME_BATCH_WINDOW_MS = float(os.environ.get("EDU_THEME_BATCH_WINDOW_MS", 150))
+THEME_BATCH_MAX_QUESTIONS = int(os.environ.get("EDU_THEME_BATCH_MAX_QUESTIONS", 64))
+
+# How lessons get themed: "llm" (the default) asks the model. Opt in to the
+# offline word-problem engine for generated sums (see word_problems.py) with
+# "local", where questions it can't read stay plain unless the shared cache
+# has them, or "local_first", which themes what it can locally right away and
+# has the model rewrite those stories in the background, the rest goes to
+# the model as with "llm"
+THEMING_ENGINE = os.environ.get("EDU_THEMING_ENGINE", "llm").lower()
+
+# User and class folders are spread over this many levels of hashed shard
+# folders, e.g. users/ab/cd/<userid>/ (see paths.py)
+SHARD_LEVELS = 2
+
+# Every student shares this default math class; their own generated questions
+# are kept as a small per-student overlay on top of its template
+DEFAULT_CLASS_ID = "default_math"
@@ -0,0 +1,207 @@
+"""
+Content-addressed store for lesson HTML.
+
+Every distinct HTML document is stored once under CONTENT_STORE/<ab>/<sha256>.
+Each class has a manifest {lesson_id: sha256} (see storage.get_class_manifest),
+so the nine default lessons are shared by every default_math class instead of
+being copied per signup, and identical teacher uploads are stored once.
+
+Next to each blob sit precompressed variants (<sha256>.gz, and <sha256>.br
+when the brotli package is installed), made when the blob is stored, so
+GET /lesson-content can send them as they are. Blobs never change, so their
+bytes are also kept in memory once read.
+
+    python content_store.py migrate   # move class content/ folders into the store
+    python content_store.py gc        # delete blobs no manifest points at (no uploads in flight)
+"""
+
+import gzip
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+from functools import lru_cache
+from pathlib import Path
+
+from constants import CONTENT_STORE, HTML_CONTENT_SRC, LESSON_BLOB_CACHE_SIZE
+from paths import class_folder, iter_class_folders
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+CHUNK_SIZE = 64 * 1024
+
+# Content-Encoding -> (file suffix, compress function), in order of preference
+VARIANTS = {"gzip": (".gz", lambda raw: gzip.compress(raw, compresslevel=9, mtime=0))}
+if brotli is not None:
+    VARIANTS = {"br": (".br", lambda raw: brotli.compress(raw, mode=brotli.MODE_TEXT)), **VARIANTS}
+
+_default_manifest = None
+
+
+def blob_path(digest: str) -> Path:
+    return CONTENT_STORE / digest[:2] / digest
+
+
+def variant_path(digest: str, encoding: str) -> Path:
+    return blob_path(digest).with_name(digest + VARIANTS[encoding][0])
+
+
+def _write_new(path: Path, raw: bytes):
+    fd, temp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(raw)
+        os.replace(temp_name, path)
+    finally:
+        if os.path.exists(temp_name):
+            os.unlink(temp_name)
+
+
+def ensure_variants(digest: str):
+    """Write any compressed variants of a blob that are missing."""
+    raw = None
+    for encoding in VARIANTS:
+        path = variant_path(digest, encoding)
+        if not path.exists():
+            raw = raw if raw is not None else read_blob(digest)
+            _write_new(path, VARIANTS[encoding][1](raw))
+
+
+def put_stream(stream) -> str:
+    """Hash and store a file-like object in one pass, return its sha256."""
+    CONTENT_STORE.mkdir(parents=True, exist_ok=True)
+    sha = hashlib.sha256()
+    fd, temp_name = tempfile.mkstemp(dir=CONTENT_STORE, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while chunk := stream.read(CHUNK_SIZE):
+                sha.update(chunk)
+                f.write(chunk)
+
+        digest = sha.hexdigest()
+        path = blob_path(digest)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(temp_name, path)
+    finally:
+        if os.path.exists(temp_name):
+            os.unlink(temp_name)
+
+    # duplicates are dropped above, but their variants may predate a compressor
+    ensure_variants(digest)
+    return digest
+
+
+def put_file(path: Path) -> str:
+    with open(path, "rb") as f:
+        return put_stream(f)
+
+
+@lru_cache(maxsize=LESSON_BLOB_CACHE_SIZE)
+def read_blob(digest: str) -> bytes:
+    with open(blob_path(digest), "rb") as f:
+        return f.read()
+
+
+@lru_cache(maxsize=LESSON_BLOB_CACHE_SIZE)
+def read_variant(digest: str, encoding: str) -> bytes:
+    """Compressed bytes of a blob, made now if it was stored before the variant existed."""
+    path = variant_path(digest, encoding)
+    if not path.exists():
+        ensure_variants(digest)
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def default_manifest() -> dict:
+    """Manifest for the bundled default math lessons, stored on first use."""
+    global _default_manifest
+    if _default_manifest is None or not all(blob_path(d).exists() for d in _default_manifest.values()):
+        _default_manifest = {
+            html_file.stem: put_file(html_file)
+            for html_file in sorted(HTML_CONTENT_SRC.iterdir())
+            if html_file.suffix == ".html"
+        }
+    return dict(_default_manifest)
+
+
+def lesson_digest(class_id: str, lesson_id: str):
+    """
+    sha256 of a lesson's HTML, or None. A lesson still in the old per-class
+    content/ folder is moved into the store and the class manifest first.
+    """
+    from storage import get_storage
+    from locks import class_meta_lock
+
+    storage = get_storage()
+    digest = (storage.get_class_manifest(class_id) or {}).get(lesson_id)
+    if digest and blob_path(digest).exists():
+        return digest
+
+    legacy_path = class_folder(class_id) / "content" / f"{lesson_id}.html"
+    if not legacy_path.exists():
+        return None
+    with class_meta_lock(class_id):
+        manifest = storage.get_class_manifest(class_id) or {}
+        manifest[lesson_id] = put_file(legacy_path)
+        storage.save_class_manifest(class_id, manifest)
+    return manifest[lesson_id]
+
+
+def migrate_class_folders() -> tuple:
+    """Move every class folder's content/*.html into the store and write manifests."""
+    from storage import get_storage
+    from locks import class_meta_lock
+
+    storage = get_storage()
+    classes = files = 0
+    for class_id, folder in iter_class_folders():
+        content_folder = folder / "content"
+        if not content_folder.is_dir():
+            continue
+        with class_meta_lock(class_id):
+            manifest = storage.get_class_manifest(class_id) or {}
+            for html_file in content_folder.glob("*.html"):
+                manifest[html_file.stem] = put_file(html_file)
+                files += 1
+            storage.save_class_manifest(class_id, manifest)
+            shutil.rmtree(content_folder)
+        classes += 1
+    return classes, files
+
+
+def collect_garbage() -> int:
+    """Delete blobs that no class manifest refers to."""
+    from storage import get_storage
+
+    storage = get_storage()
+    class_ids = {row["classid"] for row in storage.list_classes()}
+    class_ids.update(class_id for class_id, _ in iter_class_folders())
+
+    referenced = set(default_manifest().values())
+    for class_id in class_ids:
+        referenced.update((storage.get_class_manifest(class_id) or {}).values())
+
+    removed = 0
+    for path in CONTENT_STORE.glob("*/*"):
+        # <sha256> and its <sha256>.gz/.br variants
+        if path.name.split(".")[0] not in referenced:
+            path.unlink()
+            removed += 1
+    return removed
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "migrate":
+        classes, files = migrate_class_folders()
+        print(f"Moved {files} lesson files from {classes} classes into {CONTENT_STORE}")
+    elif command == "gc":
+        print(f"Removed {collect_garbage()} unreferenced blobs")
+    else:
+        print("usage: python content_store.py migrate|gc")
+        sys.exit(1)
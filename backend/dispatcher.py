@@ -0,0 +1,260 @@
+"""
+Admission control for model calls.
+
+Every call to the model goes through the process-wide Dispatcher, which
+owns the provider (one client, reused by every thread) and makes callers
+wait their turn:
+
+- at most LLM_MAX_CONCURRENCY calls run at once,
+- calls start at no more than LLM_RATE_PER_MINUTE (token bucket allowing
+  bursts of LLM_RATE_BURST),
+- waiting INTERACTIVE calls (a student waiting for their lesson) go
+  before BACKGROUND ones (cache warm-up), first come first served within
+  a priority,
+- a call that fails with a retryable error is retried up to
+  LLM_MAX_RETRIES times after a random delay of up to LLM_BACKOFF_SECONDS,
+  doubling with every retry; retries queue again like new calls,
+- a call that can't start within its budget (LLM_QUEUE_TIMEOUT_SECONDS)
+  raises TimeoutError instead of piling up more work.
+
+The limits are per worker process.
+
+    get_dispatcher().generate(system_instruction, prompt, priority=BACKGROUND)
+"""
+
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+
+from constants import (
+    LLM_MAX_CONCURRENCY,
+    LLM_RATE_PER_MINUTE,
+    LLM_RATE_BURST,
+    LLM_MAX_RETRIES,
+    LLM_BACKOFF_SECONDS,
+    LLM_QUEUE_TIMEOUT_SECONDS,
+)
+
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+
+def is_retryable(error: Exception) -> bool:
+    """Client errors (bad request, bad key, ...) won't go away by asking again; rate limits and timeouts will."""
+    code = getattr(error, "code", None)
+    if isinstance(code, int) and 400 <= code < 500:
+        return code in (408, 429)
+    return True
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute: float, burst: int):
+        self.rate = rate_per_minute / 60
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Take a token and return 0, or return the seconds until one is available."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class _WaitStats:
+    __slots__ = ("admitted", "total", "max")
+
+    def __init__(self):
+        self.admitted = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        self.admitted += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def as_dict(self) -> dict:
+        return {
+            "admitted": self.admitted,
+            "avg_wait_ms": self.total / self.admitted * 1000 if self.admitted else 0.0,
+            "max_wait_ms": self.max * 1000,
+        }
+
+
+class Dispatcher:
+    def __init__(self, provider=None, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 rate_per_minute: float = LLM_RATE_PER_MINUTE, burst: int = LLM_RATE_BURST,
+                 max_retries: int = LLM_MAX_RETRIES, backoff: float = LLM_BACKOFF_SECONDS,
+                 queue_timeout: float = LLM_QUEUE_TIMEOUT_SECONDS):
+        self._provider = provider
+        self.max_concurrency = max(max_concurrency, 1)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.queue_timeout = queue_timeout
+        self._bucket = TokenBucket(rate_per_minute, burst)
+        self._cond = threading.Condition()
+        self._waiting = []  # heap of (priority, seq)
+        self._seq = itertools.count()
+        self._active = 0
+
+        self._waits = {p: _WaitStats() for p in PRIORITY_NAMES}
+        self.throttled = 0
+        self.retries = 0
+        self.errors = 0
+        self.timeouts = 0
+
+    @property
+    def provider(self):
+        if self._provider is None:
+            from llm import get_provider
+            self._provider = get_provider()
+        return self._provider
+
+    def _acquire(self, priority: int, deadline: float):
+        """Wait for a slot and a rate token, in priority order."""
+        start = time.monotonic()
+        ticket = (priority, next(self._seq))
+        throttled = False
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    delay = None
+                    if self._waiting[0] == ticket and self._active < self.max_concurrency:
+                        delay = self._bucket.take()
+                        if delay == 0:
+                            heapq.heappop(self._waiting)
+                            self._active += 1
+                            self._waits[priority].add(time.monotonic() - start)
+                            self._cond.notify_all()  # the next in line may fit as well
+                            return
+                        if not throttled:
+                            throttled = True
+                            self.throttled += 1
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise TimeoutError(f"Model call waited {time.monotonic() - start:.1f}s without starting")
+                    self._cond.wait(min(delay, remaining) if delay else remaining)
+            except BaseException:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                    self._cond.notify_all()
+                raise
+
+    def has_capacity(self) -> bool:
+        """True if a call made now wouldn't have to queue for a slot."""
+        with self._cond:
+            return not self._waiting and self._active < self.max_concurrency
+
+    def _release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def generate(self, system_instruction: str, prompt: str, priority: int = INTERACTIVE,
+                 timeout: float = None) -> str:
+        """
+        provider.generate() once admitted, retried with backoff on retryable
+        errors. TimeoutError if it can't start within timeout seconds
+        (LLM_QUEUE_TIMEOUT_SECONDS by default, including time spent on retries).
+        """
+        deadline = time.monotonic() + (timeout if timeout is not None else self.queue_timeout)
+        attempt = 0
+        while True:
+            self._acquire(priority, deadline)
+            try:
+                return self.provider.generate(system_instruction, prompt)
+            except Exception as e:
+                self.errors += 1
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                delay = random.uniform(0, self.backoff * 2 ** attempt)
+                print(f"[WARN] Model call failed ({type(e).__name__}: {e}), retrying in {delay:.1f}s")
+            finally:
+                self._release()
+            attempt += 1
+            self.retries += 1
+            time.sleep(delay)
+
+    def stream(self, system_instruction: str, prompt: str, priority: int = INTERACTIVE,
+               timeout: float = None):
+        """
+        Like generate(), but yields provider.generate_stream() pieces. The
+        slot is held until the stream is used up or closed. Errors are only
+        retried before the first piece arrived.
+        """
+        deadline = time.monotonic() + (timeout if timeout is not None else self.queue_timeout)
+        attempt = 0
+        while True:
+            self._acquire(priority, deadline)
+            started = False
+            try:
+                for piece in self.provider.generate_stream(system_instruction, prompt):
+                    started = True
+                    yield piece
+                return
+            except Exception as e:
+                self.errors += 1
+                if started or attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                delay = random.uniform(0, self.backoff * 2 ** attempt)
+                print(f"[WARN] Model stream failed ({type(e).__name__}: {e}), retrying in {delay:.1f}s")
+            finally:
+                self._release()
+            attempt += 1
+            self.retries += 1
+            time.sleep(delay)
+
+    def _after_fork(self):
+        # the parent's waiters and running calls don't exist in the child
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._active = 0
+
+    def stats(self) -> dict:
+        """Queue depth, wait times and error counters, for /metrics."""
+        with self._cond:
+            queued = {name: 0 for name in PRIORITY_NAMES.values()}
+            for priority, _ in self._waiting:
+                queued[PRIORITY_NAMES[priority]] += 1
+            return {
+                # not self.provider, /metrics shouldn't create (or fail to create) one
+                "provider": self._provider.stats() if self._provider else None,
+                "max_concurrency": self.max_concurrency,
+                "active": self._active,
+                "queued": queued,
+                "waits": {PRIORITY_NAMES[p]: w.as_dict() for p, w in self._waits.items()},
+                "throttled": self.throttled,
+                "retries": self.retries,
+                "errors": self.errors,
+                "timeouts": self.timeouts,
+            }
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher() -> Dispatcher:
+    """Return the process-wide model call dispatcher."""
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = Dispatcher()
+                if hasattr(os, "register_at_fork"):
+                    os.register_at_fork(after_in_child=_dispatcher._after_fork)
+    return _dispatcher
@@ -0,0 +1,338 @@
+"""
+Durable background jobs for slow work that shouldn't hold up a request,
+like theming a lesson's questions with the model.
+
+Jobs live in their own SQLite database (JOBS_DB), so they survive restarts
+and any worker process can run a job another one queued. Each worker
+process runs JOB_WORKERS threads that claim jobs with a lease, which a
+heartbeat renews while the job runs; a job whose worker died is picked up
+again once its lease runs out. A job that raises (or whose worker died) is
+retried with exponential backoff until JOB_MAX_ATTEMPTS, then marked
+failed.
+
+    job_id = enqueue("theme_lesson", {...}, dedupe_key="...")
+    get_job(job_id)   # {"status": "queued|running|done|failed", ...}
+
+Handlers are registered by kind with register_handler(). Run a dedicated
+worker (no web server) with:
+
+    python jobs.py run
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+import uuid
+
+from constants import (
+    JOBS_DB,
+    JOB_WORKERS,
+    JOB_MAX_ATTEMPTS,
+    JOB_RETRY_SECONDS,
+    JOB_LEASE_SECONDS,
+    JOB_KEEP_SECONDS,
+)
+from storage import connect_sqlite
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    dedupe_key TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    run_after REAL NOT NULL,
+    leased_until REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, run_after);
+CREATE INDEX IF NOT EXISTS jobs_dedupe ON jobs (dedupe_key, status);
+"""
+
+POLL_SECONDS = 1.0
+# renew the leases of running jobs this often, well before they run out
+HEARTBEAT_SECONDS = JOB_LEASE_SECONDS / 3
+
+_handlers = {}
+
+
+def register_handler(kind: str, fn):
+    """fn(payload) runs a job of this kind; its return value is stored as the result."""
+    _handlers[kind] = fn
+
+
+class JobQueue:
+    def __init__(self, db_path=JOBS_DB, workers: int = JOB_WORKERS):
+        self.db_path = db_path
+        self.workers = workers
+        self._local = threading.local()
+        self._wake = threading.Event()
+        self._start_lock = threading.Lock()
+        self._threads = []
+        self._running = {}  # job id -> attempt, the jobs this process is running
+        self._running_lock = threading.Lock()
+        self._heartbeat = None
+        self._connect().executescript(SCHEMA)
+
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect_sqlite(self.db_path)
+            self._local.conn = conn
+        return conn
+
+    # ---------- producers ----------
+
+    def enqueue(self, kind: str, payload: dict, dedupe_key: str = None,
+                max_attempts: int = JOB_MAX_ATTEMPTS) -> str:
+        """
+        Queue a job and return its id. With a dedupe_key, a job with the same
+        key that is still queued or running is returned instead of a new one.
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if dedupe_key is not None:
+                row = conn.execute(
+                    "SELECT id FROM jobs WHERE dedupe_key = ? AND status IN ('queued', 'running')",
+                    (dedupe_key,),
+                ).fetchone()
+                if row is not None:
+                    conn.execute("COMMIT")
+                    return row["id"]
+            job_id = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO jobs (id, kind, payload, status, dedupe_key, max_attempts, run_after, created_at, updated_at) "
+                "VALUES (?, ?, ?, 'queued', ?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(payload), dedupe_key, max_attempts, now, now, now),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self.start()
+        self._wake.set()
+        return job_id
+
+    def get(self, job_id: str):
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    # ---------- workers ----------
+
+    def _claim(self):
+        """Lease the next job that is due, or return None."""
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # a worker died running the last attempt, don't run it yet again
+            expired = conn.execute(
+                "UPDATE jobs SET status = 'failed', leased_until = NULL, updated_at = ?, "
+                "error = 'Lease expired on the last attempt' "
+                "WHERE status = 'running' AND leased_until < ? AND attempts >= max_attempts",
+                (now, now),
+            ).rowcount
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE (status = 'queued' AND run_after <= ?) "
+                "OR (status = 'running' AND leased_until < ?) ORDER BY run_after LIMIT 1",
+                (now, now),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, leased_until = ?, updated_at = ? "
+                    "WHERE id = ?",
+                    (now + JOB_LEASE_SECONDS, now, row["id"]),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self.failed += expired
+        if row is None:
+            return None
+        job = dict(row)
+        job["attempts"] += 1
+        return job
+
+    def _finish(self, job: dict, result=None, error: str = None):
+        now = time.time()
+        if error is None:
+            status, run_after = "done", job["run_after"]
+        elif job["attempts"] < job["max_attempts"]:
+            status, run_after = "queued", now + JOB_RETRY_SECONDS * 2 ** (job["attempts"] - 1)
+        else:
+            status, run_after = "failed", job["run_after"]
+        # only the attempt holding the lease may finish the job
+        updated = self._connect().execute(
+            "UPDATE jobs SET status = ?, run_after = ?, leased_until = NULL, updated_at = ?, result = ?, error = ? "
+            "WHERE id = ? AND attempts = ?",
+            (status, run_after, now, json.dumps(result) if result is not None else None, error,
+             job["id"], job["attempts"]),
+        ).rowcount
+        if not updated:
+            print(f"[WARN] Job {job['id']} ({job['kind']}) attempt {job['attempts']} lost its lease, "
+                  f"dropping its outcome")
+        elif status == "done":
+            self.completed += 1
+        elif status == "queued":
+            self.retried += 1
+        else:
+            self.failed += 1
+
+    def _renew_leases(self):
+        """Heartbeat: push back the lease of every job this process is running."""
+        while True:
+            time.sleep(HEARTBEAT_SECONDS)
+            with self._running_lock:
+                running = list(self._running.items())
+            if not running:
+                continue
+            try:
+                conn = self._connect()
+                leased_until = time.time() + JOB_LEASE_SECONDS
+                conn.executemany(
+                    "UPDATE jobs SET leased_until = ? WHERE id = ? AND attempts = ? AND status = 'running'",
+                    [(leased_until, job_id, attempts) for job_id, attempts in running],
+                )
+            except Exception as e:
+                print(f"[WARN] Renewing job leases failed: {e}")
+
+    def _start_heartbeat(self):
+        with self._running_lock:
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(target=self._renew_leases, name="job-heartbeat", daemon=True)
+                self._heartbeat.start()
+
+    def run_one(self) -> bool:
+        """Run the next due job in this thread. False if there was none."""
+        job = self._claim()
+        if job is None:
+            return False
+        self._start_heartbeat()
+        with self._running_lock:
+            self._running[job["id"]] = job["attempts"]
+        handler = _handlers.get(job["kind"])
+        try:
+            if handler is None:
+                raise LookupError(f"No handler for job kind '{job['kind']}'")
+            result = handler(json.loads(job["payload"]))
+        except Exception as e:
+            print(f"[ERROR] Job {job['id']} ({job['kind']}) attempt {job['attempts']} failed: {e}")
+            traceback.print_exc()
+            self._finish(job, error=f"{type(e).__name__}: {e}")
+        else:
+            self._finish(job, result=result)
+        finally:
+            with self._running_lock:
+                self._running.pop(job["id"], None)
+        return True
+
+    def _run(self):
+        last_cleanup = 0.0
+        while True:
+            try:
+                while self.run_one():
+                    pass
+                if time.time() - last_cleanup > 3600:
+                    self.cleanup()
+                    last_cleanup = time.time()
+            except Exception as e:
+                print(f"[ERROR] Job worker: {e}")
+            self._wake.wait(POLL_SECONDS)
+            self._wake.clear()
+
+    def start(self):
+        """Start this process's worker threads, if they aren't running yet."""
+        if self._threads or self.workers <= 0:
+            return
+        with self._start_lock:
+            if not self._threads:
+                for i in range(self.workers):
+                    thread = threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+
+    def _after_fork(self):
+        # worker threads and connections don't survive a fork, start() makes new ones
+        self._local = threading.local()
+        self._wake = threading.Event()
+        self._start_lock = threading.Lock()
+        self._threads = []
+        self._running = {}
+        self._running_lock = threading.Lock()
+        self._heartbeat = None
+
+    def cleanup(self) -> int:
+        """Delete finished jobs older than JOB_KEEP_SECONDS."""
+        cursor = self._connect().execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+            (time.time() - JOB_KEEP_SECONDS,),
+        )
+        return cursor.rowcount
+
+    def stats(self) -> dict:
+        """Jobs per status plus this process's counters, for /metrics."""
+        rows = self._connect().execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {
+            "workers": len(self._threads),
+            "by_status": {r["status"]: r["n"] for r in rows},
+            "completed": self.completed,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue() -> JobQueue:
+    """Return the process-wide job queue."""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue()
+                if hasattr(os, "register_at_fork"):
+                    os.register_at_fork(after_in_child=_queue._after_fork)
+    return _queue
+
+
+def enqueue(kind: str, payload: dict, dedupe_key: str = None) -> str:
+    return get_queue().enqueue(kind, payload, dedupe_key=dedupe_key)
+
+
+def get_job(job_id: str):
+    return get_queue().get(job_id)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["run"]:
+        print("usage: python jobs.py run")
+        sys.exit(1)
+    import class_utils  # registers the job handlers
+
+    queue = get_queue()
+    print(f"Running jobs from {queue.db_path} with {queue.workers} threads")
+    queue.start()
+    while True:
+        time.sleep(3600)
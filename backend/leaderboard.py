@@ -0,0 +1,464 @@
+"""
+Leaderboard kept up to date as answers come in.
+
+Storage writes (save_progress, record_answer, delete_progress) append each
+student's new point total for a class to a points log: users/leaderboard.jsonl,
+or the points table in SQLite. Every worker keeps a LeaderboardView built
+from that log, with one sorted ranking per class and one global ranking,
+and reads just the new entries before answering. A page of the leaderboard
+or a student's rank costs a bisect instead of a scan of every progress file.
+
+Entries written for an answer also carry the day it was given and the
+points it won or lost. The view adds those to a ring of per-day buckets for
+each student and class (the last LEADERBOARD_RETENTION_DAYS days), so a
+window like "today" or "this week" is ranked by summing a few buckets. The
+ranking for a window is summed on its first request and then updated as
+answers come in, so later pages cost a bisect too. Students who won no
+points in the window aren't ranked.
+
+The totals can always be recomputed from progress (after restoring a backup,
+or to check the view):
+
+    python leaderboard.py rebuild   # recompute every total and replace the log
+    python leaderboard.py verify    # compare the view against a full recount
+
+Progress documents don't say when questions were answered, so a rebuild
+keeps the day buckets the view already has.
+"""
+
+import re
+import sys
+import threading
+from array import array
+from bisect import bisect_left, insort
+from datetime import date
+
+from constants import (
+    LEADERBOARD_COMPACT_FACTOR,
+    LEADERBOARD_RETENTION_DAYS,
+    LEADERBOARD_WEEK_START,
+    LEADERBOARD_TERM_START,
+)
+from locks import lock
+
+# points per correct question, anything else counts as hard
+LEVEL_POINTS = {"easy": 1, "medium": 2}
+HARD_POINTS = 3
+
+# windowed rankings kept per worker, e.g. today's and this week's per class
+WINDOW_CACHE_SIZE = 64
+
+
+def is_student(user_row) -> bool:
+    """Whether an auth row (or None) is a student account, the only ones ranked."""
+    return bool(user_row) and (user_row.get("role") or "").upper() == "STUDENT"
+
+
+def compute_points(progress: dict) -> int:
+    """
+    Shared scoring logic:
+    - 1 point per correct 'easy' question
+    - 2 points per correct 'medium' question
+    - 3 points per correct 'hard' question
+    """
+    total_points = 0
+    for lesson in progress.get("lessons", {}).values():
+        for level, questions in lesson.get("questions", {}).items():
+            weight = LEVEL_POINTS.get(level, HARD_POINTS)
+            for q in questions:
+                if q.get("correct") is True:
+                    total_points += weight
+    return total_points
+
+
+def answer_delta(progress: dict, record: dict) -> int:
+    """How many points an answer journal record adds to (or takes from) a progress document."""
+    lesson = progress.get("lessons", {}).get(record["lesson_id"])
+    if not lesson:
+        return 0
+    for level, questions in lesson.get("questions", {}).items():
+        for q in questions:
+            if q["id"] == record["question_id"]:
+                was = q.get("correct") is True
+                return LEVEL_POINTS.get(level, HARD_POINTS) * (int(record["correct"]) - int(was))
+    return 0
+
+
+def day_number(ts: float) -> int:
+    """Day (in the server's local time) an answer timestamp falls on."""
+    return date.fromtimestamp(ts).toordinal()
+
+
+def window_days(window: str = None, start: str = None, end: str = None, today: int = None) -> tuple:
+    """
+    First and last day of a leaderboard window, inclusive:
+      today, week (since LEADERBOARD_WEEK_START), term (since
+      LEADERBOARD_TERM_START), <N>d (the last N days), or start/end
+      ISO dates (end defaults to today).
+    Raises ValueError for anything else.
+    """
+    today = today if today is not None else date.today().toordinal()
+    if start or end:
+        first = date.fromisoformat(start).toordinal() if start else today - LEADERBOARD_RETENTION_DAYS + 1
+        last = date.fromisoformat(end).toordinal() if end else today
+    elif window == "today":
+        first = last = today
+    elif window == "week":
+        first = today - (date.fromordinal(today).weekday() - LEADERBOARD_WEEK_START) % 7
+        last = today
+    elif window == "term":
+        if LEADERBOARD_TERM_START:
+            first = date.fromisoformat(LEADERBOARD_TERM_START).toordinal()
+        else:
+            first = today - LEADERBOARD_RETENTION_DAYS + 1
+        last = today
+    elif window and re.fullmatch(r"[1-9][0-9]*d", window):
+        first = today - int(window[:-1]) + 1
+        last = today
+    else:
+        raise ValueError(f"Unknown leaderboard window '{window}'")
+
+    if first > last:
+        raise ValueError("Window starts after it ends")
+    # older buckets are gone
+    return max(first, today - LEADERBOARD_RETENTION_DAYS + 1), last
+
+
+def iso_day(day: int) -> str:
+    return date.fromordinal(day).isoformat()
+
+
+class _DayBuckets:
+    """Points won per day, in a ring holding the last `size` days."""
+
+    __slots__ = ("days", "points")
+
+    def __init__(self, size: int = LEADERBOARD_RETENTION_DAYS):
+        self.days = array("l", [-1]) * size
+        self.points = array("l", [0]) * size
+
+    def add(self, day: int, delta: int) -> bool:
+        """Add points won on a day. True if that dropped an older day's points."""
+        i = day % len(self.days)
+        dropped = False
+        if self.days[i] != day:
+            if self.days[i] > day:
+                return False  # older than the ring reaches
+            dropped = self.days[i] >= 0 and self.points[i] != 0
+            self.days[i], self.points[i] = day, 0
+        self.points[i] += delta
+        return dropped
+
+    def total(self, first: int, last: int) -> int:
+        size = len(self.days)
+        return sum(
+            self.points[d % size]
+            for d in range(max(first, last - size + 1), last + 1)
+            if self.days[d % size] == d
+        )
+
+    def items(self, since: int) -> list:
+        """(day, points) for the kept days from `since` on."""
+        return [(d, p) for d, p in zip(self.days, self.points) if d >= since and p]
+
+
+class _Ranking:
+    """Points per student plus a list of (-points, userid) kept sorted."""
+
+    def __init__(self, points: dict = None):
+        self.points = dict(points or {})
+        self._order = sorted((-p, u) for u, p in self.points.items())
+
+    def __len__(self):
+        return len(self._order)
+
+    def set(self, userid: str, points: int):
+        self.remove(userid)
+        self.points[userid] = points
+        insort(self._order, (-points, userid))
+
+    def add(self, userid: str, delta: int):
+        self.set(userid, self.points.get(userid, 0) + delta)
+
+    def remove(self, userid: str):
+        old = self.points.pop(userid, None)
+        if old is not None:
+            del self._order[bisect_left(self._order, (-old, userid))]
+
+    def rank(self, userid: str):
+        """1-based rank, students with equal points share one. None if not ranked."""
+        points = self.points.get(userid)
+        if points is None:
+            return None
+        return bisect_left(self._order, (-points, "")) + 1
+
+    def page(self, offset: int, limit: int) -> list:
+        rows = []
+        for neg_points, userid in self._order[offset:offset + limit]:
+            rows.append({"userid": userid, "points": -neg_points, "rank": bisect_left(self._order, (neg_points, "")) + 1})
+        return rows
+
+
+class LeaderboardView:
+    """This worker's copy of the points log, as per-class and global rankings."""
+
+    def __init__(self, storage):
+        self.storage = storage
+        self._lock = threading.Lock()
+        self._cursor = None
+        self._totals = {}        # (userid, class_id) -> points
+        self._class_counts = {}  # userid -> number of classes with a total
+        self._classes = {}       # class_id -> _Ranking
+        self._global = _Ranking()
+        self._buckets = {}       # (userid, class_id) -> _DayBuckets
+        self._log_entries = 0    # entries read since the log was last rewritten
+        self._students = set()   # userids known to be student accounts
+        self._windows = {}       # (class_id, first, last) -> _Ranking, kept up to date by _apply
+        self.reloads = 0
+        self.compactions = 0
+
+    def _reset(self):
+        self._totals, self._class_counts, self._classes, self._global = {}, {}, {}, _Ranking()
+        self._buckets = {}
+        self._windows = {}
+        self._log_entries = 0
+        self._students = {row["userid"] for row in self.storage.list_users("STUDENT")}
+
+    def _is_student(self, userid: str) -> bool:
+        # the log outlives accounts (a reset of users/, a restored backup), their points don't count
+        if userid in self._students:
+            return True
+        if not is_student(self.storage.get_user_by_id(userid)):
+            return False
+        self._students.add(userid)
+        return True
+
+    def _apply(self, userid: str, class_id: str, points, day: int = None, delta: int = 0):
+        key = (userid, class_id)
+        if points is None:
+            self._buckets.pop(key, None)
+            self._drop_windows(class_id)
+        elif day is not None:
+            buckets = self._buckets.get(key)
+            if buckets is None:
+                buckets = self._buckets[key] = _DayBuckets()
+            if buckets.add(day, delta):
+                self._drop_windows(class_id)
+            elif delta:
+                self._add_to_windows(userid, class_id, day, delta)
+
+        old = self._totals.pop(key, None)
+        ranking = self._classes.setdefault(class_id, _Ranking())
+        if old is not None:
+            ranking.remove(userid)
+            self._class_counts[userid] -= 1
+        if points is not None:
+            self._totals[key] = points
+            ranking.set(userid, points)
+            self._class_counts[userid] = self._class_counts.get(userid, 0) + 1
+
+        if self._class_counts.get(userid):
+            self._global.add(userid, (points or 0) - (old or 0))
+        else:
+            # progress deleted from their last class
+            self._class_counts.pop(userid, None)
+            self._global.remove(userid)
+        if not ranking:
+            del self._classes[class_id]
+
+    def _read_log(self):
+        self._cursor, entries, full = self.storage.read_points_log(self._cursor)
+        if full:
+            self._reset()
+            self.reloads += 1
+        for entry in entries:
+            if self._is_student(entry[0]):
+                self._apply(*entry)
+        self._log_entries += len(entries)
+
+    def refresh(self):
+        """Apply whatever was appended to the points log since the last call."""
+        # the storage lock is always taken before self._lock, never inside it
+        if self._cursor is None and not self.storage.has_points_log():
+            with lock("leaderboard"), self.storage.transaction():
+                if not self.storage.has_points_log():
+                    self.storage.rewrite_points_log(recount(self.storage))
+
+        with self._lock:
+            self._read_log()
+            compact = self._log_entries > LEADERBOARD_COMPACT_FACTOR * len(self._totals) + 1000
+        if compact:
+            self.compact()
+
+    def compact(self):
+        """Rewrite the points log with just the current totals."""
+        # the transaction keeps SQLite appends (which don't take the lock) out meanwhile
+        with lock("leaderboard"), self.storage.transaction(), self._lock:
+            self._read_log()
+            self.storage.rewrite_points_log(self._entries(self._totals))
+            self.compactions += 1
+
+    def _entries(self, totals: dict) -> list:
+        """Log entries that recreate these totals and the day buckets we keep for them."""
+        since = date.today().toordinal() - LEADERBOARD_RETENTION_DAYS + 1
+        entries = []
+        for (userid, class_id), points in totals.items():
+            entries.append((userid, class_id, points))
+            buckets = self._buckets.get((userid, class_id))
+            if buckets is not None:
+                entries.extend((userid, class_id, points, d, p) for d, p in buckets.items(since))
+        return entries
+
+    def entries_for(self, totals: dict) -> list:
+        self.refresh()
+        with self._lock:
+            return self._entries(totals)
+
+    def points(self, userid: str, class_id: str):
+        """Current total for one student in one class, None if they have no progress there."""
+        self.refresh()
+        with self._lock:
+            return self._totals.get((userid, class_id))
+
+    def _ranking(self, class_id: str = None, days: tuple = None) -> _Ranking:
+        if days is not None:
+            return self._window_ranking(class_id, *days)
+        if class_id is None:
+            return self._global
+        return self._classes.get(class_id) or _Ranking()
+
+    def _drop_windows(self, class_id: str):
+        for window in [w for w in self._windows if w[0] in (class_id, None)]:
+            del self._windows[window]
+
+    def _add_to_windows(self, userid: str, class_id: str, day: int, delta: int):
+        """Keep the cached window rankings that include the day up to date with an answer."""
+        for (window_class, first, last), ranking in self._windows.items():
+            if window_class not in (class_id, None) or not first <= day <= last:
+                continue
+            if day <= last - LEADERBOARD_RETENTION_DAYS:
+                continue  # before what the buckets keep for the window
+            ranking.add(userid, delta)
+            if ranking.points[userid] == 0:
+                ranking.remove(userid)
+
+    def _window_ranking(self, class_id, first: int, last: int) -> _Ranking:
+        """
+        Students who won or lost points between two days, by those points.
+        Summed from the buckets once, then kept up to date as answers come in.
+        """
+        window = (class_id, first, last)
+        ranking = self._windows.get(window)
+        if ranking is None:
+            if len(self._windows) >= WINDOW_CACHE_SIZE:
+                del self._windows[next(iter(self._windows))]  # the oldest, like yesterday's "today"
+            ranking = self._windows[window] = self._sum_window(class_id, first, last)
+        return ranking
+
+    def _sum_window(self, class_id, first: int, last: int) -> _Ranking:
+        if class_id is not None:
+            ranking = self._classes.get(class_id)
+            keys = [(u, class_id) for u in ranking.points] if ranking else []
+        else:
+            keys = self._totals
+        points = {}
+        for key in keys:
+            buckets = self._buckets.get(key)
+            points[key[0]] = points.get(key[0], 0) + (buckets.total(first, last) if buckets else 0)
+        return _Ranking({userid: p for userid, p in points.items() if p})
+
+    def page(self, class_id: str = None, offset: int = 0, limit: int = None,
+             days: tuple = None, userid: str = None) -> tuple:
+        """
+        (number of ranked students, rows of userid/points/rank, userid's own row
+        or None) for one page. days=(first, last) ranks by points won in that window.
+        """
+        self.refresh()
+        with self._lock:
+            ranking = self._ranking(class_id, days)
+            rows = ranking.page(offset, len(ranking) if limit is None else limit)
+            return len(ranking), rows, self._row(ranking, userid)
+
+    def rank(self, userid: str, class_id: str = None, days: tuple = None):
+        """{"userid", "points", "rank"} for one student, or None if not ranked."""
+        self.refresh()
+        with self._lock:
+            return self._row(self._ranking(class_id, days), userid)
+
+    @staticmethod
+    def _row(ranking: _Ranking, userid: str):
+        rank = ranking.rank(userid) if userid else None
+        if rank is None:
+            return None
+        return {"userid": userid, "points": ranking.points[userid], "rank": rank}
+
+    def totals(self) -> dict:
+        self.refresh()
+        with self._lock:
+            return dict(self._totals)
+
+    def stats(self) -> dict:
+        """Sizes and reload counters, for /metrics."""
+        with self._lock:
+            return {
+                "students": len(self._global),
+                "classes": len(self._classes),
+                "totals": len(self._totals),
+                "day_buckets": len(self._buckets),
+                "log_entries": self._log_entries,
+                "reloads": self.reloads,
+                "compactions": self.compactions,
+            }
+
+
+def recount(storage) -> list:
+    """(userid, class_id, points) for every student's progress document, the slow way."""
+    entries = []
+    for userid, class_id in storage.list_progress_keys():
+        if not is_student(storage.get_user_by_id(userid)):
+            continue  # progress left behind by an account that no longer exists
+        try:
+            progress = storage.get_progress(userid, class_id)
+        except Exception as e:
+            print(f"[WARN] Skipping unreadable progress of {userid} in {class_id}: {e}")
+            continue
+        if progress is not None:
+            entries.append((userid, class_id, compute_points(progress)))
+    return entries
+
+
+def rebuild(storage) -> int:
+    """Recount every total and replace the points log with the result."""
+    # holding the lock keeps answers from being appended to the log we replace
+    with lock("leaderboard"), storage.transaction():
+        totals = {(u, c): p for u, c, p in recount(storage)}
+        storage.rewrite_points_log(storage.leaderboard.entries_for(totals))
+    return len(totals)
+
+
+def verify(storage) -> list:
+    """(userid, class_id, view points, recounted points) for every total that disagrees."""
+    view = storage.leaderboard.totals()
+    expected = {(u, c): p for u, c, p in recount(storage)}
+    return [
+        (u, c, view.get((u, c)), expected.get((u, c)))
+        for u, c in sorted(set(view) | set(expected))
+        if view.get((u, c)) != expected.get((u, c))
+    ]
+
+
+if __name__ == "__main__":
+    from storage import get_storage
+
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "rebuild":
+        print(f"Rebuilt leaderboard from {rebuild(get_storage())} progress documents")
+    elif command == "verify":
+        mismatches = verify(get_storage())
+        for userid, class_id, have, want in mismatches:
+            print(f"[WARN] {userid} in {class_id}: leaderboard has {have}, progress says {want}")
+        print(f"{len(mismatches)} mismatches")
+        sys.exit(1 if mismatches else 0)
+    else:
+        print("usage: python leaderboard.py rebuild|verify")
+        sys.exit(1)
@@ -0,0 +1,281 @@
+"""
+Model providers for theming questions.
+
+get_provider() returns the provider selected by LLM_PROVIDER (calls to it
+go through dispatcher.get_dispatcher(), which limits how many run at once):
+
+    gemini - Google Gemini (GEMINI_MODEL, key from GEMINI_API_KEY)
+    stub   - a local fake that answers in the format theme_questions() asks
+             for, without a network or a key. Latency, format errors and
+             wrong answers are drawn at the configured rates, so load tests
+             and CI can run the full complete-lesson path with realistic
+             timings and failures.
+
+A provider implements generate(system_instruction, prompt), returning the
+response text, and can implement generate_stream() to yield the text in
+pieces as the model writes it.
+
+model_available() says whether LLM_PROVIDER can be used at all (gemini
+needs EDU_GEMINI_API_KEY). Without it lessons are themed by the offline
+engine only, rather than every job and request failing on its own.
+"""
+
+import math
+import random
+import re
+import threading
+import time
+
+from constants import (
+    LLM_PROVIDER,
+    GEMINI_API_KEY,
+    GEMINI_MODEL,
+    LLM_STUB_LATENCY_MS,
+    LLM_STUB_LATENCY_SIGMA,
+    LLM_STUB_PER_QUESTION_MS,
+    LLM_STUB_FORMAT_ERROR_RATE,
+    LLM_STUB_WRONG_ANSWER_RATE,
+    LLM_STUB_SEED,
+)
+
+
+class LLMProvider:
+    name = ""
+
+    def generate(self, system_instruction: str, prompt: str) -> str:
+        """Send one prompt and return the response text."""
+        raise NotImplementedError
+
+    def generate_stream(self, system_instruction: str, prompt: str):
+        """Yield the response text in pieces; providers without streaming yield it all at once."""
+        yield self.generate(system_instruction, prompt)
+
+    def stats(self) -> dict:
+        return {"provider": self.name}
+
+
+class GeminiProvider(LLMProvider):
+    name = "gemini"
+
+    def __init__(self, api_key: str = GEMINI_API_KEY, model: str = GEMINI_MODEL):
+        if not api_key:
+            raise ValueError("No Gemini API key, set EDU_GEMINI_API_KEY (or EDU_LLM_PROVIDER=stub to theme offline)")
+        from google import genai
+        from google.genai import types
+
+        self.model = model
+        self._types = types
+        self._client = genai.Client(api_key=api_key)
+
+    def generate(self, system_instruction: str, prompt: str) -> str:
+        response = self._client.models.generate_content(
+            model=self.model,
+            config=self._types.GenerateContentConfig(system_instruction=system_instruction),
+            contents=prompt,
+        )
+        return response.text or ""
+
+    def generate_stream(self, system_instruction: str, prompt: str):
+        for chunk in self._client.models.generate_content_stream(
+            model=self.model,
+            config=self._types.GenerateContentConfig(system_instruction=system_instruction),
+            contents=prompt,
+        ):
+            if chunk.text:
+                yield chunk.text
+
+    def stats(self) -> dict:
+        return {"provider": self.name, "model": self.model}
+
+
+_BLANK = re.compile(r"_+")
+_TERM = re.compile(r"\s*([+-])?\s*(\d+|x)\s*")
+
+
+def _side(expr: str, x: int):
+    """Value of a sum like '14 + x - 7' at x, or None if it isn't one."""
+    total, pos = 0, 0
+    while pos < len(expr):
+        m = _TERM.match(expr, pos)
+        if m is None or (pos and m.group(1) is None):
+            return None
+        value = x if m.group(2) == "x" else int(m.group(2))
+        total += -value if m.group(1) == "-" else value
+        pos = m.end()
+    return total if pos else None
+
+
+def solve(question: str):
+    """
+    Answer of an addition/subtraction question with at most one blank,
+    e.g. '3 + 4 =' or '__ - 8 - 7 = -6'. None for anything else.
+    """
+    text = _BLANK.sub("x", question.replace("−", "-"))
+    if text.count("x") > 1 or text.count("=") != 1:
+        return None
+    left, right = (s.strip() for s in text.split("="))
+    if not right:
+        right = "x"
+    values = []
+    for x in (0, 1):
+        a, b = _side(left, x), _side(right, x)
+        if a is None or b is None:
+            return None
+        values.append(a - b)
+    slope = values[1] - values[0]
+    if slope == 0:
+        return None
+    return -values[0] // slope
+
+
+class StubProvider(LLMProvider):
+    """
+    Local fake of the model for tests and load tests. It reads the theme,
+    the questions and the lines the answer should have from the prompts
+    helpers.theming_prompt() and details_prompt() build, works out the
+    answers itself (see solve()) and writes one block per question.
+    """
+
+    name = "stub"
+
+    def __init__(self, latency_ms: float = LLM_STUB_LATENCY_MS, sigma: float = LLM_STUB_LATENCY_SIGMA,
+                 per_question_ms: float = LLM_STUB_PER_QUESTION_MS,
+                 format_error_rate: float = LLM_STUB_FORMAT_ERROR_RATE,
+                 wrong_answer_rate: float = LLM_STUB_WRONG_ANSWER_RATE, seed=LLM_STUB_SEED):
+        self.latency_ms = latency_ms
+        self.sigma = sigma
+        self.per_question_ms = per_question_ms
+        self.format_error_rate = format_error_rate
+        self.wrong_answer_rate = wrong_answer_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.format_errors = 0
+        self.wrong_answers = 0
+
+    def _draw(self):
+        with self._lock:
+            return self._random.random()
+
+    def _writing_time(self, lines: list) -> float:
+        """per_question_ms for a full five-line block, less for shorter ones."""
+        return self.per_question_ms * len(lines) / 5 / 1000
+
+    def _first_token_latency(self) -> float:
+        with self._lock:
+            spread = math.exp(self._random.gauss(0, self.sigma)) if self.sigma > 0 else 1.0
+        return self.latency_ms * spread / 1000
+
+    def _block(self, question: str, theme: str, labels: set, answer=None) -> list:
+        if answer is None:
+            answer = solve(question)
+            if answer is None:
+                # not arithmetic we understand, so the answer won't check out
+                answer = sum(map(ord, question)) % 100
+            elif self._draw() < self.wrong_answer_rate:
+                answer += 1
+                self.wrong_answers += 1
+        lines = [
+            f"Question: In a {theme} story, what number makes {question.strip()} true?",
+            f"Hint: Think about the {theme.lower()} numbers one at a time.",
+            f"Hint: Work through {question.strip()} from left to right.",
+            f"Solution: Working through {question.strip()} step by step gives {answer}.",
+            f"Numeric Solution: {answer}",
+        ]
+        return [line for line in lines if line.split(":", 1)[0] in labels]
+
+    def _mangle(self, lines: list) -> list:
+        """One of the ways the real model gets the format wrong."""
+        with self._lock:
+            kind = self._random.randrange(4)
+            at = self._random.randrange(len(lines))
+        if kind == 0:
+            del lines[at]  # a line goes missing
+        elif kind == 1:
+            lines[at] = lines[at].split(":", 1)[-1].strip()  # label left out
+        elif kind == 2:
+            lines.insert(at, "Here is another one:")  # chatter between blocks
+        elif at + 1 < len(lines):
+            lines[at] += " " + lines.pop(at + 1)  # two lines run together
+        return lines
+
+    def _blocks(self, system_instruction: str, prompt: str):
+        """The response, one list of lines per question."""
+        m = re.search(r"theme: (.*?)\.", system_instruction)
+        theme = m.group(1) if m else "Math"
+        labels = set(re.findall(r"(Numeric Solution|Question|Hint|Solution):", system_instruction))
+        self.calls += 1
+        fields = dict(line.split(":", 1) for line in prompt.splitlines()[1:] if ":" in line)
+        if "Problem" in fields:
+            # hints and solution for one question, whose answer is given
+            questions = [(fields["Problem"].strip(), fields.get("Answer", "").strip())]
+        else:
+            questions = [(q, None) for q in prompt.splitlines()[1:] if q.strip()]
+        for question, answer in questions:
+            lines = self._block(question, theme, labels, answer)
+            if self._draw() < self.format_error_rate:
+                lines = self._mangle(lines)
+                self.format_errors += 1
+            yield lines
+
+    def generate(self, system_instruction: str, prompt: str) -> str:
+        blocks = list(self._blocks(system_instruction, prompt))
+        time.sleep(self._first_token_latency() + sum(map(self._writing_time, blocks)))
+        return "\n".join(line for lines in blocks for line in lines)
+
+    def generate_stream(self, system_instruction: str, prompt: str):
+        # first piece after the call latency, then one block per question,
+        # cut mid-line the way a real stream arrives
+        time.sleep(self._first_token_latency())
+        for n, lines in enumerate(self._blocks(system_instruction, prompt)):
+            time.sleep(self._writing_time(lines))
+            text = ("\n" if n else "") + "\n".join(lines)
+            cut = len(text) // 2
+            yield text[:cut]
+            yield text[cut:]
+
+    def stats(self) -> dict:
+        return {
+            "provider": self.name,
+            "calls": self.calls,
+            "format_errors": self.format_errors,
+            "wrong_answers": self.wrong_answers,
+        }
+
+
+PROVIDERS = {
+    "gemini": GeminiProvider,
+    "stub": StubProvider,
+}
+
+_provider = None
+_provider_lock = threading.Lock()
+_unavailable = None  # why LLM_PROVIDER can't be used, "" if it can
+
+
+def model_available() -> bool:
+    """Whether LLM_PROVIDER is configured, checked (and warned about) once per process."""
+    global _unavailable
+    if _unavailable is None:
+        if LLM_PROVIDER not in PROVIDERS:
+            reason = f"Unknown LLM provider '{LLM_PROVIDER}'"
+        elif LLM_PROVIDER == "gemini" and not GEMINI_API_KEY:
+            reason = "No Gemini API key, set EDU_GEMINI_API_KEY (or EDU_LLM_PROVIDER=stub)"
+        else:
+            reason = ""
+        if reason:
+            print(f"[WARN] {reason}. Lessons are themed with the offline word-problem engine only")
+        _unavailable = reason
+    return not _unavailable
+
+
+def get_provider() -> LLMProvider:
+    """Return the process-wide model provider selected by LLM_PROVIDER."""
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                if not model_available():
+                    raise ValueError(_unavailable)
+                _provider = PROVIDERS[LLM_PROVIDER]()
+    return _provider
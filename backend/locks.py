@@ -0,0 +1,136 @@
+"""
+Lock manager for read-modify-write cycles on user and class data.
+
+Keys like ("progress", userid, class_id) or ("meta", class_id) are hashed
+onto a fixed number of stripes. Each stripe is an in-process RLock plus an
+advisory flock on LOCKS_FOLDER/<stripe>.lock, so the same key is
+serialized across threads and across gunicorn workers. Two keys may share
+a stripe; that only costs some extra waiting.
+
+The few files everybody shares, GLOBAL_LOCKS, aren't striped: each has
+its own lock (and LOCKS_FOLDER/<name>.lock), so it never shares a stripe
+with a per-user or per-class key.
+
+Locks are re-entrant within a thread. To keep two threads from taking the
+same locks in opposite order, a thread takes them in this order:
+
+1. at most one striped key at a time (progress, meta, profile, ...),
+2. then global locks, in GLOBAL_LOCKS order, always last.
+
+So holding progress_lock() and appending to the leaderboard log is fine,
+taking a key lock while holding lock("leaderboard") isn't. lock() raises
+RuntimeError for a lock taken out of order.
+"""
+
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines, in-process locking only
+    fcntl = None
+
+from constants import LOCKS_FOLDER, LOCK_STRIPES, LOCK_WAIT_WARN_SECONDS
+
+
+# global resources, in the order they may be nested
+GLOBAL_LOCKS = ("auth_table", "classes_csv", "leaderboard")
+
+
+class _Stripe:
+    def __init__(self, name: str, rank: int = -1):
+        self.name = name
+        self.rank = rank  # position in GLOBAL_LOCKS, -1 for a key stripe
+        self.lock = threading.RLock()
+        self.depth = 0
+        self.file = None
+
+    def acquire(self):
+        self.lock.acquire()
+        if self.depth == 0 and fcntl is not None:
+            try:
+                LOCKS_FOLDER.mkdir(parents=True, exist_ok=True)
+                self.file = open(LOCKS_FOLDER / f"{self.name}.lock", "a")
+                fcntl.flock(self.file, fcntl.LOCK_EX)
+            except BaseException:
+                if self.file is not None:
+                    self.file.close()
+                    self.file = None
+                self.lock.release()
+                raise
+        self.depth += 1
+
+    def release(self):
+        self.depth -= 1
+        if self.depth == 0 and self.file is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
+        self.lock.release()
+
+
+_stripes = [_Stripe(f"{i:03d}") for i in range(LOCK_STRIPES)]
+_globals = {name: _Stripe(name, rank) for rank, name in enumerate(GLOBAL_LOCKS)}
+_held = threading.local()  # stripes this thread holds, in the order taken
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _record_wait(kind: str, waited: float):
+    with _stats_lock:
+        s = _stats.setdefault(kind, {"acquired": 0, "total_wait_ms": 0.0, "max_wait_ms": 0.0})
+        s["acquired"] += 1
+        s["total_wait_ms"] += waited * 1000
+        s["max_wait_ms"] = max(s["max_wait_ms"], waited * 1000)
+
+    if waited > LOCK_WAIT_WARN_SECONDS:
+        print(f"[WARN] Waited {waited:.2f}s for {kind} lock")
+
+
+@contextmanager
+def lock(kind: str, *parts):
+    """Hold the lock for (kind, *parts) for the duration of the block."""
+    if not parts and kind in _globals:
+        stripe = _globals[kind]
+    else:
+        name = ":".join([kind, *map(str, parts)])
+        stripe = _stripes[zlib.crc32(name.encode()) % LOCK_STRIPES]
+    held = _held.__dict__.setdefault("stripes", [])
+    if held and stripe not in held and stripe.rank <= held[-1].rank:
+        raise RuntimeError(f"{kind} lock taken after the {held[-1].name} lock, see the lock order in locks.py")
+
+    start = time.perf_counter()
+    stripe.acquire()
+    _record_wait(kind, time.perf_counter() - start)
+    held.append(stripe)
+    try:
+        yield
+    finally:
+        held.pop()
+        stripe.release()
+
+
+def progress_lock(userid: str, class_id: str):
+    return lock("progress", userid, class_id)
+
+
+def class_meta_lock(class_id: str):
+    return lock("meta", class_id)
+
+
+def profile_lock(userid: str):
+    return lock("profile", userid)
+
+
+def lock_stats() -> dict:
+    """Acquisition count and wait times per lock kind, for /metrics."""
+    with _stats_lock:
+        return {
+            kind: {
+                **s,
+                "avg_wait_ms": s["total_wait_ms"] / s["acquired"] if s["acquired"] else 0.0,
+            }
+            for kind, s in _stats.items()
+        }
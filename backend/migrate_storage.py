@@ -0,0 +1,74 @@
+"""
+One-shot migration of the users/ folder layout into the SQLite backend.
+
+Run from the backend folder:
+    python migrate_storage.py [path/to/edu.sqlite3]
+
+Safe to re-run, every record is upserted. Lesson HTML stays in the content store.
+Files that fail to parse are reported and skipped.
+"""
+
+import sys
+from pathlib import Path
+
+from constants import SQLITE_DB
+from paths import iter_user_folders, iter_class_folders
+from storage import FileStorage, SQLiteStorage
+
+
+def migrate(db_path: Path = SQLITE_DB):
+    src = FileStorage()
+    dst = SQLiteStorage(db_path)
+    counts = {"users": 0, "profiles": 0, "classes": 0, "progress": 0, "skipped": 0}
+
+    def read(fn, *args):
+        try:
+            return fn(*args)
+        except ValueError as e:
+            print(f"[WARN] Skipping unreadable {fn.__name__}{args}: {e}")
+            counts["skipped"] += 1
+            return None
+
+    with dst.transaction():
+        for row in src.list_users():
+            dst.add_user(row)
+            counts["users"] += 1
+
+        for row in src.list_classes():
+            dst.add_class(row)
+            counts["classes"] += 1
+
+        # meta/template folders can exist without a classes.csv row
+        for class_id, _ in iter_class_folders():
+            meta = read(src.get_class_meta, class_id)
+            if meta is not None:
+                dst.save_class_meta(class_id, meta)
+            template = read(src.get_class_template, class_id)
+            if template is not None:
+                dst.save_class_template(class_id, template)
+            manifest = read(src.get_class_manifest, class_id)
+            if manifest is not None:
+                dst.save_class_manifest(class_id, manifest)
+
+        for userid, _ in iter_user_folders():
+            profile = read(src.get_profile, userid)
+            if profile is not None:
+                dst.save_profile(userid, profile)
+                counts["profiles"] += 1
+
+            for class_id in src.list_user_class_ids(userid):
+                progress = read(src.get_progress, userid, class_id)
+                if progress is not None:
+                    dst.save_progress(userid, class_id, progress)
+                    counts["progress"] += 1
+                overlay = read(src.get_class_overlay, userid, class_id)
+                if overlay is not None:
+                    dst.save_class_overlay(userid, class_id, overlay)
+
+    return counts
+
+
+if __name__ == "__main__":
+    db_path = Path(sys.argv[1]) if len(sys.argv) > 1 else SQLITE_DB
+    counts = migrate(db_path)
+    print(f"Migrated into {db_path}: " + ", ".join(f"{n} {k}" for k, n in counts.items()))
@@ -0,0 +1,147 @@
+"""
+Where user and class folders live on disk.
+
+Folders are spread over two levels of hashed shard directories so no single
+directory grows with the number of users or classes:
+
+    users/<ab>/<cd>/<userid>/                 profile.json, classes/<cid>/...
+    users/classes/<ab>/<cd>/<class_id>/       meta.json, template.json, ...
+
+<ab><cd> are the first hex digits of md5(id), so ids that are not UUIDs
+(like "default_math") spread out too.
+
+Reads fall back to the old flat layout (users/<userid>/, users/classes/<id>/)
+so the server keeps working while migrate_layout() moves folders over:
+
+    python paths.py migrate
+"""
+
+import hashlib
+import os
+import shutil
+import sys
+from pathlib import Path
+
+from constants import USERSFOLDER, CLASSES_FOLDER, CONTENT_STORE, SHARD_LEVELS
+
+SHARD_WIDTH = 2
+
+
+def _shard_parts(key: str) -> list:
+    digest = hashlib.md5(key.encode("utf-8")).hexdigest()
+    return [digest[i * SHARD_WIDTH:(i + 1) * SHARD_WIDTH] for i in range(SHARD_LEVELS)]
+
+
+def _is_shard_name(name: str) -> bool:
+    return len(name) == SHARD_WIDTH and all(c in "0123456789abcdef" for c in name)
+
+
+def _resolve(root: Path, key: str) -> Path:
+    """Sharded folder if it exists or nothing exists yet, else the legacy flat folder."""
+    sharded = root.joinpath(*_shard_parts(key), key)
+    if sharded.exists():
+        return sharded
+    legacy = root / key
+    if legacy.exists():
+        return legacy
+    return sharded
+
+
+def user_folder(userid: str) -> Path:
+    return _resolve(USERSFOLDER, userid)
+
+
+def student_class_folder(userid: str, class_id: str) -> Path:
+    return user_folder(userid) / "classes" / class_id
+
+
+def class_folder(class_id: str) -> Path:
+    return _resolve(CLASSES_FOLDER, class_id)
+
+
+def _iter_folders(root: Path, skip=()):
+    """Every id folder under root, sharded or legacy."""
+    if not root.exists():
+        return
+    for entry in root.iterdir():
+        if not entry.is_dir() or entry in skip or entry.name.startswith("."):
+            continue
+        if not _is_shard_name(entry.name):
+            yield entry
+            continue
+        level = [entry]
+        for _ in range(SHARD_LEVELS - 1):
+            level = [d for parent in level for d in parent.iterdir() if d.is_dir()]
+        for parent in level:
+            yield from (d for d in parent.iterdir() if d.is_dir())
+
+
+def iter_user_folders():
+    """(userid, folder) for every user folder in either layout."""
+    for folder in _iter_folders(USERSFOLDER, skip={CLASSES_FOLDER, CONTENT_STORE}):
+        yield folder.name, folder
+
+
+def iter_class_folders():
+    """(class_id, folder) for every class folder in either layout."""
+    for folder in _iter_folders(CLASSES_FOLDER):
+        yield folder.name, folder
+
+
+# ---------- migration ----------
+
+def _merge_into(src: Path, dst: Path):
+    """Move files left in src into dst, keeping whichever copy is newer. Journals are appended."""
+    for path in list(src.rglob("*")):
+        if path.is_dir():
+            continue
+        target = dst / path.relative_to(src)
+        if path.suffix == ".jsonl" and target.exists():
+            with open(path, "rb") as f_in, open(target, "ab") as f_out:
+                f_out.write(f_in.read())
+            path.unlink()
+        elif not target.exists() or path.stat().st_mtime > target.stat().st_mtime:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(path, target)
+        else:
+            path.unlink()
+    shutil.rmtree(src, ignore_errors=True)
+
+
+def _migrate_folder(root: Path, key: str) -> bool:
+    legacy = root / key
+    if not legacy.is_dir():
+        return False
+    sharded = root.joinpath(*_shard_parts(key), key)
+    sharded.parent.mkdir(parents=True, exist_ok=True)
+    if sharded.exists():
+        _merge_into(legacy, sharded)
+    else:
+        # a rename is atomic, readers see either the old or the new folder
+        os.replace(legacy, sharded)
+    return True
+
+
+def migrate_layout() -> tuple:
+    """
+    Move flat user and class folders into their shards. Safe while the server
+    runs: a request that resolved the old path just before the move can
+    recreate a few files there, so a second pass merges those stragglers.
+    """
+    users, classes = set(), set()
+    for _ in range(2):
+        for userid, folder in list(iter_user_folders()):
+            if folder.parent == USERSFOLDER and _migrate_folder(USERSFOLDER, userid):
+                users.add(userid)
+        for class_id, folder in list(iter_class_folders()):
+            if folder.parent == CLASSES_FOLDER and _migrate_folder(CLASSES_FOLDER, class_id):
+                classes.add(class_id)
+    return len(users), len(classes)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["migrate"]:
+        print("usage: python paths.py migrate")
+        sys.exit(1)
+    users, classes = migrate_layout()
+    print(f"Moved {users} user folders and {classes} class folders into shards")
@@ -0,0 +1,143 @@
+"""
+Speculative theming of a student's next lesson.
+
+Theming a lesson only when complete-lesson unlocks it makes the student
+wait for the model right when they move on. Instead, once a student has
+answered LESSON_PREFETCH_THRESHOLD of a lesson's questions (seen through
+/student/update-question), the next lesson, still locked, is themed in the
+background at BACKGROUND priority:
+
+- the themed variants are staged in the locked lesson's "prefetch" entry
+  ({"theme", "status", "variants"}) rather than in its questions,
+- unlocking swaps the staged variants in (swap_in_prefetched()). If the
+  prefetch is still running, the job complete-lesson queues is the same job
+  (they share a dedupe key), and it puts the rest straight into the lesson,
+- a prefetch for a theme the student no longer has is thrown away. Its
+  variants are still in the shared theme cache, for other students.
+
+Each lesson is prefetched at most once. The counters are per worker
+process (a prefetch may be staged in one and swapped in by another), so
+sum them over the workers. A prefetch that is neither a hit nor wasted
+yet is outstanding: its lesson is still locked, maybe for good.
+"""
+
+import threading
+
+from constants import LESSON_PREFETCH, LESSON_PREFETCH_THRESHOLD
+from helpers import apply_variants
+from storage import get_storage
+from locks import progress_lock
+
+
+class PrefetchStats:
+    """How often unlocking a lesson found it prefetched, for /metrics."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = 0
+        self.hits = 0  # unlocked after the prefetch was done
+        self.partial_hits = 0  # unlocked while the prefetch was still running
+        self.misses = 0  # unlocked without a prefetch
+        self.wasted = 0  # unlocked with another theme than the prefetch was for, or replaced
+        self.questions_swapped = 0
+        self.questions_wasted = 0
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def stats(self) -> dict:
+        with self._lock:
+            unlocks = self.hits + self.partial_hits + self.misses + self.wasted
+            settled = self.hits + self.partial_hits + self.wasted
+            return {
+                "started": self.started,
+                "outstanding": self.started - settled,
+                "unlocks": unlocks,
+                "hits": self.hits,
+                "partial_hits": self.partial_hits,
+                "misses": self.misses,
+                "wasted": self.wasted,
+                "hit_rate": (self.hits + self.partial_hits) / unlocks if unlocks else 0.0,
+                # of the prefetches that got settled, not the ones still staged
+                "waste_rate": self.wasted / settled if settled else 0.0,
+                "questions_swapped": self.questions_swapped,
+                "questions_wasted": self.questions_wasted,
+            }
+
+
+prefetch_stats = PrefetchStats()
+
+
+def _lesson_to_prefetch(progress: dict, lesson_id: str):
+    """The lesson after lesson_id if it is locked and nothing themed it yet, else None."""
+    lesson_ids = list(progress["lessons"])
+    if lesson_id not in lesson_ids or lesson_ids[-1] == lesson_id:
+        return None
+    next_lesson_id = lesson_ids[lesson_ids.index(lesson_id) + 1]
+    lesson = progress["lessons"][next_lesson_id]
+    if lesson.get("unlocked") or "prefetch" in lesson or "theming" in lesson:
+        return None
+    return next_lesson_id
+
+
+def maybe_prefetch_next_lesson(userid: str, class_id: str, lesson_id: str):
+    """
+    Queue a prefetch of the lesson after lesson_id once enough of lesson_id
+    is answered. Returns the job id, None if there was nothing to do.
+    """
+    if not LESSON_PREFETCH:
+        return None
+    from class_utils import enqueue_theming
+
+    storage = get_storage()
+    progress = storage.read_progress(userid, class_id)
+    if progress is None or _lesson_to_prefetch(progress, lesson_id) is None:
+        return None
+    questions = [q for level in progress["lessons"][lesson_id]["questions"].values() for q in level]
+    answered = sum(q.get("time_taken") is not None for q in questions)
+    if not questions or answered < LESSON_PREFETCH_THRESHOLD * len(questions):
+        return None
+    profile = storage.get_profile(userid)
+    if profile is None or not profile.get("theme"):
+        return None
+
+    theme = profile["theme"]
+    with progress_lock(userid, class_id):
+        progress = storage.get_progress(userid, class_id)
+        next_lesson_id = progress and _lesson_to_prefetch(progress, lesson_id)
+        if not next_lesson_id:
+            return None
+        # marks the lesson as prefetched, so later answers don't queue it again
+        progress["lessons"][next_lesson_id]["prefetch"] = {"theme": theme, "status": "queued", "variants": {}}
+        storage.save_progress(userid, class_id, progress)
+    prefetch_stats.count("started")
+    print(f"Prefetching lesson {next_lesson_id} in {class_id} for {userid} ({answered}/{len(questions)} answered)")
+    return enqueue_theming(userid, class_id, next_lesson_id, theme, prefetch=True)
+
+
+def swap_in_prefetched(lesson: dict, theme: str) -> str:
+    """
+    Swap a lesson's staged prefetch into its questions as it gets unlocked,
+    with the student's progress lock held. Returns "hit", "partial_hit",
+    "miss" or "wasted".
+    """
+    staged = lesson.pop("prefetch", None)
+    lesson["theme"] = theme
+    if staged is None:
+        prefetch_stats.count("misses")
+        return "miss"
+    if staged["theme"] != theme:
+        prefetch_stats.count("wasted")
+        prefetch_stats.count("questions_wasted", len(staged["variants"]))
+        return "wasted"
+
+    prefetch_stats.count("questions_swapped", apply_variants(lesson, staged["variants"]))
+    if staged["status"] == "done":
+        prefetch_stats.count("hits")
+        lesson["theming"] = "done"
+        return "hit"
+    # the prefetch job carries on with the rest straight into the lesson, or its retry does
+    prefetch_stats.count("partial_hits")
+    lesson["theming"] = "running"
+    return "partial_hit"
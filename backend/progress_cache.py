@@ -0,0 +1,107 @@
+"""
+Process-wide LRU cache of parsed progress documents.
+
+Entries are keyed by (userid, class_id) and remember a stamp from the
+storage backend (file inode/mtime/size, or the row version in SQLite).
+A read only has to compare stamps, which is far cheaper than decoding the
+document again; a stamp that changed (another worker wrote) is a miss.
+
+Writes go through the cache as well: save_progress() stores the saved
+document and record_answer() applies the answer to the cached copy, each
+bumping the entry's version, so the next read doesn't reparse anything.
+
+Cached documents are shared between requests and must not be modified,
+see storage.read_progress().
+"""
+
+import threading
+from collections import OrderedDict
+
+from constants import PROGRESS_CACHE_SIZE
+
+
+class _Entry:
+    __slots__ = ("doc", "stamp", "version")
+
+    def __init__(self, doc, stamp, version: int):
+        self.doc = doc
+        self.stamp = stamp
+        self.version = version
+
+
+class ProgressCache:
+    def __init__(self, capacity: int = PROGRESS_CACHE_SIZE):
+        self.capacity = capacity
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.writes = 0
+
+    def get(self, key, stamp):
+        """Cached document if its stamp still matches, else None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.stamp != stamp:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.doc
+
+    def put(self, key, doc, stamp):
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._entries[key] = _Entry(doc, stamp, 1)
+            else:
+                entry.doc, entry.stamp = doc, stamp
+                entry.version += 1
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def update(self, key, old_stamp, fn, new_stamp):
+        """
+        Write-back for a change already made in storage: replace the cached
+        document with fn(doc), if the entry was current before the change.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            if entry.stamp != old_stamp:
+                # someone else changed it in between, reload on the next read
+                del self._entries[key]
+                return
+            entry.doc = fn(entry.doc)
+            entry.stamp = new_stamp
+            entry.version += 1
+            self.writes += 1
+
+    def version(self, key) -> int:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry.version if entry else 0
+
+    def drop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        """Hit/miss/eviction counters, for /metrics."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "write_backs": self.writes,
+            }
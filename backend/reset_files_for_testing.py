@@ -8,6 +8,8 @@ BASE = Path("users")
 CLASSES_FOLDER = BASE / "classes"
 AUTH_TABLE = BASE / "auth_table.csv"
 CLASSES_CSV = BASE / "classes.csv"
+# state kept next to the CSVs: the leaderboard points log and the SQLite databases
+STATE_FILES = [BASE / "leaderboard.jsonl", BASE / "jobs.sqlite3", BASE / "theme_cache.sqlite3", BASE / "edu.sqlite3"]
 
 """
 GPT script to quickly clear local db to start from scratch
@@ -48,6 +50,15 @@ def clear_csv_keep_header(csv_path: Path):
     print(f"[✓] Cleared {csv_path}, kept headers")
 
 
+def delete_files(paths: list):
+    """Delete these files, and the -wal/-shm files SQLite keeps next to a database."""
+    for path in paths:
+        for file in [path, path.with_name(path.name + "-wal"), path.with_name(path.name + "-shm")]:
+            if file.exists():
+                file.unlink()
+                print(f"[✓] Deleted {file}")
+
+
 def delete_other_folders(base: Path, exclude: list):
     """Delete all folders inside base except those in exclude list."""
     for item in base.iterdir():
@@ -72,6 +83,9 @@ def main():
     # 4️⃣ Delete all other folders inside users/
     delete_other_folders(BASE, exclude=["classes"])
 
+    # 5️⃣ Delete the leaderboard log and the databases, they'd still hold the old accounts
+    delete_files(STATE_FILES)
+
     print("\n=== RESET COMPLETE ===")
 
 
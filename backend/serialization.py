@@ -0,0 +1,152 @@
+"""
+Codecs for persisted documents (progress, profiles, class meta/templates).
+
+A codec name is a serializer optionally followed by a compressor:
+    json, json-pretty, orjson, msgpack, json+gzip, msgpack+zstd, ...
+
+Plain JSON output is written as-is so it stays readable. Anything binary
+(msgpack or compressed) starts with MAGIC + the codec name, so decode()
+can always tell what it is looking at. Old pretty-printed files keep
+loading without conversion.
+
+orjson, msgpack and zstandard are optional; codecs that need a missing
+package are simply not available.
+
+Convert existing files in place (stop the server first):
+    python serialization.py convert msgpack+zstd users/
+"""
+
+import gzip
+import json
+import sys
+from pathlib import Path
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from constants import PERSIST_CODEC
+
+MAGIC = b"\x89EDU"
+
+
+def _json_loads(raw):
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+SERIALIZERS = {
+    "json": (lambda data: json.dumps(data, separators=(",", ":")).encode("utf-8"), _json_loads),
+    "json-pretty": (lambda data: json.dumps(data, indent=2).encode("utf-8"), _json_loads),
+}
+if orjson is not None:
+    SERIALIZERS["orjson"] = (orjson.dumps, orjson.loads)
+if msgpack is not None:
+    SERIALIZERS["msgpack"] = (
+        lambda data: msgpack.packb(data, use_bin_type=True),
+        lambda raw: msgpack.unpackb(raw, raw=False),
+    )
+
+COMPRESSORS = {
+    "gzip": (lambda raw: gzip.compress(raw, compresslevel=6, mtime=0), gzip.decompress),
+}
+if zstandard is not None:
+    COMPRESSORS["zstd"] = (
+        lambda raw: zstandard.ZstdCompressor(level=3).compress(raw),
+        lambda raw: zstandard.ZstdDecompressor().decompress(raw),
+    )
+
+# serializers whose uncompressed output is plain JSON text, no header needed
+TEXT_SERIALIZERS = {"json", "json-pretty", "orjson"}
+
+
+def available_codecs() -> list:
+    names = list(SERIALIZERS)
+    names += [f"{s}+{c}" for s in SERIALIZERS for c in COMPRESSORS]
+    return names
+
+
+def _split(codec: str):
+    serializer, _, compressor = codec.partition("+")
+    if serializer not in SERIALIZERS or (compressor and compressor not in COMPRESSORS):
+        raise ValueError(f"Codec '{codec}' is not available, choose from {available_codecs()}")
+    return serializer, compressor
+
+
+def encode(data, codec: str = None) -> bytes:
+    codec = codec or PERSIST_CODEC
+    serializer, compressor = _split(codec)
+
+    raw = SERIALIZERS[serializer][0](data)
+    if compressor:
+        raw = COMPRESSORS[compressor][0](raw)
+    if serializer in TEXT_SERIALIZERS and not compressor:
+        return raw
+
+    name = codec.encode("ascii")
+    return MAGIC + bytes([len(name)]) + name + raw
+
+
+def decode(raw):
+    """Decode bytes written by encode() with any codec, or plain JSON text."""
+    if isinstance(raw, str):
+        return _json_loads(raw)
+    if not raw.startswith(MAGIC):
+        return _json_loads(raw)
+
+    length = raw[len(MAGIC)]
+    start = len(MAGIC) + 1
+    serializer, compressor = _split(raw[start:start + length].decode("ascii"))
+    body = raw[start + length:]
+    if compressor:
+        body = COMPRESSORS[compressor][1](body)
+    return SERIALIZERS[serializer][1](body)
+
+
+def codec_of(raw: bytes) -> str:
+    if raw.startswith(MAGIC):
+        length = raw[len(MAGIC)]
+        return raw[len(MAGIC) + 1:len(MAGIC) + 1 + length].decode("ascii")
+    return "json"
+
+
+def convert(paths: list, codec: str) -> int:
+    """Re-encode every .json file under the given paths in place."""
+    from helpers import load_json, write_json_atomic
+
+    _split(codec)
+    converted = 0
+    for root in map(Path, paths):
+        files = [root] if root.is_file() else root.rglob("*.json")
+        for path in files:
+            try:
+                data = load_json(path)
+            except ValueError as e:
+                print(f"[WARN] Skipping unreadable {path}: {e}")
+                continue
+            write_json_atomic(path, data, codec=codec)
+            converted += 1
+    return converted
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "convert":
+        print("usage: python serialization.py convert <codec> [paths...]")
+        print(f"codecs: {', '.join(available_codecs())}")
+        sys.exit(1)
+
+    target = sys.argv[2]
+    count = convert(sys.argv[3:] or ["users"], target)
+    print(f"Converted {count} files to {target}")
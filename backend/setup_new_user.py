@@ -1,10 +1,10 @@
-import csv
 from class_utils import join_teacher_class
 
 from datetime import datetime
 
-from constants import Role, AUTH_TABLE, USERSFOLDER
-from helpers import append_csv, write_json
+from constants import Role
+from storage import get_storage, AUTH_FIELDS
+from locks import lock
 from user_utils import hash_password, generate_new_student
 import uuid
 
@@ -12,12 +12,10 @@ def str_to_role(role_str: str) -> Role:
     return Role[role_str.upper()]
 
 def user_exists(username: str) -> bool:
-    with open(AUTH_TABLE, newline="") as f:
-        reader = csv.DictReader(f)
-        return any(row["username"] == username for row in reader)
+    return get_storage().get_user_by_username(username) is not None
 
 def add_user_to_auth_table(userid: str, username: str, hashed_pw: str, role: Role):
-    append_csv(AUTH_TABLE, [userid, username, hashed_pw, role.name], header=["userid", "username", "password", "role"])
+    get_storage().add_user({"userid": userid, "username": username, "hashed_password": hashed_pw, "role": role.name})
 
 # handle sign up and creating default math class
 # setup_new_user.py
@@ -28,9 +26,6 @@ def signup(username: str, password: str, role: str, class_id, security_qas, them
     class_id: for STUDENT this is an optional *teacher* class code.
               If empty/None, student just gets the default math setup.
     """
-    if user_exists(username):
-        return False, None
-
     userid = str(uuid.uuid4())
     hashed_pw = hash_password(password)
     role_enum = str_to_role(role)
@@ -49,17 +44,12 @@ def signup(username: str, password: str, role: str, class_id, security_qas, them
     else:
         flat_qas = ["", "", "", "", "", ""]
 
-    # Append to auth table
-    append_csv(
-        AUTH_TABLE,
-        [userid, username, hashed_pw, role_enum.name] + flat_qas,
-        header=[
-            "userid", "username", "hashed_password", "role",
-            "question1", "answer1_hash",
-            "question2", "answer2_hash",
-            "question3", "answer3_hash",
-        ],
-    )
+    # Append to auth table, the existence check and the append must not interleave
+    storage = get_storage()
+    with lock("auth_table"):
+        if user_exists(username):
+            return False, None
+        storage.add_user(dict(zip(AUTH_FIELDS, [userid, username, hashed_pw, role_enum.name] + flat_qas)))
 
     # ---- Role-specific handling ----
     if role_enum == Role.STUDENT:
@@ -85,7 +75,7 @@ def signup(username: str, password: str, role: str, class_id, security_qas, them
             "last_active": None,
             "classes_created": [],
         }
-        write_json(USERSFOLDER / userid / "profile.json", profile_data)
+        storage.save_profile(userid, profile_data)
 
     elif role_enum == Role.PARENT:
         profile_data = {
@@ -98,7 +88,7 @@ def signup(username: str, password: str, role: str, class_id, security_qas, them
             "last_login": datetime.now().isoformat(),
             "last_active": None,
         }
-        write_json(USERSFOLDER / userid / "profile.json", profile_data)
+        storage.save_profile(userid, profile_data)
 
     print(f"User '{username}' created successfully with role '{role_enum.name}' and id '{userid}'")
     return True, userid
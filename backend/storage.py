@@ -0,0 +1,804 @@
+"""
+Storage backends for users, classes and progress.
+
+FileStorage keeps the users/ folder layout (auth_table.csv, classes.csv,
+<user folder>/profile.json, <user folder>/classes/<cid>/progress.json, ...),
+see paths.py for where user and class folders live.
+SQLiteStorage keeps the same records in a single database file.
+
+Pick one with EDU_STORAGE_BACKEND=file|sqlite and always go through get_storage().
+Lesson HTML is not handled here, classes only keep a manifest into the content store.
+Every progress write also appends the new point total to the points log
+behind the leaderboard, see leaderboard.py.
+"""
+
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager, nullcontext
+from functools import partial
+
+from constants import (
+    AUTH_TABLE,
+    CLASSES_CSV,
+    STORAGE_BACKEND,
+    SQLITE_DB,
+    JOURNAL_COMPACT_AFTER,
+    DURABILITY_MODE,
+    LEADERBOARD_LOG,
+)
+from helpers import load_json, json_exists, write_json, write_json_atomic
+from auth_index import AuthIndex, AUTH_FIELDS
+from class_registry import ClassRegistry, CLASS_FIELDS, normalize_class_row
+from serialization import encode, decode
+from answer_journal import make_record, apply_answer_copy, fold, read_records, append_record
+from progress_cache import ProgressCache
+from leaderboard import LeaderboardView, compute_points, answer_delta, day_number
+from locks import lock, progress_lock
+from write_behind import get_writer
+from paths import user_folder, student_class_folder, class_folder, iter_user_folders
+
+
+def _stat_stamp(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+class _CachedProgressReads:
+    """Cached read-only progress lookups and answer scoring, shared by both backends."""
+
+    def read_progress(self, userid: str, class_id: str):
+        """
+        Progress for display and scoring, served from the progress cache.
+        The document is shared with other requests: don't modify it, use
+        get_progress() for read-modify-write.
+        """
+        key = (userid, class_id)
+        stamp = self._progress_stamp(userid, class_id)
+        progress = self.progress_cache.get(key, stamp)
+        if progress is None:
+            progress = self.get_progress(userid, class_id)
+            if progress is not None:
+                self.progress_cache.put(key, progress, stamp)
+        return progress
+
+    def progress_version(self, userid: str, class_id: str) -> int:
+        """Changes whenever this worker sees the progress change, 0 if not cached."""
+        key = (userid, class_id)
+        if self.progress_cache.get(key, self._progress_stamp(userid, class_id)) is None:
+            return 0
+        return self.progress_cache.version(key)
+
+    def _points_after_answer(self, userid: str, class_id: str, record: dict):
+        """
+        (new point total in the class, points the answer won or lost) once
+        record is applied, None without progress.
+        """
+        progress = self.read_progress(userid, class_id)
+        if progress is None:
+            return None
+        points = self.leaderboard.points(userid, class_id)
+        if points is None:
+            points = compute_points(progress)
+        delta = answer_delta(progress, record)
+        return points + delta, delta
+
+
+class FileStorage(_CachedProgressReads):
+    """The original users/ folder layout."""
+
+    name = "file"
+
+    def __init__(self):
+        self.auth = AuthIndex(AUTH_TABLE)
+        self.classes = ClassRegistry(CLASSES_CSV)
+        self.progress_cache = ProgressCache()
+        self.leaderboard = LeaderboardView(self)
+
+    # ---------- auth ----------
+
+    def get_user_by_username(self, username: str):
+        return self.auth.get_by_username(username)
+
+    def get_user_by_id(self, userid: str):
+        return self.auth.get_by_userid(userid)
+
+    def list_users(self, role: str = None) -> list:
+        return self.auth.list(role)
+
+    def add_user(self, row: dict):
+        self.auth.add(row)
+
+    def set_password(self, username: str, hashed_pw: str) -> bool:
+        return self.auth.set_password(username, hashed_pw)
+
+    # ---------- profiles ----------
+
+    def get_profile(self, userid: str):
+        profile_file = user_folder(userid) / "profile.json"
+        if json_exists(profile_file):
+            return load_json(profile_file)
+        return None
+
+    def save_profile(self, userid: str, profile: dict):
+        write_json(user_folder(userid) / "profile.json", profile)
+
+    # ---------- classes ----------
+
+    def get_class(self, class_id: str):
+        return self.classes.get(class_id)
+
+    def get_classes(self, class_ids: list) -> list:
+        return self.classes.get_many(class_ids)
+
+    def list_classes(self, teacher_id: str = None) -> list:
+        return self.classes.list(teacher_id)
+
+    def add_class(self, row: dict):
+        self.classes.add(row)
+        class_folder(normalize_class_row(row)["classid"]).mkdir(parents=True, exist_ok=True)
+
+    def delete_class(self, class_id: str) -> bool:
+        """Remove the class row and the class folder (meta, template and manifest)."""
+        deleted = self.classes.delete(class_id)
+
+        folder = class_folder(class_id)
+        get_writer().discard(folder)
+        if folder.exists():
+            shutil.rmtree(folder)
+        return deleted
+
+    def get_class_meta(self, class_id: str):
+        meta_file = class_folder(class_id) / "meta.json"
+        if json_exists(meta_file):
+            return load_json(meta_file)
+        return None
+
+    def save_class_meta(self, class_id: str, meta: dict):
+        write_json(class_folder(class_id) / "meta.json", meta)
+
+    def get_class_template(self, class_id: str):
+        template_file = class_folder(class_id) / "template.json"
+        if json_exists(template_file):
+            return load_json(template_file)
+        return None
+
+    def save_class_template(self, class_id: str, template: dict):
+        write_json(class_folder(class_id) / "template.json", template)
+
+    def get_class_manifest(self, class_id: str):
+        """{lesson_id: sha256} of the class's lesson HTML in the content store."""
+        manifest_file = class_folder(class_id) / "manifest.json"
+        if json_exists(manifest_file):
+            return load_json(manifest_file)
+        return None
+
+    def save_class_manifest(self, class_id: str, manifest: dict):
+        write_json(class_folder(class_id) / "manifest.json", manifest)
+
+    def get_class_overlay(self, userid: str, class_id: str):
+        """What one student's copy of a shared class changes in its template."""
+        overlay_file = student_class_folder(userid, class_id) / "overlay.json"
+        if json_exists(overlay_file):
+            return load_json(overlay_file)
+        return None
+
+    def save_class_overlay(self, userid: str, class_id: str, overlay: dict):
+        write_json(student_class_folder(userid, class_id) / "overlay.json", overlay)
+
+    # ---------- progress ----------
+
+    def _progress_stamp(self, userid: str, class_id: str):
+        folder = student_class_folder(userid, class_id)
+        return _stat_stamp(folder / "progress.json"), _stat_stamp(folder / "answers.jsonl")
+
+    @staticmethod
+    def _folded_journals(folder):
+        """answers.jsonl.<n>: journals folded into snapshots still waiting to be written, oldest first."""
+        return sorted(folder.glob("answers.jsonl.*"), key=lambda p: int(p.suffix[1:]))
+
+    def get_progress(self, userid: str, class_id: str):
+        """progress.json with any journaled answers folded in, a private copy the caller may modify."""
+        folder = student_class_folder(userid, class_id)
+        progress_file = folder / "progress.json"
+        if json_exists(progress_file):
+            records = read_records(folder / "answers.jsonl")
+            writer = get_writer()
+            if writer.mode == "relaxed" and writer.pending(progress_file) is None:
+                # left by a crash before the snapshot that folded them was written;
+                # on top of an older snapshot, or replaying what it already set
+                records = [r for journal in self._folded_journals(folder) for r in read_records(journal)] + records
+            return fold(load_json(progress_file), records)
+        return None
+
+    def save_progress(self, userid: str, class_id: str, progress: dict):
+        """
+        Write a full snapshot. It was read through get_progress, so the journal is already in it.
+        The document goes into the progress cache, don't modify it after saving.
+        """
+        folder = student_class_folder(userid, class_id)
+        journal = folder / "answers.jsonl"
+        if get_writer().mode != "relaxed":
+            write_json_atomic(folder / "progress.json", progress)
+            journal.unlink(missing_ok=True)
+        else:
+            # relaxed writes the snapshot later, and the answers in the journal are on disk
+            # already: set the journal aside and only drop it (and any set aside before,
+            # which the snapshot holds too) once the snapshot is written
+            folded = self._folded_journals(folder)
+            last = int(folded[-1].suffix[1:]) if folded else 0
+            if journal.exists():
+                last += 1
+                journal.rename(journal.with_name(f"answers.jsonl.{last}"))
+            write_json_atomic(folder / "progress.json", progress,
+                              on_written=partial(self._drop_folded_journals, folder, last) if last else None)
+        self.progress_cache.put((userid, class_id), progress, self._progress_stamp(userid, class_id))
+        self.append_points(userid, class_id, compute_points(progress))
+
+    def _drop_folded_journals(self, folder, last: int):
+        for journal in self._folded_journals(folder):
+            if int(journal.suffix[1:]) <= last:
+                journal.unlink(missing_ok=True)
+
+    def record_answer(self, userid: str, class_id: str, lesson_id: str, question_id: str,
+                      correct: bool, time_taken: int):
+        journal = student_class_folder(userid, class_id) / "answers.jsonl"
+        record = make_record(lesson_id, question_id, correct, time_taken)
+        with progress_lock(userid, class_id):
+            points = self._points_after_answer(userid, class_id, record)
+            before = self._progress_stamp(userid, class_id)
+            count = append_record(journal, record)
+            self.progress_cache.update((userid, class_id), before,
+                                       lambda progress: apply_answer_copy(progress, record),
+                                       self._progress_stamp(userid, class_id))
+            if points is not None:
+                self.append_points(userid, class_id, *points, day=day_number(record["ts"]))
+        if count >= JOURNAL_COMPACT_AFTER:
+            self.compact_progress(userid, class_id)
+
+    def compact_progress(self, userid: str, class_id: str) -> bool:
+        with progress_lock(userid, class_id):
+            if not (student_class_folder(userid, class_id) / "answers.jsonl").exists():
+                return False
+            progress = self.get_progress(userid, class_id)
+            if progress is None:
+                return False
+            self.save_progress(userid, class_id, progress)
+        return True
+
+    def compact_all_progress(self) -> int:
+        compacted = 0
+        for userid, folder in iter_user_folders():
+            for journal in folder.glob("classes/*/answers.jsonl"):
+                compacted += self.compact_progress(userid, journal.parent.name)
+        return compacted
+
+    def delete_progress(self, userid: str, class_id: str):
+        folder = student_class_folder(userid, class_id)
+        get_writer().discard(folder)
+        if folder.exists():
+            shutil.rmtree(folder)
+        self.progress_cache.drop((userid, class_id))
+        self.append_points(userid, class_id, None)
+
+    def list_user_class_ids(self, userid: str) -> list:
+        """Class ids the user has a progress folder for."""
+        classes_folder = user_folder(userid) / "classes"
+        if not classes_folder.exists():
+            return []
+        return [c.name for c in classes_folder.iterdir() if c.is_dir()]
+
+    def list_progress_keys(self):
+        """(userid, class_id) for every progress document."""
+        for userid, folder in iter_user_folders():
+            for progress_file in folder.glob("classes/*/progress.json"):
+                yield userid, progress_file.parent.name
+
+    # ---------- leaderboard points log ----------
+    # one JSON line per change: [userid, class_id, points], points null once the
+    # progress is deleted, or [userid, class_id, points, day, delta] for an answer.
+    # The first line names the log's generation, which changes whenever the log
+    # is rewritten.
+
+    def has_points_log(self) -> bool:
+        return LEADERBOARD_LOG.exists()
+
+    def append_points(self, userid: str, class_id: str, points, delta: int = 0, day: int = None):
+        entry = [userid, class_id, points] if day is None else [userid, class_id, points, day, delta]
+        with lock("leaderboard"):
+            if not LEADERBOARD_LOG.exists():
+                return  # the first read recounts everything anyway
+            with open(LEADERBOARD_LOG, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+
+    def read_points_log(self, cursor) -> tuple:
+        """
+        Entries after cursor, as (new cursor, entries, full). full means the
+        log was rewritten (or cursor is None) and entries are the whole log.
+        """
+        try:
+            f = open(LEADERBOARD_LOG, "rb")
+        except FileNotFoundError:
+            return None, [], True
+        with f:
+            generation = f.readline()
+            full = cursor is None or cursor[0] != generation
+            if not full:
+                f.seek(cursor[1])
+            data = f.read()
+            offset = f.tell()
+        # stop at the last complete line, a worker may be appending right now
+        end = data.rfind(b"\n") + 1
+        entries = [tuple(json.loads(line)) for line in data[:end].splitlines() if line]
+        return (generation, offset - len(data) + end), entries, full
+
+    def rewrite_points_log(self, entries: list):
+        """Replace the log with these entries. Callers hold lock("leaderboard")."""
+        LEADERBOARD_LOG.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = LEADERBOARD_LOG.with_suffix(".tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"generation": uuid.uuid4().hex}) + "\n")
+            f.writelines(json.dumps(list(entry)) + "\n" for entry in entries)
+        os.replace(temp_path, LEADERBOARD_LOG)
+
+    def transaction(self):
+        # every write above is a single file operation, nothing to group
+        return nullcontext()
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    userid TEXT PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE,
+    hashed_password TEXT,
+    role TEXT,
+    question1 TEXT, answer1_hash TEXT,
+    question2 TEXT, answer2_hash TEXT,
+    question3 TEXT, answer3_hash TEXT,
+    parent_id TEXT
+);
+CREATE INDEX IF NOT EXISTS users_role ON users (role);
+
+CREATE TABLE IF NOT EXISTS profiles (
+    userid TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS classes (
+    classid TEXT PRIMARY KEY,
+    class_name TEXT,
+    teacher_id TEXT,
+    description TEXT,
+    created_at TEXT,
+    meta TEXT,
+    template TEXT,
+    manifest TEXT
+);
+CREATE INDEX IF NOT EXISTS classes_teacher ON classes (teacher_id);
+
+CREATE TABLE IF NOT EXISTS progress (
+    userid TEXT NOT NULL,
+    classid TEXT NOT NULL,
+    data TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (userid, classid)
+);
+CREATE INDEX IF NOT EXISTS progress_class ON progress (classid);
+
+CREATE TABLE IF NOT EXISTS overlays (
+    userid TEXT NOT NULL,
+    classid TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (userid, classid)
+);
+
+CREATE TABLE IF NOT EXISTS answers (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    userid TEXT NOT NULL,
+    classid TEXT NOT NULL,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS answers_progress ON answers (userid, classid);
+
+CREATE TABLE IF NOT EXISTS points_log (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    userid TEXT NOT NULL,
+    classid TEXT NOT NULL,
+    points INTEGER,
+    day INTEGER,
+    delta INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS points_log_state (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    generation TEXT NOT NULL
+);
+"""
+
+# (table, column, declaration) added after the first release, for older databases
+ADDED_COLUMNS = [
+    ("classes", "manifest", "TEXT"),
+    ("progress", "version", "INTEGER NOT NULL DEFAULT 0"),
+    ("points_log", "day", "INTEGER"),
+    ("points_log", "delta", "INTEGER NOT NULL DEFAULT 0"),
+]
+
+
+# SQLite does its own group commit through the WAL, durability only picks the sync level
+SQLITE_SYNCHRONOUS = {
+    "strict": "FULL",
+    "grouped": "NORMAL",
+    "relaxed": "OFF",
+}
+
+
+def connect_sqlite(db_path):
+    """A connection in autocommit mode with WAL and the sync level for DURABILITY_MODE."""
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    # transactions are opened explicitly with BEGIN IMMEDIATE
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS[DURABILITY_MODE]}")
+    return conn
+
+
+class SQLiteStorage(_CachedProgressReads):
+    """All records in one SQLite database, one connection per thread."""
+
+    name = "sqlite"
+
+    def __init__(self, db_path=SQLITE_DB):
+        self.db_path = db_path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        # databases created before a column was added to the schema
+        for table, column, declaration in ADDED_COLUMNS:
+            existing = {r["name"] for r in conn.execute(f"PRAGMA table_info({table})")}
+            if column not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+        self.progress_cache = ProgressCache()
+        self.leaderboard = LeaderboardView(self)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect_sqlite(self.db_path)
+            self._local.conn = conn
+            self._local.depth = 0
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """
+        Group several calls into one atomic write.
+        Nested transactions join the outermost one.
+        """
+        conn = self._connect()
+        if self._local.depth == 0:
+            conn.execute("BEGIN IMMEDIATE")
+        self._local.depth += 1
+        try:
+            yield conn
+        except BaseException:
+            self._local.depth -= 1
+            if self._local.depth == 0:
+                conn.execute("ROLLBACK")
+            raise
+        self._local.depth -= 1
+        if self._local.depth == 0:
+            conn.execute("COMMIT")
+
+    def _query(self, sql: str, params=()) -> list:
+        return self._connect().execute(sql, params).fetchall()
+
+    # ---------- auth ----------
+
+    def get_user_by_username(self, username: str):
+        rows = self._query("SELECT * FROM users WHERE username = ?", (username,))
+        return dict(rows[0]) if rows else None
+
+    def get_user_by_id(self, userid: str):
+        rows = self._query("SELECT * FROM users WHERE userid = ?", (userid,))
+        return dict(rows[0]) if rows else None
+
+    def list_users(self, role: str = None) -> list:
+        if role:
+            rows = self._query("SELECT * FROM users WHERE role = ? ORDER BY rowid", (role.upper(),))
+        else:
+            rows = self._query("SELECT * FROM users ORDER BY rowid")
+        return [dict(r) for r in rows]
+
+    def add_user(self, row: dict):
+        with self.transaction() as conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO users ({', '.join(AUTH_FIELDS)}) "
+                f"VALUES ({', '.join('?' for _ in AUTH_FIELDS)})",
+                [row.get(k) or "" for k in AUTH_FIELDS],
+            )
+
+    def set_password(self, username: str, hashed_pw: str) -> bool:
+        with self.transaction() as conn:
+            cur = conn.execute(
+                "UPDATE users SET hashed_password = ? WHERE username = ?", (hashed_pw, username)
+            )
+        return cur.rowcount > 0
+
+    # ---------- profiles ----------
+
+    def get_profile(self, userid: str):
+        rows = self._query("SELECT data FROM profiles WHERE userid = ?", (userid,))
+        return decode(rows[0]["data"]) if rows else None
+
+    def save_profile(self, userid: str, profile: dict):
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO profiles (userid, data) VALUES (?, ?)",
+                (userid, encode(profile)),
+            )
+
+    # ---------- classes ----------
+
+    def get_class(self, class_id: str):
+        rows = self._query(
+            f"SELECT {', '.join(CLASS_FIELDS)} FROM classes WHERE classid = ?", (class_id,)
+        )
+        return dict(rows[0]) if rows else None
+
+    def get_classes(self, class_ids: list) -> list:
+        """Rows for the given ids, in that order, skipping unknown ids."""
+        if not class_ids:
+            return []
+        rows = self._query(
+            f"SELECT {', '.join(CLASS_FIELDS)} FROM classes WHERE classid IN ({', '.join('?' for _ in class_ids)})",
+            list(class_ids),
+        )
+        by_id = {r["classid"]: dict(r) for r in rows}
+        return [by_id[c] for c in class_ids if c in by_id]
+
+    def list_classes(self, teacher_id: str = None) -> list:
+        if teacher_id is not None:
+            rows = self._query(
+                f"SELECT {', '.join(CLASS_FIELDS)} FROM classes WHERE teacher_id = ? ORDER BY rowid",
+                (str(teacher_id),),
+            )
+        else:
+            rows = self._query(f"SELECT {', '.join(CLASS_FIELDS)} FROM classes ORDER BY rowid")
+        return [dict(r) for r in rows]
+
+    def add_class(self, row: dict):
+        values = [normalize_class_row(row)[k] for k in CLASS_FIELDS]
+        with self.transaction() as conn:
+            conn.execute(
+                f"INSERT INTO classes ({', '.join(CLASS_FIELDS)}) "
+                f"VALUES ({', '.join('?' for _ in CLASS_FIELDS)}) "
+                f"ON CONFLICT (classid) DO UPDATE SET "
+                + ", ".join(f"{k} = excluded.{k}" for k in CLASS_FIELDS[1:]),
+                values,
+            )
+
+    def delete_class(self, class_id: str) -> bool:
+        with self.transaction() as conn:
+            cur = conn.execute("DELETE FROM classes WHERE classid = ?", (class_id,))
+        # classes created before the content store may still have a content/ folder
+        folder = class_folder(class_id)
+        if folder.exists():
+            shutil.rmtree(folder)
+        return cur.rowcount > 0
+
+    def _get_class_column(self, class_id: str, column: str):
+        rows = self._query(f"SELECT {column} FROM classes WHERE classid = ?", (class_id,))
+        if not rows or rows[0][column] is None:
+            return None
+        return decode(rows[0][column])
+
+    def _set_class_column(self, class_id: str, column: str, value: dict):
+        with self.transaction() as conn:
+            cur = conn.execute(
+                f"UPDATE classes SET {column} = ? WHERE classid = ?", (encode(value), class_id)
+            )
+            if cur.rowcount == 0:
+                conn.execute(
+                    f"INSERT INTO classes (classid, {column}) VALUES (?, ?)",
+                    (class_id, encode(value)),
+                )
+
+    def get_class_meta(self, class_id: str):
+        return self._get_class_column(class_id, "meta")
+
+    def save_class_meta(self, class_id: str, meta: dict):
+        self._set_class_column(class_id, "meta", meta)
+
+    def get_class_template(self, class_id: str):
+        return self._get_class_column(class_id, "template")
+
+    def save_class_template(self, class_id: str, template: dict):
+        self._set_class_column(class_id, "template", template)
+
+    def get_class_manifest(self, class_id: str):
+        return self._get_class_column(class_id, "manifest")
+
+    def save_class_manifest(self, class_id: str, manifest: dict):
+        self._set_class_column(class_id, "manifest", manifest)
+
+    def get_class_overlay(self, userid: str, class_id: str):
+        rows = self._query(
+            "SELECT data FROM overlays WHERE userid = ? AND classid = ?", (userid, class_id)
+        )
+        return decode(rows[0]["data"]) if rows else None
+
+    def save_class_overlay(self, userid: str, class_id: str, overlay: dict):
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO overlays (userid, classid, data) VALUES (?, ?, ?)",
+                (userid, class_id, encode(overlay)),
+            )
+
+    # ---------- progress ----------
+
+    def _progress_stamp(self, userid: str, class_id: str):
+        rows = self._query(
+            "SELECT version, (SELECT MAX(seq) FROM answers WHERE userid = ? AND classid = ?) AS seq "
+            "FROM progress WHERE userid = ? AND classid = ?",
+            (userid, class_id, userid, class_id),
+        )
+        return (rows[0]["version"], rows[0]["seq"]) if rows else None
+
+    def _cache_after_commit(self, key, progress, stamp):
+        # inside an outer transaction the write could still be rolled back
+        if self._local.depth == 0:
+            self.progress_cache.put(key, progress, stamp)
+        else:
+            self.progress_cache.drop(key)
+
+    def get_progress(self, userid: str, class_id: str):
+        rows = self._query(
+            "SELECT data FROM progress WHERE userid = ? AND classid = ?", (userid, class_id)
+        )
+        if not rows:
+            return None
+        answers = self._query(
+            "SELECT record FROM answers WHERE userid = ? AND classid = ? ORDER BY seq", (userid, class_id)
+        )
+        return fold(decode(rows[0]["data"]), [json.loads(a["record"]) for a in answers])
+
+    def save_progress(self, userid: str, class_id: str, progress: dict):
+        """The document goes into the progress cache, don't modify it after saving."""
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT INTO progress (userid, classid, data, version) VALUES (?, ?, ?, 1) "
+                "ON CONFLICT (userid, classid) DO UPDATE SET data = excluded.data, version = version + 1",
+                (userid, class_id, encode(progress)),
+            )
+            conn.execute("DELETE FROM answers WHERE userid = ? AND classid = ?", (userid, class_id))
+            self.append_points(userid, class_id, compute_points(progress))
+            stamp = self._progress_stamp(userid, class_id)
+        self._cache_after_commit((userid, class_id), progress, stamp)
+
+    def record_answer(self, userid: str, class_id: str, lesson_id: str, question_id: str,
+                      correct: bool, time_taken: int):
+        record = make_record(lesson_id, question_id, correct, time_taken)
+        # scored before the transaction: refreshing the leaderboard may take its lock
+        points = self._points_after_answer(userid, class_id, record)
+        with self.transaction() as conn:
+            before = self._progress_stamp(userid, class_id)
+            conn.execute(
+                "INSERT INTO answers (userid, classid, record) VALUES (?, ?, ?)",
+                (userid, class_id, json.dumps(record)),
+            )
+            if points is not None:
+                self.append_points(userid, class_id, *points, day=day_number(record["ts"]))
+            count = conn.execute(
+                "SELECT COUNT(*) FROM answers WHERE userid = ? AND classid = ?", (userid, class_id)
+            ).fetchone()[0]
+            after = self._progress_stamp(userid, class_id)
+        if self._local.depth == 0:
+            self.progress_cache.update((userid, class_id), before,
+                                       lambda progress: apply_answer_copy(progress, record), after)
+        else:
+            self.progress_cache.drop((userid, class_id))
+        if count >= JOURNAL_COMPACT_AFTER:
+            self.compact_progress(userid, class_id)
+
+    def compact_progress(self, userid: str, class_id: str) -> bool:
+        # lock before the transaction, never the other way round
+        with progress_lock(userid, class_id), self.transaction():
+            progress = self.get_progress(userid, class_id)
+            if progress is None:
+                return False
+            self.save_progress(userid, class_id, progress)
+        return True
+
+    def compact_all_progress(self) -> int:
+        pairs = self._query("SELECT DISTINCT userid, classid FROM answers")
+        return sum(self.compact_progress(p["userid"], p["classid"]) for p in pairs)
+
+    def delete_progress(self, userid: str, class_id: str):
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM progress WHERE userid = ? AND classid = ?", (userid, class_id))
+            conn.execute("DELETE FROM answers WHERE userid = ? AND classid = ?", (userid, class_id))
+            conn.execute("DELETE FROM overlays WHERE userid = ? AND classid = ?", (userid, class_id))
+            self.append_points(userid, class_id, None)
+        self.progress_cache.drop((userid, class_id))
+
+    def list_user_class_ids(self, userid: str) -> list:
+        rows = self._query("SELECT classid FROM progress WHERE userid = ? ORDER BY rowid", (userid,))
+        return [r["classid"] for r in rows]
+
+    def list_progress_keys(self):
+        return [(r["userid"], r["classid"]) for r in self._query("SELECT userid, classid FROM progress")]
+
+    # ---------- leaderboard points log ----------
+    # same entries as FileStorage's log, one row each. Sequence numbers are never
+    # reused, so after a rewrite every row is newer than any old cursor.
+
+    def has_points_log(self) -> bool:
+        return bool(self._query("SELECT 1 FROM points_log_state"))
+
+    def append_points(self, userid: str, class_id: str, points, delta: int = 0, day: int = None):
+        with self.transaction() as conn:
+            # skipped until the first read has recounted everything
+            conn.execute(
+                "INSERT INTO points_log (userid, classid, points, day, delta) "
+                "SELECT ?, ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM points_log_state)",
+                (userid, class_id, points, day, delta),
+            )
+
+    def read_points_log(self, cursor) -> tuple:
+        """Entries after cursor, as (new cursor, entries, full), see FileStorage.read_points_log."""
+        # one statement, so the generation and the rows come from the same snapshot
+        rows = self._query(
+            "SELECT s.generation, l.seq, l.userid, l.classid, l.points, l.day, l.delta FROM points_log_state s "
+            "LEFT JOIN points_log l ON l.seq > ? ORDER BY l.seq",
+            (cursor[1] if cursor else 0,),
+        )
+        if not rows:
+            return None, [], True
+        generation = rows[0]["generation"]
+        full = cursor is None or cursor[0] != generation
+        entries = [
+            (r["userid"], r["classid"], r["points"]) if r["day"] is None
+            else (r["userid"], r["classid"], r["points"], r["day"], r["delta"])
+            for r in rows if r["seq"] is not None
+        ]
+        last_seq = rows[-1]["seq"] if entries else (cursor[1] if cursor else 0)
+        return (generation, last_seq), entries, full
+
+    def rewrite_points_log(self, entries: list):
+        """Replace the log with these entries. Callers hold lock("leaderboard")."""
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM points_log")
+            conn.executemany(
+                "INSERT INTO points_log (userid, classid, points, day, delta) VALUES (?, ?, ?, ?, ?)",
+                [(tuple(entry) + (None, 0))[:5] for entry in entries],
+            )
+            conn.execute(
+                "INSERT INTO points_log_state (id, generation) VALUES (1, ?) "
+                "ON CONFLICT (id) DO UPDATE SET generation = excluded.generation",
+                (uuid.uuid4().hex,),
+            )
+
+
+BACKENDS = {
+    "file": FileStorage,
+    "sqlite": SQLiteStorage,
+}
+
+_storage = None
+
+
+def get_storage():
+    """Return the process-wide storage backend selected by STORAGE_BACKEND."""
+    global _storage
+    if _storage is None:
+        if STORAGE_BACKEND not in BACKENDS:
+            raise ValueError(f"Unknown storage backend '{STORAGE_BACKEND}'")
+        _storage = BACKENDS[STORAGE_BACKEND]()
+    return _storage
@@ -0,0 +1,43 @@
+"""
+Shared fixtures for the backend tests.
+
+The modules under test live flat in backend/ and keep their data under the
+relative users/ folder, so every test runs in its own temporary directory.
+Run from the repository root or backend/:
+
+    python -m pytest -q backend/tests
+"""
+
+import os
+import sys
+from pathlib import Path
+
+# before anything imports constants.py, which reads the environment once
+os.environ.setdefault("EDU_LLM_PROVIDER", "stub")
+os.environ.setdefault("EDU_LLM_STUB_LATENCY_MS", "0")
+os.environ.setdefault("EDU_LLM_STUB_PER_QUESTION_MS", "0")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pytest
+
+import write_behind
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """An empty working directory, so users/ and the sqlite files land in tmp_path."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def writer(request, monkeypatch):
+    """
+    A fresh process-wide writer. Strict by default, parametrize with
+    indirect=True to pick another durability mode.
+    """
+    mode = getattr(request, "param", "strict")
+    instance = write_behind.WriteBehind(mode=mode, window_ms=0, interval=3600)
+    monkeypatch.setattr(write_behind, "_writer", instance)
+    return instance
@@ -0,0 +1,95 @@
+import json
+
+import pytest
+
+from answer_journal import make_record, apply_answer, apply_answer_copy, fold, read_records, append_record
+from helpers import write_json_atomic
+from paths import student_class_folder
+from storage import FileStorage
+
+
+def make_progress():
+    return {"lessons": {"L1": {"questions": {
+        "easy": [{"id": "q1", "correct": None, "time_taken": None},
+                 {"id": "q2", "correct": None, "time_taken": None}],
+        "hard": [{"id": "q3", "correct": None, "time_taken": None}],
+    }}}}
+
+
+def answers(progress):
+    return {q["id"]: (q["correct"], q["time_taken"])
+            for level in progress["lessons"]["L1"]["questions"].values() for q in level}
+
+
+def test_fold_applies_records_in_order():
+    records = [make_record("L1", "q1", False, 3),
+               make_record("L1", "q3", True, 8),
+               make_record("L1", "q1", True, 5)]
+    progress = fold(make_progress(), records)
+    assert answers(progress) == {"q1": (True, 5), "q2": (None, None), "q3": (True, 8)}
+
+
+def test_apply_answer_ignores_unknown_lessons_and_questions():
+    progress = make_progress()
+    assert not apply_answer(progress, make_record("L2", "q1", True, 1))
+    assert not apply_answer(progress, make_record("L1", "q9", True, 1))
+    assert progress == make_progress()
+
+
+def test_apply_answer_copy_leaves_the_original_alone():
+    progress = make_progress()
+    updated = apply_answer_copy(progress, make_record("L1", "q2", True, 4))
+    assert answers(updated)["q2"] == (True, 4)
+    assert progress == make_progress()
+    # only the path to the question is copied
+    assert updated["lessons"]["L1"]["questions"]["hard"] is progress["lessons"]["L1"]["questions"]["hard"]
+
+
+def test_read_records_skips_a_torn_last_line(workdir, writer):
+    journal = workdir / "answers.jsonl"
+    assert read_records(journal) == []
+    assert append_record(journal, make_record("L1", "q1", True, 5)) == 1
+    assert append_record(journal, make_record("L1", "q2", False, 6)) == 2
+    with open(journal, "a", encoding="utf-8") as f:
+        f.write(json.dumps(make_record("L1", "q3", True, 7))[:20])
+    assert [r["question_id"] for r in read_records(journal)] == ["q1", "q2"]
+
+
+@pytest.fixture
+def storage(writer):
+    storage = FileStorage()
+    write_json_atomic(student_class_folder("s1", "c1") / "progress.json", make_progress())
+    return storage
+
+
+def test_record_answer_journals_and_compaction_folds(storage):
+    folder = student_class_folder("s1", "c1")
+    storage.record_answer("s1", "c1", "L1", "q1", True, 5)
+    storage.record_answer("s1", "c1", "L1", "q3", False, 9)
+    assert len(read_records(folder / "answers.jsonl")) == 2
+    assert answers(storage.get_progress("s1", "c1"))["q1"] == (True, 5)
+
+    assert storage.compact_progress("s1", "c1")
+    assert not (folder / "answers.jsonl").exists()
+    assert answers(json.loads((folder / "progress.json").read_text()))["q3"] == (False, 9)
+    # nothing left to compact
+    assert not storage.compact_progress("s1", "c1")
+
+
+def test_compaction_after_threshold(storage, monkeypatch):
+    import storage as storage_module
+    monkeypatch.setattr(storage_module, "JOURNAL_COMPACT_AFTER", 3)
+    folder = student_class_folder("s1", "c1")
+    storage.record_answer("s1", "c1", "L1", "q1", True, 5)
+    storage.record_answer("s1", "c1", "L1", "q2", True, 6)
+    assert (folder / "answers.jsonl").exists()
+    storage.record_answer("s1", "c1", "L1", "q3", True, 7)
+    assert not (folder / "answers.jsonl").exists()
+    assert answers(storage.get_progress("s1", "c1")) == {"q1": (True, 5), "q2": (True, 6), "q3": (True, 7)}
+
+
+def test_compact_all_progress(storage):
+    storage.record_answer("s1", "c1", "L1", "q1", True, 5)
+    assert storage.compact_all_progress() == 1
+    assert storage.compact_all_progress() == 0
+
@@ -0,0 +1,140 @@
+import threading
+import time
+
+import pytest
+
+from dispatcher import Dispatcher, TokenBucket, is_retryable, INTERACTIVE, BACKGROUND
+
+
+class ApiError(Exception):
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+class FakeProvider:
+    """Raises the queued errors first, then answers with the prompt."""
+
+    name = "fake"
+
+    def __init__(self, errors=(), gate=None):
+        self.errors = list(errors)
+        self.gate = gate
+        self.calls = []
+
+    def generate(self, system_instruction, prompt):
+        self.calls.append(prompt)
+        if self.gate is not None:
+            self.gate.wait(5)
+        if self.errors:
+            raise self.errors.pop(0)
+        return prompt
+
+    def generate_stream(self, system_instruction, prompt):
+        self.calls.append(prompt)
+        yield "first "
+        if self.errors:
+            raise self.errors.pop(0)
+        yield prompt
+
+    def stats(self):
+        return {"calls": len(self.calls)}
+
+
+def make_dispatcher(provider, **kwargs):
+    options = dict(max_concurrency=2, rate_per_minute=0, burst=1, max_retries=2, backoff=0, queue_timeout=5)
+    options.update(kwargs)
+    return Dispatcher(provider, **options)
+
+
+def wait_until(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_is_retryable():
+    assert is_retryable(ApiError(429))
+    assert is_retryable(ApiError(408))
+    assert is_retryable(ApiError(503))
+    assert is_retryable(TimeoutError())
+    assert not is_retryable(ApiError(400))
+    assert not is_retryable(ApiError(403))
+
+
+def test_token_bucket_allows_a_burst_then_paces():
+    bucket = TokenBucket(rate_per_minute=60, burst=2)
+    assert bucket.take() == 0
+    assert bucket.take() == 0
+    assert 0 < bucket.take() <= 1
+    assert TokenBucket(rate_per_minute=0, burst=1).take() == 0
+
+
+def test_retryable_errors_are_retried():
+    provider = FakeProvider([ApiError(503), ApiError(429)])
+    dispatcher = make_dispatcher(provider)
+    assert dispatcher.generate("sys", "hello") == "hello"
+    assert len(provider.calls) == 3
+    stats = dispatcher.stats()
+    assert (stats["retries"], stats["errors"], stats["active"]) == (2, 2, 0)
+    assert stats["provider"] == {"calls": 3}
+
+
+def test_client_errors_and_exhausted_retries_raise():
+    dispatcher = make_dispatcher(FakeProvider([ApiError(400)]))
+    with pytest.raises(ApiError):
+        dispatcher.generate("sys", "hello")
+    assert dispatcher.retries == 0
+
+    dispatcher = make_dispatcher(FakeProvider([ApiError(503)] * 3))
+    with pytest.raises(ApiError):
+        dispatcher.generate("sys", "hello")
+    assert dispatcher.retries == 2
+
+
+def test_stream_is_not_retried_once_pieces_arrived():
+    dispatcher = make_dispatcher(FakeProvider([ApiError(503)]))
+    pieces = []
+    with pytest.raises(ApiError):
+        for piece in dispatcher.stream("sys", "hello"):
+            pieces.append(piece)
+    assert pieces == ["first "]
+    assert dispatcher.retries == 0
+    assert dispatcher.stats()["active"] == 0
+
+    assert "".join(dispatcher.stream("sys", "hello")) == "first hello"
+
+
+def test_interactive_calls_go_before_background_ones():
+    gate = threading.Event()
+    provider = FakeProvider(gate=gate)
+    dispatcher = make_dispatcher(provider, max_concurrency=1)
+    threads = [threading.Thread(target=dispatcher.generate, args=("sys", "running"))]
+    threads[0].start()
+    wait_until(lambda: provider.calls)
+    for prompt, priority in (("background", BACKGROUND), ("interactive", INTERACTIVE)):
+        threads.append(threading.Thread(target=dispatcher.generate, args=("sys", prompt, priority)))
+        threads[-1].start()
+        wait_until(lambda: len(dispatcher._waiting) == len(threads) - 1)
+    assert not dispatcher.has_capacity()
+    assert dispatcher.stats()["queued"] == {"interactive": 1, "background": 1}
+
+    gate.set()
+    for thread in threads:
+        thread.join(5)
+    assert provider.calls == ["running", "interactive", "background"]
+
+
+def test_a_call_that_cannot_start_times_out():
+    gate = threading.Event()
+    dispatcher = make_dispatcher(FakeProvider(gate=gate), max_concurrency=1)
+    running = threading.Thread(target=dispatcher.generate, args=("sys", "running"))
+    running.start()
+    wait_until(lambda: dispatcher.stats()["active"] == 1)
+    with pytest.raises(TimeoutError):
+        dispatcher.generate("sys", "late", timeout=0.05)
+    assert dispatcher.timeouts == 1
+    assert dispatcher._waiting == []
+    gate.set()
+    running.join(5)
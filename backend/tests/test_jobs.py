@@ -0,0 +1,134 @@
+import threading
+import time
+
+import pytest
+
+import jobs
+from jobs import JobQueue
+
+
+@pytest.fixture
+def queue(workdir):
+    # no worker threads, the tests run jobs with run_one()
+    return JobQueue(db_path=workdir / "jobs.sqlite3", workers=0)
+
+
+@pytest.fixture
+def handler(monkeypatch):
+    """Register a handler for kind "test" that raises whatever is queued in `failures`."""
+    calls = []
+    failures = []
+
+    def run(payload):
+        calls.append(payload)
+        if failures:
+            raise failures.pop(0)
+        return {"echo": payload["n"]}
+
+    monkeypatch.setitem(jobs._handlers, "test", run)
+    run.calls, run.failures = calls, failures
+    return run
+
+
+def test_job_runs_once_and_stores_its_result(queue, handler):
+    job_id = queue.enqueue("test", {"n": 1})
+    assert queue.get(job_id)["status"] == "queued"
+    assert queue.run_one()
+    assert not queue.run_one()
+    job = queue.get(job_id)
+    assert (job["status"], job["result"], job["attempts"]) == ("done", {"echo": 1}, 1)
+    assert handler.calls == [{"n": 1}]
+    assert queue.stats()["by_status"] == {"done": 1}
+
+
+def test_dedupe_key_returns_the_pending_job(queue, handler):
+    first = queue.enqueue("test", {"n": 1}, dedupe_key="k")
+    assert queue.enqueue("test", {"n": 2}, dedupe_key="k") == first
+    queue.run_one()
+    assert queue.enqueue("test", {"n": 3}, dedupe_key="k") != first
+
+
+def test_failed_attempt_is_retried_with_backoff(queue, handler):
+    handler.failures.append(ValueError("boom"))
+    job_id = queue.enqueue("test", {"n": 1})
+    before = time.time()
+    assert queue.run_one()
+    job = queue.get(job_id)
+    assert job["status"] == "queued"
+    assert job["error"] == "ValueError: boom"
+    assert job["run_after"] >= before + jobs.JOB_RETRY_SECONDS
+    # not due yet
+    assert not queue.run_one()
+
+    queue._connect().execute("UPDATE jobs SET run_after = 0 WHERE id = ?", (job_id,))
+    assert queue.run_one()
+    assert queue.get(job_id)["status"] == "done"
+    assert (queue.retried, queue.completed) == (1, 1)
+
+
+def test_job_fails_after_max_attempts(queue, handler, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_RETRY_SECONDS", 0)
+    handler.failures.extend([ValueError("one"), ValueError("two")])
+    job_id = queue.enqueue("test", {"n": 1}, max_attempts=2)
+    while queue.run_one():
+        pass
+    job = queue.get(job_id)
+    assert (job["status"], job["attempts"], job["error"]) == ("failed", 2, "ValueError: two")
+    assert queue.failed == 1
+
+
+def test_unknown_kind_fails(queue):
+    job_id = queue.enqueue("nobody_handles_this", {}, max_attempts=1)
+    queue.run_one()
+    assert queue.get(job_id)["error"].startswith("LookupError")
+
+
+def test_expired_lease_is_claimed_again(queue, handler):
+    job_id = queue.enqueue("test", {"n": 1})
+    # a worker that claimed the job and died
+    stale = queue._claim()
+    queue._connect().execute("UPDATE jobs SET leased_until = 0 WHERE id = ?", (job_id,))
+
+    assert queue.run_one()
+    job = queue.get(job_id)
+    assert (job["status"], job["attempts"]) == ("done", 2)
+
+    # the dead worker's late outcome doesn't overwrite the newer attempt
+    queue._finish(stale, error="late")
+    assert queue.get(job_id)["status"] == "done"
+    assert queue.get(job_id)["error"] is None
+
+
+def test_expired_lease_on_the_last_attempt_fails_the_job(queue, handler):
+    job_id = queue.enqueue("test", {"n": 1}, max_attempts=1)
+    queue._claim()
+    queue._connect().execute("UPDATE jobs SET leased_until = 0 WHERE id = ?", (job_id,))
+    assert not queue.run_one()
+    job = queue.get(job_id)
+    assert (job["status"], job["error"]) == ("failed", "Lease expired on the last attempt")
+    assert handler.calls == []
+
+
+def test_heartbeat_renews_the_lease_of_a_running_job(queue, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_LEASE_SECONDS", 0.3)
+    monkeypatch.setattr(jobs, "HEARTBEAT_SECONDS", 0.05)
+    started, release = threading.Event(), threading.Event()
+
+    def slow(payload):
+        started.set()
+        release.wait(5)
+        return "ok"
+
+    monkeypatch.setitem(jobs._handlers, "slow", slow)
+    job_id = queue.enqueue("slow", {})
+    runner = threading.Thread(target=queue.run_one)
+    runner.start()
+    started.wait(5)
+    # well past the first lease, still held, so nobody else claims it
+    time.sleep(0.6)
+    assert queue.get(job_id)["leased_until"] > time.time()
+    assert queue._claim() is None
+    release.set()
+    runner.join(5)
+    job = queue.get(job_id)
+    assert (job["status"], job["attempts"], job["result"]) == ("done", 1, "ok")
@@ -0,0 +1,175 @@
+import random
+from contextlib import nullcontext
+from datetime import date
+
+import pytest
+
+from leaderboard import LeaderboardView, _DayBuckets, window_days, compute_points, LEADERBOARD_RETENTION_DAYS
+
+TODAY = date.today().toordinal()
+
+
+class FakeStorage:
+    """Points log in a list; entries appended to .log show up on the next refresh."""
+
+    def __init__(self, students=("s1", "s2", "s3")):
+        self.students = set(students)
+        self.log = []
+        self.generation = 0
+
+    def has_points_log(self):
+        return True
+
+    def transaction(self):
+        return nullcontext()
+
+    def rewrite_points_log(self, entries):
+        self.generation += 1
+        self.log = list(entries)
+
+    def read_points_log(self, cursor):
+        if cursor is None or cursor[0] != self.generation:
+            return (self.generation, len(self.log)), list(self.log), True
+        return (self.generation, len(self.log)), self.log[cursor[1]:], False
+
+    def list_users(self, role=None):
+        return [{"userid": u, "role": "STUDENT"} for u in self.students]
+
+    def get_user_by_id(self, userid):
+        role = "STUDENT" if userid in self.students else "TEACHER"
+        return {"userid": userid, "role": role}
+
+
+@pytest.fixture
+def storage():
+    return FakeStorage()
+
+
+@pytest.fixture
+def view(storage):
+    return LeaderboardView(storage)
+
+
+def test_compute_points_weights_levels():
+    progress = {"lessons": {"L1": {"questions": {
+        "easy": [{"correct": True}, {"correct": False}],
+        "medium": [{"correct": True}],
+        "hard": [{"correct": True}, {"correct": None}],
+    }}}}
+    assert compute_points(progress) == 1 + 2 + 3
+
+
+def test_rankings_per_class_and_global(storage, view):
+    storage.log += [("s1", "c1", 5), ("s2", "c1", 7), ("s3", "c1", 5), ("s1", "c2", 4), ("t1", "c1", 50)]
+    total, rows, own = view.page("c1", 0, 10, userid="s3")
+    assert total == 3
+    assert [(r["userid"], r["points"], r["rank"]) for r in rows] == [("s2", 7, 1), ("s1", 5, 2), ("s3", 5, 2)]
+    assert own == {"userid": "s3", "points": 5, "rank": 2}
+    # teachers aren't ranked
+    assert view.rank("t1", "c1") is None
+    assert view.rank("s1") == {"userid": "s1", "points": 9, "rank": 1}
+
+    storage.log += [("s1", "c2", None), ("s2", "c1", 1)]
+    assert view.rank("s1") == {"userid": "s1", "points": 5, "rank": 1}
+    assert view.points("s1", "c2") is None
+    assert view.page("c1", 0, 1)[1] == [{"userid": "s1", "points": 5, "rank": 1}]
+
+
+def test_window_ranks_points_won_in_the_window(storage, view):
+    storage.log += [("s1", "c1", 3, TODAY - 1, 3),
+                    ("s1", "c1", 5, TODAY, 2),
+                    ("s2", "c1", 4, TODAY, 4),
+                    ("s3", "c1", 1, TODAY - 1, 1)]
+    total, rows, _ = view.page("c1", 0, 10, days=(TODAY, TODAY))
+    assert total == 2
+    assert [(r["userid"], r["points"]) for r in rows] == [("s2", 4), ("s1", 2)]
+    assert view.rank("s1", "c1", days=(TODAY - 1, TODAY))["points"] == 5
+
+
+def test_cached_window_follows_new_answers(storage, view):
+    storage.log += [("s1", "c1", 2, TODAY, 2), ("s2", "c1", 1, TODAY, 1)]
+    assert view.page("c1", 0, 10, days=(TODAY, TODAY))[0] == 2
+    assert view.page(None, 0, 10, days=(TODAY, TODAY))[0] == 2
+    assert len(view._windows) == 2
+
+    storage.log += [("s3", "c1", 3, TODAY, 3), ("s2", "c1", 0, TODAY, -1)]
+    for class_id in ("c1", None):
+        total, rows, _ = view.page(class_id, 0, 10, days=(TODAY, TODAY))
+        # s2 is back to no points won today and drops out
+        assert [(r["userid"], r["points"]) for r in rows] == [("s3", 3), ("s1", 2)]
+    assert len(view._windows) == 2
+
+
+def test_deleted_progress_drops_the_cached_windows(storage, view):
+    storage.log += [("s1", "c1", 2, TODAY, 2), ("s2", "c1", 1, TODAY, 1)]
+    view.page("c1", 0, 10, days=(TODAY, TODAY))
+    storage.log.append(("s1", "c1", None))
+    assert [r["userid"] for r in view.page("c1", 0, 10, days=(TODAY, TODAY))[1]] == ["s2"]
+
+
+def test_cached_windows_match_a_fresh_sum(storage, view):
+    rng = random.Random(1)
+    points = {}
+    windows = [(None, TODAY - 6, TODAY), ("c1", TODAY - 6, TODAY), ("c2", TODAY - 1, TODAY - 1),
+               (None, TODAY - 40, TODAY)]
+    for step in range(3000):
+        userid, class_id = rng.choice(["s1", "s2", "s3"]), rng.choice(["c1", "c2", "c3"])
+        if rng.random() < 0.03:
+            storage.log.append((userid, class_id, None))
+            points.pop((userid, class_id), None)
+        else:
+            delta = rng.choice([-1, 1, 2, 3])
+            points[userid, class_id] = points.get((userid, class_id), 0) + delta
+            storage.log.append((userid, class_id, points[userid, class_id], rng.randint(TODAY - 40, TODAY), delta))
+        if step % 50 == 0:
+            for class_id, first, last in windows:
+                view.page(class_id, 0, 10, days=(first, last))
+
+    view.refresh()
+    for window in windows:
+        with view._lock:
+            cached = dict(view._window_ranking(*window).points)
+            fresh = dict(view._sum_window(*window).points)
+        assert cached == fresh
+        assert 0 not in cached.values()
+
+
+def test_compaction_keeps_totals_and_day_buckets(storage, view):
+    storage.log += [("s1", "c1", 1, TODAY, 1)] + [("s1", "c1", 2 + i, TODAY, 1) for i in range(4)]
+    before = view.page("c1", 0, 10, days=(TODAY, TODAY))
+    view.compact()
+    assert storage.generation == 1
+    assert len(storage.log) < 5
+
+    fresh = LeaderboardView(storage)
+    assert fresh.totals() == {("s1", "c1"): 5}
+    assert fresh.page("c1", 0, 10, days=(TODAY, TODAY)) == before
+
+
+def test_day_buckets_ring():
+    buckets = _DayBuckets(size=3)
+    assert not buckets.add(10, 2)
+    assert not buckets.add(11, 1)
+    assert buckets.total(10, 11) == 3
+    # day 13 takes day 10's slot
+    assert buckets.add(13, 4)
+    assert buckets.total(10, 13) == 5
+    # too old for the ring, ignored
+    assert not buckets.add(9, 7)
+    assert sorted(buckets.items(11)) == [(11, 1), (13, 4)]
+
+
+def test_window_days():
+    today = date(2026, 3, 11).toordinal()  # a Wednesday
+    assert window_days("today", today=today) == (today, today)
+    assert window_days("week", today=today) == (today - 2, today)
+    assert window_days("7d", today=today) == (today - 6, today)
+    assert window_days(start="2026-03-01", end="2026-03-02", today=today) == (
+        date(2026, 3, 1).toordinal(), date(2026, 3, 2).toordinal())
+    # clamped to the days the buckets keep
+    assert window_days("9999d", today=today)[0] == today - LEADERBOARD_RETENTION_DAYS + 1
+    for bad in ("yesterday", "0d"):
+        with pytest.raises(ValueError):
+            window_days(bad, today=today)
+    with pytest.raises(ValueError):
+        window_days(start="2026-03-05", end="2026-03-01", today=today)
@@ -0,0 +1,67 @@
+import threading
+
+import pytest
+
+from locks import lock, progress_lock, lock_stats
+
+
+def test_locks_are_reentrant():
+    with progress_lock("s1", "c1"):
+        with progress_lock("s1", "c1"):
+            with lock("leaderboard"):
+                pass
+
+
+def test_global_locks_after_a_key_lock_in_order():
+    with progress_lock("s1", "c1"), lock("auth_table"), lock("classes_csv"), lock("leaderboard"):
+        pass
+
+
+def test_key_lock_after_a_global_lock_raises():
+    with lock("leaderboard"):
+        with pytest.raises(RuntimeError):
+            with progress_lock("s1", "c1"):
+                pass
+    # nothing is left held, the same locks work the right way round
+    with progress_lock("s1", "c1"), lock("leaderboard"):
+        pass
+
+
+def test_global_locks_out_of_order_raise():
+    with lock("leaderboard"):
+        with pytest.raises(RuntimeError):
+            with lock("auth_table"):
+                pass
+
+
+def test_same_key_is_serialized_across_threads():
+    inside = threading.Event()
+    release = threading.Event()
+    order = []
+
+    def holder():
+        with progress_lock("s1", "c1"):
+            inside.set()
+            release.wait(5)
+            order.append("holder")
+
+    def waiter():
+        inside.wait(5)
+        with progress_lock("s1", "c1"):
+            order.append("waiter")
+
+    threads = [threading.Thread(target=holder), threading.Thread(target=waiter)]
+    for t in threads:
+        t.start()
+    inside.wait(5)
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert order == ["holder", "waiter"]
+
+
+def test_lock_stats_count_acquisitions():
+    before = lock_stats().get("meta", {}).get("acquired", 0)
+    with lock("meta", "c1"):
+        pass
+    assert lock_stats()["meta"]["acquired"] == before + 1
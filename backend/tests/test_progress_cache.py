@@ -0,0 +1,60 @@
+from helpers import write_json
+from paths import student_class_folder
+from progress_cache import ProgressCache
+from storage import FileStorage
+
+
+def test_hit_needs_a_matching_stamp():
+    cache = ProgressCache(capacity=4)
+    cache.put("k", {"n": 1}, stamp=1)
+    assert cache.get("k", 1) == {"n": 1}
+    assert cache.get("k", 2) is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_least_recently_used_is_evicted():
+    cache = ProgressCache(capacity=2)
+    cache.put("a", 1, 0)
+    cache.put("b", 2, 0)
+    cache.get("a", 0)
+    cache.put("c", 3, 0)
+    assert cache.get("b", 0) is None
+    assert cache.get("a", 0) == 1
+    assert cache.stats()["evictions"] == 1
+
+
+def test_update_applies_only_to_a_current_entry():
+    cache = ProgressCache()
+    cache.put("k", {"n": 1}, 1)
+    cache.update("k", 1, lambda doc: {"n": doc["n"] + 1}, 2)
+    assert cache.get("k", 2) == {"n": 2}
+    assert cache.version("k") == 2
+
+    # changed by someone else since: the entry is dropped, not patched
+    cache.update("k", 1, lambda doc: {"n": 99}, 3)
+    assert cache.version("k") == 0
+    assert cache.get("k", 3) is None
+
+
+def test_zero_capacity_caches_nothing():
+    cache = ProgressCache(capacity=0)
+    cache.put("k", 1, 0)
+    assert cache.get("k", 0) is None
+
+
+def test_storage_reads_stay_in_step_with_answers(writer):
+    storage = FileStorage()
+    write_json(student_class_folder("s1", "c1") / "progress.json", {"lessons": {"L1": {"questions": {
+        "easy": [{"id": "q1", "correct": None, "time_taken": None}]}}}})
+    first = storage.read_progress("s1", "c1")
+    assert storage.read_progress("s1", "c1") is first
+    version = storage.progress_version("s1", "c1")
+
+    storage.record_answer("s1", "c1", "L1", "q1", True, 5)
+    progress = storage.read_progress("s1", "c1")
+    assert progress["lessons"]["L1"]["questions"]["easy"][0]["correct"] is True
+    assert storage.progress_version("s1", "c1") == version + 1
+    # the shared document a reader got before is never modified
+    assert first["lessons"]["L1"]["questions"]["easy"][0]["correct"] is None
+    assert storage.progress_cache.stats()["write_backs"] == 1
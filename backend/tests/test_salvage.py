@@ -0,0 +1,129 @@
+import asyncio
+from types import SimpleNamespace
+
+from helpers import iter_themed_blocks, iter_lines, is_complete_block, normalize_number, _align, _theme_chunk
+
+
+def blocks_of(text):
+    return list(iter_themed_blocks(text.splitlines()))
+
+
+def test_normalize_number():
+    assert normalize_number("= 7 apples") == "7"
+    assert normalize_number("$1,200.50") == "1200.5"
+    assert normalize_number("7.0") == "7"
+    assert normalize_number("− 3") == "-3"
+    assert normalize_number("none") is None
+
+
+def test_iter_lines_joins_pieces():
+    assert list(iter_lines(["Quest", "ion: a\nNum", "eric Solution: 1\n", "tail"])) == [
+        "Question: a", "Numeric Solution: 1", "tail"]
+
+
+def test_well_formed_blocks():
+    blocks = blocks_of(
+        "Question: Tom has 3 apples and buys 4.\n"
+        "Numeric Solution: 7\n"
+        "\n"
+        "**Question 2:** Sara has 10 shells and loses 2.\n"
+        "**Numeric Solution:** = 8 shells\n"
+    )
+    assert blocks == [{"question": "Tom has 3 apples and buys 4.", "numeric_solution": "7"},
+                      {"question": "Sara has 10 shells and loses 2.", "numeric_solution": "8"}]
+    assert all(is_complete_block(b) for b in blocks)
+
+
+def test_details_and_multi_line_solutions():
+    [block] = blocks_of(
+        "Question: 3 + 4\n"
+        "Hint: count on\n"
+        "Hint: from 3\n"
+        "Solution: 3 + 4\n"
+        "= 7\n"
+        "Numeric Solution: 7\n"
+    )
+    assert block["hint1"] == "count on"
+    assert block["hint2"] == "from 3"
+    assert block["solution"] == "3 + 4\n= 7"
+
+
+def test_labels_run_together_on_one_line():
+    assert blocks_of("Question: 2 + 2 Numeric Solution: 4") == [{"question": "2 + 2", "numeric_solution": "4"}]
+
+
+def test_a_lost_label_only_costs_its_own_question():
+    blocks = blocks_of(
+        "Question: first\n"
+        "Question: second\n"
+        "Numeric Solution: 2\n"
+        "Numeric Solution: 3\n"
+        "Question: fourth\n"
+        "Numeric Solution: 4\n"
+    )
+    assert blocks == [{"question": "first"},
+                      {"question": "second", "numeric_solution": "2"},
+                      {"numeric_solution": "3"},
+                      {"question": "fourth", "numeric_solution": "4"}]
+    assert [is_complete_block(b) for b in blocks] == [False, True, False, True]
+
+
+def test_trailing_incomplete_block_is_yielded():
+    assert blocks_of("Question: one\nNumeric Solution: 1\nQuestion: cut off") == [
+        {"question": "one", "numeric_solution": "1"}, {"question": "cut off"}]
+
+
+def block(question, answer):
+    return {"question": question, "numeric_solution": answer}
+
+
+def test_align_same_length_drops_wrong_answers():
+    blocks = [block("a", "1"), block("b", "5"), {"question": "c"}]
+    assert _align(blocks, ["1", "2", "3"]) == [blocks[0], None, None]
+    # no solutions to check against, any complete block fits
+    assert _align(blocks, [None, None, None]) == [blocks[0], blocks[1], None]
+
+
+def test_align_skips_a_missing_block():
+    blocks = [block("a", "1"), block("c", "3")]
+    assert _align(blocks, ["1", "2", "3"]) == [blocks[0], None, blocks[1]]
+
+
+def test_align_skips_an_extra_block():
+    blocks = [block("a", "1"), block("x", "9"), block("b", "2"), block("c", "3")]
+    assert _align(blocks, ["1", "2", "3"]) == [blocks[0], blocks[2], blocks[3]]
+
+
+class FakeDispatcher:
+    """Answers stream() calls with canned responses, one per call."""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.prompts = []
+        self.provider = SimpleNamespace(name="fake")
+
+    def stream(self, system_instruction, prompt, priority=None):
+        self.prompts.append(prompt)
+        yield from self.responses.pop(0)
+
+    def generate(self, system_instruction, prompt, priority=None):
+        return "".join(self.stream(system_instruction, prompt, priority))
+
+    def has_capacity(self):
+        return True
+
+
+def test_only_the_salvaged_rest_is_asked_again():
+    dispatcher = FakeDispatcher([
+        ["Question: themed one\nNumeric Solution: 1\n",
+         "Question: themed two\nNumeric Solution: 5\n",
+         "Question: themed three\nNumeric Solution: 3\n"],
+        ["Question: themed two again\nNumeric Solution: 2\n"],
+    ])
+    published = []
+    themed = asyncio.run(_theme_chunk(dispatcher, ["one", "two", "three"], "space", ["1", "2", "3"], 0,
+                                      published.extend))
+    assert [t["question"] for t in themed] == ["themed one", "themed two again", "themed three"]
+    assert len(dispatcher.prompts) == 2
+    assert "two" in dispatcher.prompts[1] and "three" not in dispatcher.prompts[1]
+    assert sorted(i for i, _ in published) == [0, 1, 2]
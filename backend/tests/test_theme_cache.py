@@ -0,0 +1,61 @@
+import pytest
+
+from theme_cache import ThemeCache, normalize_question, is_valid_variant
+
+
+@pytest.fixture
+def cache(workdir):
+    return ThemeCache(db_path=workdir / "theme_cache.sqlite3", variants=2, max_entries=100)
+
+
+def variant(text, answer="7"):
+    return {"question": text, "numeric_solution": answer}
+
+
+def test_normalize_question():
+    assert normalize_question("  3 +  4\n= ") == normalize_question("3 + 4 =")
+    assert normalize_question("What is X?") == "what is x?"
+
+
+def test_is_valid_variant_compares_numbers():
+    assert is_valid_variant(variant("q", "= 7 apples"), 7)
+    assert is_valid_variant(variant("q", "7.0"), "7")
+    assert not is_valid_variant(variant("q", "8"), "7")
+    assert not is_valid_variant(variant("q", "seven"), "7")
+    assert not is_valid_variant(None, "7")
+
+
+def test_hit_on_the_normalized_question_and_theme(cache):
+    assert cache.get("3 + 4 =", "Space") is None
+    cache.put("3 + 4 =", "Space", variant("A rocket has 3 moons and finds 4 more."))
+    assert cache.get(" 3 +  4 = ", "space")["question"].startswith("A rocket")
+    assert cache.get("3 + 4 =", "Pirates") is None
+    assert cache.get_many(["3 + 4 =", "5 + 5 ="], "space").keys() == {"3 + 4 ="}
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["stored"]) == (2, 3, 1)
+
+
+def test_keeps_the_newest_distinct_variants(cache):
+    for text in ("one", "two", "two", "three"):
+        cache.put("3 + 4 =", "space", variant(text))
+    assert cache.variant_count("3 + 4 =", "space") == 2
+    seen = {cache.get("3 + 4 =", "space")["question"] for _ in range(50)}
+    assert seen == {"two", "three"}
+
+
+def test_details_cached_per_themed_question(cache):
+    details = {"hint1": "Count the moons.", "hint2": "Add them.", "solution": "3 + 4 = 7"}
+    assert cache.get_details("A rocket has 3 moons", "space") is None
+    cache.put_details("A rocket has 3 moons", "space", details)
+    assert cache.get_details("a rocket has  3 moons", "Space") == details
+    assert cache.stats()["detail_hit_rate"] == 0.5
+
+
+def test_least_recently_used_keys_are_evicted(workdir):
+    cache = ThemeCache(db_path=workdir / "small.sqlite3", variants=1, max_entries=3)
+    for i in range(4):
+        cache.put(f"q{i}", "space", variant(f"themed {i}"))
+    assert cache.stats()["entries"] == 2
+    assert cache.evictions == 2
+    assert cache.get("q0", "space") is None
+    assert cache.get("q3", "space") is not None
@@ -0,0 +1,66 @@
+import random
+import re
+
+import pytest
+
+from QuestionGenerators import lesson_generators
+from word_problems import PHRASE_BANKS, parse, theme_locally
+
+
+@pytest.mark.parametrize("question, terms, signs, result, answer", [
+    ("8 + 3 =", [8, 3], [1, 1], None, 11),
+    ("_ + 8 = 14", [None, 8], [1, 1], 14, 6),
+    ("6 - 5 - __ = -1", [6, 5, None], [1, -1, -1], -1, 2),
+    ("12 − 4 =", [12, 4], [1, -1], None, 8),
+])
+def test_parse(question, terms, signs, result, answer):
+    eq = parse(question)
+    assert (eq.terms, eq.signs, eq.result, eq.answer) == (terms, signs, result, answer)
+
+
+@pytest.mark.parametrize("question", [
+    "What is 3 + 4?",
+    "3 + 4",
+    "3 + 4 = 7",        # nothing unknown
+    "_ + _ = 7",        # two unknowns
+    "5 =",              # not a sum
+    "3 * 4 =",
+    "2 - _ = 5",        # the missing number would be negative
+])
+def test_parse_rejects(question):
+    assert parse(question) is None
+
+
+def test_theme_locally_fills_every_field():
+    variant = theme_locally("9 + 1 + 9 =", "Soccer", solution=19)
+    assert variant["numeric_solution"] == "19"
+    assert variant["engine"] == "local"
+    assert all(variant[field] for field in ("question", "hint1", "hint2", "solution"))
+    assert variant["question"].endswith("?")
+    # the same question and theme always tell the same story
+    assert theme_locally("9 + 1 + 9 =", "soccer") == variant
+
+
+def test_theme_locally_declines():
+    assert theme_locally("9 + 1 =", "Dinosaurs") is None
+    assert theme_locally("What is 9 + 1?", "Soccer") is None
+    assert theme_locally("9 + 1 =", "Soccer", solution=11) is None
+
+
+def test_every_generated_question_themes_with_the_right_answer():
+    random.seed(7)
+    for name, generator in lesson_generators.items():
+        for level in ("easy", "medium", "hard"):
+            for _ in range(30):
+                question, answer = generator(level)
+                for theme in PHRASE_BANKS:
+                    variant = theme_locally(question, theme, solution=answer)
+                    if parse(question) is None:
+                        assert variant is None
+                        continue
+                    assert variant is not None, (name, question, theme)
+                    assert variant["numeric_solution"] == str(answer)
+                    assert str(answer) in variant["solution"]
+                    # negative totals are told as a score, never as a number of things
+                    if " is playing " not in variant["question"]:
+                        assert not re.search(r"-\d", variant["question"]), variant["question"]
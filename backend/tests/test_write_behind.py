@@ -0,0 +1,112 @@
+import shutil
+
+import pytest
+
+from answer_journal import make_record
+from helpers import load_json, json_exists, write_json
+from paths import student_class_folder
+from storage import FileStorage
+from write_behind import WriteBehind
+
+
+def test_unknown_mode_raises():
+    with pytest.raises(ValueError):
+        WriteBehind(mode="eventually")
+
+
+def test_strict_writes_before_returning(workdir, writer):
+    called = []
+    write_json(workdir / "doc" / "a.json", {"n": 1}, on_written=lambda: called.append(1))
+    assert (workdir / "doc" / "a.json").exists()
+    assert called == [1]
+    assert writer.stats()["batches"] == 1
+
+
+@pytest.mark.parametrize("writer", ["grouped"], indirect=True)
+def test_grouped_writes_before_returning(workdir, writer):
+    write_json(workdir / "a.json", {"n": 1})
+    assert (workdir / "a.json").exists()
+    assert writer.pending(workdir / "a.json") is None
+
+
+@pytest.mark.parametrize("writer", ["relaxed"], indirect=True)
+def test_relaxed_coalesces_and_reads_pending_documents(workdir, writer):
+    path = workdir / "a.json"
+    called = []
+    write_json(path, {"n": 1}, on_written=lambda: called.append(1))
+    write_json(path, {"n": 2}, on_written=lambda: called.append(2))
+    assert not path.exists()
+    assert json_exists(path)
+    assert load_json(path) == {"n": 2}
+    assert writer.stats()["coalesced"] == 1
+
+    writer.flush()
+    assert load_json(path) == {"n": 2}
+    assert writer.pending(path) is None
+    # both callbacks wait for the one write that covers them
+    assert called == [1, 2]
+
+
+@pytest.mark.parametrize("writer", ["relaxed"], indirect=True)
+def test_relaxed_keeps_a_failed_batch_for_the_next_flush(workdir, writer):
+    path = workdir / "gone" / "a.json"
+    called = []
+    write_json(path, {"n": 1}, on_written=lambda: called.append(1))
+    shutil.rmtree(workdir / "gone")
+    writer.flush()
+    assert called == []
+    assert writer.pending(path) is not None
+
+    path.parent.mkdir()
+    writer.flush()
+    assert load_json(path) == {"n": 1}
+    assert called == [1]
+
+
+@pytest.mark.parametrize("writer", ["relaxed"], indirect=True)
+def test_discard_drops_pending_writes_under_a_folder(workdir, writer):
+    called = []
+    write_json(workdir / "user" / "a.json", {"n": 1}, on_written=lambda: called.append(1))
+    write_json(workdir / "other" / "b.json", {"n": 2})
+    writer.discard(workdir / "user")
+    writer.flush()
+    assert not (workdir / "user" / "a.json").exists()
+    assert (workdir / "other" / "b.json").exists()
+    assert called == []
+
+
+def make_progress():
+    return {"lessons": {"L1": {"questions": {"easy": [
+        {"id": q, "correct": None, "time_taken": None} for q in ("q1", "q2", "q3")
+    ]}}}}
+
+
+def answers(progress):
+    return {q["id"]: (q["correct"], q["time_taken"]) for q in progress["lessons"]["L1"]["questions"]["easy"]}
+
+
+@pytest.mark.parametrize("writer", ["relaxed"], indirect=True)
+def test_relaxed_keeps_the_journal_until_the_snapshot_is_written(writer):
+    storage = FileStorage()
+    folder = student_class_folder("s1", "c1")
+    write_json(folder / "progress.json", make_progress())
+    writer.flush()
+    storage.record_answer("s1", "c1", "L1", "q1", True, 5)
+    storage.compact_progress("s1", "c1")
+    storage.record_answer("s1", "c1", "L1", "q2", False, 6)
+    storage.compact_progress("s1", "c1")
+    assert sorted(p.name for p in folder.glob("answers.jsonl*")) == ["answers.jsonl.1", "answers.jsonl.2"]
+
+    # a crash before the flush: the old snapshot plus the set-aside journals
+    with writer._cond:
+        writer._pending.clear()
+        writer._callbacks.clear()
+    storage.progress_cache.drop(("s1", "c1"))
+    assert answers(storage.get_progress("s1", "c1"))["q1"] == (True, 5)
+    assert answers(storage.get_progress("s1", "c1"))["q2"] == (False, 6)
+
+    storage.record_answer("s1", "c1", "L1", "q3", True, 7)
+    storage.compact_progress("s1", "c1")
+    writer.flush()
+    assert list(folder.glob("answers.jsonl*")) == []
+    assert answers(storage.get_progress("s1", "c1")) == {"q1": (True, 5), "q2": (False, 6), "q3": (True, 7)}
@@ -0,0 +1,208 @@
+"""
+Micro-batching of theming requests across students.
+
+When a class unlocks a lesson at about the same time, every student's
+theming job asks for the same template questions, and most of them in one
+of a handful of themes. The ThemeBatcher holds a request for the first
+THEME_BATCH_WINDOW_MS, gathers the requests for the same theme that come in
+meanwhile, and sends their distinct questions (same text and solution) to
+helpers.theme_questions() once:
+
+- the first request of a batch waits out the window and then makes the
+  call, the others wait for it; a batch that reaches
+  THEME_BATCH_MAX_QUESTIONS goes right away,
+- it runs at the most urgent priority among its requests,
+- each themed question is handed to the on_themed of every request that
+  asked for it as it arrives, and each request gets back its own list,
+- if the call fails, every request in the batch raises.
+
+Only requests in the same worker process are batched.
+
+    get_theme_batcher().theme_questions(questions, theme, solutions, on_themed=...)
+"""
+
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+
+from constants import THEME_BATCH_WINDOW_MS, THEME_BATCH_MAX_QUESTIONS, LLM_CHUNK_SIZE
+from helpers import theme_questions, normalize_number, theming_stats
+from theme_cache import normalize_question
+
+
+class _Request:
+    __slots__ = ("positions", "on_themed", "results", "error", "done")
+
+    def __init__(self, on_themed):
+        self.positions = []  # where each of its questions is in the batch
+        self.on_themed = on_themed
+        self.results = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class _Batch:
+    def __init__(self, theme: str, priority):
+        self.theme = theme
+        self.priority = priority
+        self.questions = []
+        self.solutions = []
+        self.askers = []  # per question in the batch, [(request, index in the request)]
+        self.requests = []
+        self._positions = {}
+        self.full = threading.Event()
+        self.opened = time.monotonic()
+
+    def add(self, questions: list, solutions: list, priority, on_themed) -> _Request:
+        request = _Request(on_themed)
+        for i, (question, solution) in enumerate(zip(questions, solutions)):
+            key = (normalize_question(question), normalize_number(solution) if solution is not None else None)
+            position = self._positions.get(key)
+            if position is None:
+                position = self._positions[key] = len(self.questions)
+                self.questions.append(question)
+                self.solutions.append(solution)
+                self.askers.append([])
+            self.askers[position].append((request, i))
+            request.positions.append(position)
+        self.requests.append(request)
+        if priority < self.priority:
+            self.priority = priority
+        return request
+
+
+class ThemeBatcher:
+    def __init__(self, window_ms: float = THEME_BATCH_WINDOW_MS,
+                 max_questions: int = THEME_BATCH_MAX_QUESTIONS):
+        self.window = window_ms / 1000
+        self.max_questions = max(max_questions, 1)
+        self._lock = threading.Lock()
+        self._open = {}  # theme -> batch still taking requests
+
+        self.batches = 0
+        self.requests = 0
+        self.questions_requested = 0
+        self.questions_sent = 0
+        self.max_batch_requests = 0
+        self.calls_saved = 0
+        self.window_wait = 0.0
+
+    def theme_questions(self, questions: list, theme: str, solutions: list = None, priority: int = None,
+                        on_themed=None):
+        """Same as helpers.theme_questions(), batched with other requests for the theme."""
+        from dispatcher import INTERACTIVE
+
+        if self.window <= 0 or not questions:
+            return theme_questions(questions, theme, solutions, priority=priority, on_themed=on_themed)
+        priority = INTERACTIVE if priority is None else priority
+        solutions = list(solutions) if solutions is not None else [None] * len(questions)
+
+        with self._lock:
+            batch = self._open.get(theme)
+            leader = batch is None
+            if leader:
+                batch = self._open[theme] = _Batch(theme, priority)
+            request = batch.add(list(questions), solutions, priority, on_themed)
+            if len(batch.questions) >= self.max_questions:
+                del self._open[theme]
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._open.get(theme) is batch:
+                    del self._open[theme]
+            self._run(batch)
+        else:
+            request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.results
+
+    def _run(self, batch: _Batch):
+        """Theme a closed batch and hand the results out to its requests."""
+        self._record(batch)
+
+        def on_themed(items):
+            by_request = defaultdict(list)
+            for position, variant in items:
+                for request, i in batch.askers[position]:
+                    by_request[request].append((i, variant))
+            for request, themed in by_request.items():
+                if request.on_themed is None:
+                    continue
+                try:
+                    request.on_themed(themed)
+                except Exception as e:
+                    # one student's failed save shouldn't cost the others theirs
+                    print(f"[WARN] Saving {len(themed)} batched {batch.theme} questions failed: {e}")
+                    request.error = request.error or e
+
+        try:
+            variants = theme_questions(batch.questions, batch.theme, batch.solutions,
+                                       priority=batch.priority, on_themed=on_themed)
+        except Exception as e:
+            for request in batch.requests:
+                request.error = e
+        else:
+            for request in batch.requests:
+                request.results = [variants[position] for position in request.positions]
+        finally:
+            for request in batch.requests:
+                request.done.set()
+
+    def _record(self, batch: _Batch):
+        def calls(n):
+            return math.ceil(n / LLM_CHUNK_SIZE)
+
+        with self._lock:
+            self.batches += 1
+            self.requests += len(batch.requests)
+            self.questions_requested += sum(len(r.positions) for r in batch.requests)
+            self.questions_sent += len(batch.questions)
+            self.max_batch_requests = max(self.max_batch_requests, len(batch.requests))
+            # chunked calls the requests would have made on their own, less the batch's
+            self.calls_saved += sum(calls(len(r.positions)) for r in batch.requests) - calls(len(batch.questions))
+            self.window_wait += time.monotonic() - batch.opened
+
+    def _after_fork(self):
+        # batches of the parent's threads don't exist in the child
+        self._lock = threading.Lock()
+        self._open = {}
+
+    def stats(self) -> dict:
+        """Batch sizes, questions deduplicated and model time saved, for /metrics."""
+        call_seconds = theming_stats.mean_call_seconds()
+        with self._lock:
+            return {
+                "window_ms": self.window * 1000,
+                "batches": self.batches,
+                "requests": self.requests,
+                "avg_requests_per_batch": self.requests / self.batches if self.batches else 0.0,
+                "max_requests_per_batch": self.max_batch_requests,
+                "questions_requested": self.questions_requested,
+                "questions_sent": self.questions_sent,
+                "dedupe_rate": 1 - self.questions_sent / self.questions_requested if self.questions_requested else 0.0,
+                "model_calls_saved": self.calls_saved,
+                # the calls saved, at what a theming call takes on average
+                "model_seconds_saved": call_seconds and self.calls_saved * call_seconds,
+                "avg_window_wait_ms": self.window_wait / self.batches * 1000 if self.batches else 0.0,
+            }
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_theme_batcher() -> ThemeBatcher:
+    """Return the process-wide theming batcher."""
+    global _batcher
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = ThemeBatcher()
+                if hasattr(os, "register_at_fork"):
+                    os.register_at_fork(after_in_child=_batcher._after_fork)
+    return _batcher
@@ -0,0 +1,335 @@
+"""
+Shared cache of themed questions.
+
+Base questions repeat a lot ("3 + 4 =" comes up for many students, and
+everyone in a teacher class shares its template), so a themed version the
+model wrote for one student is kept for everyone else with the same theme.
+Entries are keyed by the normalized question text and the theme and hold
+up to THEME_CACHE_VARIANTS variants; a hit picks one at random so students
+don't all get the same story. Only variants whose numeric solution matched
+the base question's are stored.
+
+Hints and worked solutions are only written when a student opens them, for
+the themed question text they belong to; they are cached the same way,
+keyed by that text and the theme (get_details()/put_details()).
+
+The cache lives in its own SQLite database (THEME_CACHE_DB), shared by all
+worker processes. Once it holds more than THEME_CACHE_MAX_ENTRIES keys the
+least recently used are evicted.
+
+Fill it ahead of time (needs the model) with:
+
+    python theme_cache.py warm [theme ...]   # every generator question and class template question
+    python theme_cache.py stats
+"""
+
+import json
+import random
+import sys
+import threading
+import time
+
+from constants import (
+    THEME_CACHE_DB,
+    THEME_CACHE_VARIANTS,
+    THEME_CACHE_MAX_ENTRIES,
+    AVAILABLE_THEMES,
+)
+from storage import connect_sqlite
+from helpers import normalize_number
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS themed_questions (
+    question TEXT NOT NULL,
+    theme TEXT NOT NULL,
+    variants TEXT NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (question, theme)
+);
+CREATE INDEX IF NOT EXISTS themed_questions_lru ON themed_questions (last_used);
+CREATE TABLE IF NOT EXISTS themed_details (
+    question TEXT NOT NULL,
+    theme TEXT NOT NULL,
+    details TEXT NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (question, theme)
+);
+CREATE INDEX IF NOT EXISTS themed_details_lru ON themed_details (last_used);
+"""
+
+# a hit only writes its new last_used back if the old one is older than this
+TOUCH_SECONDS = 60
+
+# questions per model request while warming up
+WARM_BATCH = 20
+# sampling a generator stops after this many draws in a row brought nothing new
+WARM_STALE_DRAWS = 200
+WARM_MAX_PER_LEVEL = 2000
+
+
+def normalize_question(text: str) -> str:
+    return " ".join(str(text).split()).lower()
+
+
+def is_valid_variant(variant: dict, solution) -> bool:
+    """The model's numeric answer must match the base question's solution."""
+    if not variant:
+        return False
+    answer = normalize_number(variant.get("numeric_solution", ""))
+    return answer is not None and answer == normalize_number(solution)
+
+
+class ThemeCache:
+    def __init__(self, db_path=THEME_CACHE_DB, variants: int = THEME_CACHE_VARIANTS,
+                 max_entries: int = THEME_CACHE_MAX_ENTRIES):
+        self.db_path = db_path
+        self.variants = variants
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._counter_lock = threading.Lock()
+        self._connect().executescript(SCHEMA)
+
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.evictions = 0
+        self.detail_hits = 0
+        self.detail_misses = 0
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect_sqlite(self.db_path)
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name: str, n: int = 1):
+        with self._counter_lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def get(self, question: str, theme: str):
+        """A cached themed variant of a base question, or None."""
+        key = (normalize_question(question), theme.lower())
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT variants, last_used FROM themed_questions WHERE question = ? AND theme = ?", key
+        ).fetchone()
+        if row is None:
+            self._count("misses")
+            return None
+
+        self._count("hits")
+        now = time.time()
+        if now - row["last_used"] > TOUCH_SECONDS:
+            conn.execute(
+                "UPDATE themed_questions SET last_used = ? WHERE question = ? AND theme = ?", (now, *key)
+            )
+        return random.choice(json.loads(row["variants"]))
+
+    def get_many(self, questions: list, theme: str) -> dict:
+        """{question: variant} for the questions that are cached."""
+        found = {}
+        for question in questions:
+            variant = self.get(question, theme)
+            if variant is not None:
+                found[question] = variant
+        return found
+
+    def variant_count(self, question: str, theme: str) -> int:
+        row = self._connect().execute(
+            "SELECT variants FROM themed_questions WHERE question = ? AND theme = ?",
+            (normalize_question(question), theme.lower()),
+        ).fetchone()
+        return len(json.loads(row["variants"])) if row else 0
+
+    def put(self, question: str, theme: str, variant: dict):
+        """Add a validated variant, keeping the newest THEME_CACHE_VARIANTS per key."""
+        key = (normalize_question(question), theme.lower())
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT variants FROM themed_questions WHERE question = ? AND theme = ?", key
+            ).fetchone()
+            variants = json.loads(row["variants"]) if row else []
+            if all(v.get("question") != variant.get("question") for v in variants):
+                variants = (variants + [variant])[-self.variants:]
+            conn.execute(
+                "INSERT INTO themed_questions (question, theme, variants, last_used) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (question, theme) DO UPDATE SET variants = excluded.variants, last_used = excluded.last_used",
+                (*key, json.dumps(variants), time.time()),
+            )
+            evicted = 0
+            if row is None:
+                evicted = self._evict(conn, "themed_questions")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._count("stored")
+        self._count("evictions", evicted)
+
+    def get_details(self, question: str, theme: str):
+        """Cached hints and solution ({hint1, hint2, solution}) of a themed question, or None."""
+        key = (normalize_question(question), theme.lower())
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT details, last_used FROM themed_details WHERE question = ? AND theme = ?", key
+        ).fetchone()
+        if row is None:
+            self._count("detail_misses")
+            return None
+        self._count("detail_hits")
+        now = time.time()
+        if now - row["last_used"] > TOUCH_SECONDS:
+            conn.execute("UPDATE themed_details SET last_used = ? WHERE question = ? AND theme = ?", (now, *key))
+        return json.loads(row["details"])
+
+    def put_details(self, question: str, theme: str, details: dict):
+        key = (normalize_question(question), theme.lower())
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO themed_details (question, theme, details, last_used) VALUES (?, ?, ?, ?)",
+                (*key, json.dumps(details), time.time()),
+            )
+            evicted = self._evict(conn, "themed_details")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._count("evictions", evicted)
+
+    def _evict(self, conn, table: str) -> int:
+        size = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        if size <= self.max_entries:
+            return 0
+        # evict a little more than needed so we don't do this on every insert
+        extra = size - self.max_entries + max(self.max_entries // 100, 1)
+        conn.execute(
+            f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} ORDER BY last_used LIMIT ?)",
+            (extra,),
+        )
+        return extra
+
+    def stats(self) -> dict:
+        """Hit/miss/eviction counters for this process plus the cache size, for /metrics."""
+        conn = self._connect()
+        size = conn.execute("SELECT COUNT(*) FROM themed_questions").fetchone()[0]
+        details = conn.execute("SELECT COUNT(*) FROM themed_details").fetchone()[0]
+        with self._counter_lock:
+            lookups = self.hits + self.misses
+            detail_lookups = self.detail_hits + self.detail_misses
+            return {
+                "entries": size,
+                "detail_entries": details,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "stored": self.stored,
+                "evictions": self.evictions,
+                "detail_hits": self.detail_hits,
+                "detail_misses": self.detail_misses,
+                "detail_hit_rate": self.detail_hits / detail_lookups if detail_lookups else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_theme_cache() -> ThemeCache:
+    """Return the process-wide themed-question cache."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ThemeCache()
+    return _cache
+
+
+# ---------- warm-up ----------
+
+def generator_questions() -> dict:
+    """
+    {question: solution} covering the question generators' output. They draw
+    random numbers, so each level is sampled until new questions stop turning up.
+    """
+    from QuestionGenerators import lesson_generators
+
+    questions = {}
+    for generator in lesson_generators.values():
+        for level in ("easy", "medium", "hard"):
+            stale = draws = 0
+            while stale < WARM_STALE_DRAWS and draws < WARM_MAX_PER_LEVEL:
+                text, answer = generator(level)
+                draws += 1
+                if text in questions:
+                    stale += 1
+                else:
+                    questions[text] = str(answer)
+                    stale = 0
+    return questions
+
+
+def template_questions() -> dict:
+    """{question: solution} for every question in every class template."""
+    from storage import get_storage
+
+    storage = get_storage()
+    questions = {}
+    class_ids = {row["classid"] for row in storage.list_classes()}
+    for class_id in sorted(class_ids):
+        template = storage.get_class_template(class_id) or {}
+        for lesson in template.values():
+            for q in lesson.get("questions", []):
+                questions[q["content"]] = str(q["solution"])
+    return questions
+
+
+def warm(themes: list = None) -> dict:
+    """Theme every known base question for every theme until each key has its variants."""
+    from helpers import theme_questions
+    from dispatcher import BACKGROUND
+    from llm import model_available
+
+    if not model_available():
+        return {}
+
+    cache = get_theme_cache()
+    questions = {**generator_questions(), **template_questions()}
+    stored = {}
+    for theme in themes or AVAILABLE_THEMES:
+        stored[theme] = sent = 0
+        # one variant per key and round
+        for _ in range(cache.variants):
+            todo = [q for q in questions if cache.variant_count(q, theme) < cache.variants]
+            if not todo:
+                break
+            for i in range(0, len(todo), WARM_BATCH):
+                batch = todo[i:i + WARM_BATCH]
+                sent += len(batch)
+                try:
+                    themed = theme_questions(batch, theme, [questions[q] for q in batch], priority=BACKGROUND)
+                except Exception as e:
+                    print(f"[WARN] Theming {len(batch)} questions for {theme} failed: {e}")
+                    continue
+                for question, variant in zip(batch, themed):
+                    if is_valid_variant(variant, questions[question]):
+                        cache.put(question, theme, variant)
+                        stored[theme] += 1
+        print(f"{theme}: {sent} questions sent, {stored[theme]} variants stored")
+    return stored
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "warm":
+        warm(sys.argv[2:] or None)
+    elif command == "stats":
+        print(json.dumps(get_theme_cache().stats(), indent=2))
+    else:
+        print("usage: python theme_cache.py warm [theme ...] | stats")
+        sys.exit(1)
@@ -1,26 +1,20 @@
-import csv
 from datetime import datetime
-from pathlib import Path
 
-from constants import USERSFOLDER, AUTH_TABLE, CLASSES_CSV
-from helpers import write_json, load_json, get_user_if_valid
-from class_utils import register_class, create_questions_for_student
+from helpers import get_user_if_valid
+from class_utils import ensure_default_class, make_question_overlay, create_questions_for_student
 from helpers import hash_password
+from storage import get_storage
 from QuestionGenerators import generate_student_questions
 
 
 def generate_new_student(userid: str, username: str, theme : str, class_id=None, class_name="default_math"):
-    user_folder = USERSFOLDER / userid
-    user_folder.mkdir(parents=True, exist_ok=True)
-
-    # create a default math class
+    # join the shared default math class
     if class_id is None:
-        # each student gets default math class, give it a unique class_id
-        template_questions = generate_student_questions(userid)
+        class_id = ensure_default_class()
 
-        # only copy HTMLs for personal math class
-        class_id = register_class(class_name, teacher_userid=0, description="Default math class",
-                                  template_questions=template_questions, copy_default_html=True)
+        # the student's own questions are the only thing that differs from the shared template
+        template_questions = generate_student_questions(userid)
+        get_storage().save_class_overlay(userid, class_id, make_question_overlay(template_questions))
 
     # Profile
     profile_data = {
@@ -34,43 +28,22 @@ def generate_new_student(userid: str, username: str, theme : str, class_id=None,
         "last_login": datetime.now().isoformat(),
         "last_active": None
     }
-    write_json(user_folder / "profile.json", profile_data)
+    get_storage().save_profile(userid, profile_data)
 
     # Questions + progress
     create_questions_for_student(userid, class_id)
 
 
 def get_user_profile(userid: str):
-    profile_file = USERSFOLDER / userid / "profile.json"
-    if profile_file.exists():
-        return load_json(profile_file)
-    return None
+    return get_storage().get_profile(userid)
 
 
 def get_user_classes(userid: str):
-    classes_folder = USERSFOLDER / userid / "classes"
-    if not classes_folder.exists():
-        return []
-
+    storage = get_storage()
     result = []
 
-    # Load all classes from CSV once
-    classes_data = []
-    with open(CLASSES_CSV, newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        classes_data = list(reader)
-
-    for c in classes_folder.iterdir():
-        if not c.is_dir():
-            continue
-
-        cid = c.name  # folder name IS the classid
-
-        # Find matching class row
-        row = next((r for r in classes_data if r["classid"] == cid), None)
-        if not row:
-            continue
-
+    # one indexed lookup for all enrolled classes
+    for row in storage.get_classes(storage.list_user_class_ids(userid)):
         result.append({
             "classid": row["classid"],
             "class_name": row["class_name"],
@@ -91,19 +64,6 @@ def change_password(username: str, old_password: str, new_password: str):
     if not user:
         return False, "Old password incorrect"
 
-    # first we need to read the whole csv into a list
-    rows = []
-    with open(AUTH_TABLE, newline="") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            if row["username"] == username:
-                row["password"] = hash_password(new_password)  # update password
-            rows.append(row)
-
-    # overwrite CSV with updated row
-    with open(AUTH_TABLE, "w", newline="") as f:
-        writer = csv.DictWriter(f, fieldnames=rows[0].keys())
-        writer.writeheader()
-        writer.writerows(rows)
+    get_storage().set_password(username, hash_password(new_password))
 
     return True, "Password updated"
@@ -0,0 +1,352 @@
+"""
+Offline themed word problems for generated arithmetic.
+
+The QuestionGenerators write sums like "8 + 3 =", "_ + 8 = 14" or
+"6 - 5 - __ = -1". For those the model isn't needed: theme_locally() reads
+the equation, tells a short story with the theme's phrase bank and writes
+two hints (a nudge, then the first step) and a worked solution, in the
+same shape as a model's variant (see helpers.BLOCK_FIELDS). The output
+only depends on the question and the theme, and takes microseconds.
+
+Stories count things ("soccer balls in the equipment bag") while the
+running total stays at zero or above and the bank has an action for every
+step, and keep score in rounds of a game otherwise. The hints and solution
+only use the numbers, so they stay right if the model later rewrites the
+story around the same sum. The engine is opt-in, see THEMING_ENGINE in
+constants.py.
+
+    theme_locally("9 + 1 + 9 =", "Soccer")  # {"question": ..., "numeric_solution": "19", ...}
+"""
+
+import random
+import re
+
+from helpers import normalize_number
+
+# per theme: names, the things counted and where they are, ways to get more
+# and to lose some (the story text with {n} {things}, and the same action
+# for the question), and a game to keep score in
+PHRASE_BANKS = {
+    "soccer": {
+        "names": ("Maya", "Leo", "Sam"),
+        "thing": ("soccer ball", "soccer balls"),
+        "place": "in the team's equipment bag",
+        "gain": (("finds {n} more {things} behind the goal", "find behind the goal"),
+                 ("gets {n} new {things} from the coach", "get from the coach"),
+                 ("wins {n} {things} at a tournament", "win at the tournament")),
+        "lose": (("kicks {n} {things} over the fence", "kick over the fence"),
+                 ("lends {n} {things} to the other team", "lend to the other team"),
+                 ("gives {n} {things} to the younger players", "give to the younger players")),
+        "game": "a penalty shootout game",
+    },
+    "hockey": {
+        "names": ("Jordan", "Priya", "Coach Alex"),
+        "thing": ("hockey puck", "hockey pucks"),
+        "place": "in the rink's puck bucket",
+        "gain": (("finds {n} more {things} under the bench", "find under the bench"),
+                 ("gets {n} new {things} from the pro shop", "get from the pro shop"),
+                 ("collects {n} {things} after practice", "collect after practice")),
+        "lose": (("shoots {n} {things} into the stands", "shoot into the stands"),
+                 ("loses {n} {things} in the snow", "lose in the snow"),
+                 ("gives {n} {things} to the goalie", "give to the goalie")),
+        "game": "a hockey shootout game",
+    },
+    "toys": {
+        "names": ("Sam", "Ava", "Noah"),
+        "thing": ("toy block", "toy blocks"),
+        "place": "in the toy box",
+        "gain": (("gets {n} new {things} for a birthday", "get for the birthday"),
+                 ("finds {n} {things} under the couch", "find under the couch"),
+                 ("buys {n} {things} at the toy store", "buy at the toy store")),
+        "lose": (("gives {n} {things} to a friend", "give to the friend"),
+                 ("puts {n} {things} away on a shelf", "put away on the shelf"),
+                 ("leaves {n} {things} at the park", "leave at the park")),
+        "game": "a ring toss game",
+    },
+    "pokemon": {
+        "names": ("Ash", "Misty", "Brock"),
+        "thing": ("Poke Ball", "Poke Balls"),
+        "place": "in the backpack",
+        "gain": (("buys {n} more {things} at the Poke Mart", "buy at the Poke Mart"),
+                 ("finds {n} {things} in the tall grass", "find in the tall grass"),
+                 ("gets {n} {things} from Professor Oak", "get from Professor Oak")),
+        "lose": (("throws {n} {things} to catch a Pikachu", "throw to catch the Pikachu"),
+                 ("trades {n} {things} with a friend", "trade with the friend"),
+                 ("drops {n} {things} in the river", "drop in the river")),
+        "game": "a Pokemon battle",
+    },
+    "video games": {
+        "names": ("Riley", "Kai", "Zoe"),
+        "thing": ("gold coin", "gold coins"),
+        "place": "in the treasure chest",
+        "gain": (("collects {n} {things} on the next level", "collect on the next level"),
+                 ("finds {n} {things} in a secret room", "find in the secret room"),
+                 ("wins {n} {things} in a boss battle", "win in the boss battle")),
+        "lose": (("spends {n} {things} on a new sword", "spend on the new sword"),
+                 ("drops {n} {things} falling into lava", "drop falling into the lava"),
+                 ("pays {n} {things} for a health potion", "pay for the health potion")),
+        "game": "a racing video game",
+    },
+    "cars": {
+        "names": ("Marco", "Lena", "Mechanic Pat"),
+        "thing": ("toy car", "toy cars"),
+        "place": "in the garage",
+        "gain": (("buys {n} more {things} at the car show", "buy at the car show"),
+                 ("wins {n} {things} as a prize in a race", "win as a prize in the race"),
+                 ("builds {n} {things} in the workshop", "build in the workshop")),
+        "lose": (("sells {n} {things} to a collector", "sell to the collector"),
+                 ("lends {n} {things} to a neighbor", "lend to the neighbor"),
+                 ("sends {n} {things} to the car wash", "send to the car wash")),
+        "game": "a go-kart racing game",
+    },
+    "fairies": {
+        "names": ("Fern", "Willow", "Luna"),
+        "thing": ("magic acorn", "magic acorns"),
+        "place": "in the fairy garden",
+        "gain": (("finds {n} more {things} under a mushroom", "find under the mushroom"),
+                 ("gets {n} {things} from the fairy queen", "get from the fairy queen"),
+                 ("grows {n} {things} with a wish", "grow with the wish")),
+        "lose": (("gives {n} {things} to the forest animals", "give to the forest animals"),
+                 ("uses {n} {things} for a spell", "use for the spell"),
+                 ("drops {n} {things} in the pond", "drop in the pond")),
+        "game": "a fairy dust game",
+    },
+    "horses": {
+        "names": ("Ella", "Mateo", "Farmer Kim"),
+        "thing": ("carrot", "carrots"),
+        "place": "in the stable",
+        "gain": (("picks {n} more {things} from the garden", "pick from the garden"),
+                 ("buys {n} {things} at the market", "buy at the market"),
+                 ("gets {n} {things} from a neighbor", "get from the neighbor")),
+        "lose": (("feeds {n} {things} to the horses", "feed to the horses"),
+                 ("gives {n} {things} to the pony", "give to the pony"),
+                 ("drops {n} {things} on the trail", "drop on the trail")),
+        "game": "a show jumping game",
+    },
+    "dolls": {
+        "names": ("Mia", "Sofia", "Jamie"),
+        "thing": ("doll dress", "doll dresses"),
+        "place": "in the dollhouse closet",
+        "gain": (("sews {n} more {things}", "sew"),
+                 ("gets {n} {things} for a birthday", "get for the birthday"),
+                 ("buys {n} {things} at the toy store", "buy at the toy store")),
+        "lose": (("gives {n} {things} to a cousin", "give to the cousin"),
+                 ("packs {n} {things} for a trip", "pack for the trip"),
+                 ("donates {n} {things} to the school fair", "donate to the school fair")),
+        "game": "a dress-up game",
+    },
+}
+
+_TERM = re.compile(r"\s*([+-])?\s*(\d+|_+)\s*")
+_RESULT = re.compile(r"\s*(-?\d+|_+)?\s*")
+
+
+class Equation:
+    """
+    A sum of whole numbers with one unknown, e.g. "_ - 9 = 1":
+    terms [None, 9] with signs [1, -1] and result 1. unknown is the index
+    of the unknown term, or len(terms) if the result is unknown.
+    """
+
+    def __init__(self, terms: list, signs: list, result):
+        self.terms = terms
+        self.signs = signs
+        self.result = result
+        self.unknown = terms.index(None) if None in terms else len(terms)
+
+    @property
+    def answer(self) -> int:
+        if self.unknown == len(self.terms):
+            return sum(s * t for s, t in zip(self.signs, self.terms))
+        rest = sum(s * t for s, t in zip(self.signs, self.terms) if t is not None)
+        return self.signs[self.unknown] * (self.result - rest)
+
+    def solved(self) -> list:
+        """The terms with the unknown filled in."""
+        return [self.answer if t is None else t for t in self.terms]
+
+    def text(self, terms: list = None, result=None) -> str:
+        """The sum written out, "?" for the unknown."""
+        terms = terms or self.terms
+        parts = ["?" if terms[0] is None else str(terms[0])]
+        for sign, term in zip(self.signs[1:], terms[1:]):
+            parts.append(f"{'+' if sign > 0 else '-'} {'?' if term is None else term}")
+        if result is None:
+            result = "?" if self.result is None else self.result
+        return f"{' '.join(parts)} = {result}"
+
+
+def parse(question: str):
+    """The Equation in a generated question, None for anything else."""
+    text = question.replace("−", "-").strip()
+    if text.count("=") != 1:
+        return None
+    left, right = text.split("=")
+    terms, signs, pos = [], [], 0
+    while pos < len(left):
+        m = _TERM.match(left, pos)
+        if m is None or m.end() == pos or (m.group(1) is None) != (pos == 0):
+            return None
+        signs.append(-1 if m.group(1) == "-" else 1)
+        terms.append(None if m.group(2).startswith("_") else int(m.group(2)))
+        pos = m.end()
+    m = _RESULT.fullmatch(right)
+    if m is None or len(terms) < 2:
+        return None
+    result = int(m.group(1)) if m.group(1) and not m.group(1).startswith("_") else None
+    if (result is None) + terms.count(None) != 1:
+        return None
+    equation = Equation(terms, signs, result)
+    if equation.unknown < len(terms) and equation.answer < 0:
+        return None  # no story has a negative number of things in it
+    return equation
+
+
+def _running(start: int, steps: list) -> list:
+    """["8 + 3 = 11", "11 - 2 = 9"] for start 8 and steps [(1, 3), (-1, 2)]."""
+    lines, total = [], start
+    for sign, n in steps:
+        new = total + sign * n
+        lines.append(f"{total} {'+' if sign > 0 else '-'} {n} = {new}")
+        total = new
+    return lines
+
+
+def _minus(a: int, b: int) -> str:
+    return f"{a} - ({b})" if b < 0 else f"{a} - {b}"
+
+
+def _details(eq: Equation) -> dict:
+    """Two hints and a worked solution; they only use the numbers."""
+    answer = eq.answer
+    terms = eq.solved()
+    result = eq.result if eq.result is not None else answer
+    hint1 = f"Write the story as a number sentence: {eq.text()}"
+
+    if eq.unknown == len(terms):
+        steps = _running(terms[0], list(zip(eq.signs[1:], terms[1:])))
+        if len(steps) > 1:
+            hint2 = f"Go one step at a time: {steps[0]}. Then keep going from {steps[0].rsplit(' ', 1)[-1]}."
+        else:
+            hint2 = f"Start at {terms[0]} and count {'up' if eq.signs[1] > 0 else 'back'} {terms[1]}."
+        solution = f"{'. '.join(steps)}. So the answer is {answer}."
+    elif eq.unknown == 0:
+        # undo every step, starting from the result
+        undo = [(-s, t) for s, t in zip(eq.signs[1:], terms[1:])]
+        steps = _running(result, undo)
+        undone = " ".join([str(result)] + [f"{'+' if s > 0 else '-'} {n}" for s, n in undo])
+        hint2 = f"Undo the other steps, starting from {result}: {undone} = ?"
+        solution = (f"Undo the other steps, starting from {result}: {'. '.join(steps)}. "
+                    f"So the missing number is {answer}. Check: {eq.text(terms, result)}.")
+    else:
+        others = [(s, t) for i, (s, t) in enumerate(zip(eq.signs, terms)) if i != eq.unknown]
+        known = sum(s * t for s, t in others)
+        steps = _running(others[0][1], others[1:])
+        first = f"Work out the rest first: {'. '.join(steps)}. " if steps else ""
+        if eq.signs[eq.unknown] > 0:
+            hint2 = f"{first}What do you add to {known} to get {result}?"
+            last = _minus(result, known)
+        else:
+            hint2 = f"{first}What do you take away from {known} to get {result}?"
+            last = _minus(known, result)
+        solution = (f"{first}{last} = {answer}, so the missing number is {answer}. "
+                    f"Check: {eq.text(terms, result)}.")
+    return {"hint1": hint1, "hint2": hint2, "solution": solution}
+
+
+def _count(n, bank: dict) -> str:
+    if n is None:
+        return f"some {bank['thing'][1]}"
+    return f"{n} {bank['thing'][0] if n == 1 else bank['thing'][1]}"
+
+
+def _points(n) -> str:
+    if n is None:
+        return "some points"
+    return f"{n} point" if n == 1 else f"{n} points"
+
+
+def _story(eq: Equation, bank: dict, rng: random.Random) -> str:
+    name = rng.choice(bank["names"])
+    terms = eq.solved()
+    totals, total = [], 0
+    for sign, term in zip(eq.signs, terms):
+        total += sign * term
+        totals.append(total)
+    shown = [None if i == eq.unknown else t for i, t in enumerate(eq.terms)]
+    result = None if eq.unknown == len(terms) else eq.result
+
+    steps = eq.signs[1:]
+    counting = (min(totals) >= 0
+                and sum(s > 0 for s in steps) <= len(bank["gain"])
+                and sum(s < 0 for s in steps) <= len(bank["lose"]))
+    if not counting:
+        # can't have fewer than no things, or more steps than actions to tell
+        # them apart by, so keep score in numbered rounds instead
+        lines = [f"{name} is playing {bank['game']} and starts with {_points(shown[0])}."]
+        for k, (sign, n) in enumerate(zip(eq.signs[1:], shown[1:]), 1):
+            lines.append(f"In round {k}, {name} {'scores' if sign > 0 else 'loses'} {_points(n)}.")
+        if result is not None:
+            lines.append(f"{name} ends the game with {_points(result)}.")
+        if eq.unknown == len(terms):
+            lines.append(f"How many points does {name} have at the end?")
+        elif eq.unknown == 0:
+            lines.append(f"How many points did {name} start with?")
+        else:
+            verb = "score" if eq.signs[eq.unknown] > 0 else "lose"
+            lines.append(f"How many points did {name} {verb} in round {eq.unknown}?")
+        return " ".join(lines)
+
+    # a different action for every step, so the question can say which one
+    gains = list(bank["gain"])
+    loses = list(bank["lose"])
+    rng.shuffle(gains)
+    rng.shuffle(loses)
+    lines = [f"{name} has {_count(shown[0], bank)} {bank['place']}."]
+    asked = None
+    for k, (sign, n) in enumerate(zip(eq.signs[1:], shown[1:]), 1):
+        told, question = (gains if sign > 0 else loses).pop(0)
+        things = _count(n, bank).split(" ", 1)
+        lines.append(f"{'Then' if k == 1 else 'After that,'} {name} {told.format(n=things[0], things=things[1])}.")
+        if k == eq.unknown:
+            asked = question
+    things = bank["thing"][1]
+    if result is not None:
+        lines.append(f"Now {name} has {_count(result, bank)}.")
+    if eq.unknown == len(terms):
+        lines.append(f"How many {things} does {name} have now?")
+    elif eq.unknown == 0:
+        lines.append(f"How many {things} did {name} have at the start?")
+    else:
+        lines.append(f"How many {things} did {name} {asked}?")
+    return " ".join(lines)
+
+
+def theme_locally(question: str, theme: str, solution=None):
+    """
+    A themed variant of a generated question ({question, numeric_solution,
+    hint1, hint2, solution, engine: "local"}), or None if the theme has no
+    phrase bank, the question isn't a sum we can read, or its answer doesn't
+    match solution.
+    Never raises, a question it can't render is left to the model.
+    """
+    bank = PHRASE_BANKS.get((theme or "").lower())
+    if bank is None:
+        return None
+    try:
+        eq = parse(question)
+        if eq is None:
+            return None
+        if solution is not None and normalize_number(solution) != normalize_number(eq.answer):
+            return None
+        # seeded by the question, so the same question always gets the same story
+        rng = random.Random(f"{theme.lower()}:{question}")
+        return {
+            "question": _story(eq, bank, rng),
+            "numeric_solution": str(eq.answer),
+            **_details(eq),
+            "engine": "local",
+        }
+    except Exception as e:
+        print(f"[WARN] Couldn't theme '{question}' locally for {theme}: {type(e).__name__}: {e}")
+        return None
@@ -0,0 +1,275 @@
+"""
+Write-behind layer for persisted documents.
+
+helpers.write_json() hands encoded documents to the writer. How they reach
+the disk depends on DURABILITY_MODE:
+
+  strict   temp file, fsync, rename and directory fsync in the calling thread
+  grouped  writes that arrive within GROUP_COMMIT_MS of each other form one
+           batch; repeated writes to the same file are coalesced, the batch
+           is written and fsynced once, and every caller returns once its
+           batch is on disk
+  relaxed  callers return straight away; batches are written (without fsync)
+           every RELAXED_FLUSH_SECONDS and at shutdown
+
+A caller can pass on_written to write(), which runs once that document
+is on disk (in the flushing thread, so it must not take locks), e.g. to
+drop what the document replaces only then.
+
+Until a document is written, load_json() in this process reads it from the
+pending batch. Other worker processes only see it once it is on disk, so a
+relaxed deployment should run a single worker. strict and grouped only
+return after the write, so locks keep working across workers.
+"""
+
+import atexit
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from constants import DURABILITY_MODE, GROUP_COMMIT_MS, RELAXED_FLUSH_SECONDS
+
+MODES = ("strict", "grouped", "relaxed")
+
+
+def _write_file(path: Path, raw: bytes, fsync: bool):
+    fd, temp_name = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(raw)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_name, path)
+    except BaseException:
+        if os.path.exists(temp_name):
+            os.unlink(temp_name)
+        raise
+
+
+def _fsync_path(path: Path):
+    """fsync a file or directory, quietly skipping what the OS won't open (directories on Windows)."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class WriteBehind:
+    def __init__(self, mode: str = DURABILITY_MODE, window_ms: float = GROUP_COMMIT_MS,
+                 interval: float = RELAXED_FLUSH_SECONDS):
+        if mode not in MODES:
+            raise ValueError(f"Unknown durability mode '{mode}', choose from {MODES}")
+        self.mode = mode
+        self.window = window_ms / 1000
+        self.interval = interval
+
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._pending = {}    # path -> encoded document, latest write wins
+        self._inflight = {}   # the batch currently being written
+        self._sync = set()    # appended files to fsync with the next batch
+        self._callbacks = {}  # path -> on_written callbacks waiting for its next write
+        self._batch = 1       # batch number new writes join
+        self._flushed = 0     # last batch that reached the disk
+        self._errors = {}     # batch number -> exception, for waiting callers
+        self._thread = None
+
+        self.writes = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.batch_docs_total = 0
+        self.batch_docs_max = 0
+        self.flush_ms_total = 0.0
+        self.flush_ms_max = 0.0
+
+    # ---------- reads ----------
+
+    def pending(self, path: Path):
+        """Encoded document not yet on disk, or None."""
+        with self._cond:
+            raw = self._pending.get(path)
+            return raw if raw is not None else self._inflight.get(path)
+
+    # ---------- writes ----------
+
+    def write(self, path: Path, raw: bytes, on_written=None):
+        # folders are created right away so directory listings see new records
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        if self.mode == "strict":
+            start = time.perf_counter()
+            _write_file(path, raw, fsync=True)
+            _fsync_path(path.parent)
+            self._record_batch(1, time.perf_counter() - start)
+            with self._cond:
+                self.writes += 1
+            if on_written is not None:
+                on_written()
+            return
+
+        self._start()
+        with self._cond:
+            self.writes += 1
+            if path in self._pending:
+                self.coalesced += 1
+            self._pending[path] = raw
+            if on_written is not None:
+                self._callbacks.setdefault(path, []).append(on_written)
+            batch = self._batch
+            self._cond.notify_all()
+        if self.mode == "grouped":
+            self._wait_for(batch)
+
+    def sync(self, path: Path):
+        """Make a file written outside this layer (an appended journal) durable."""
+        if self.mode == "strict":
+            _fsync_path(path)
+        elif self.mode == "grouped":
+            self._start()
+            with self._cond:
+                self._sync.add(path)
+                batch = self._batch
+                self._cond.notify_all()
+            self._wait_for(batch)
+        # relaxed: the OS writes it back whenever it likes
+
+    def discard(self, folder: Path):
+        """Drop pending writes under a folder that is being deleted."""
+        with self._flush_lock, self._cond:
+            for path in [p for p in self._pending if folder in p.parents]:
+                del self._pending[path]
+                self._callbacks.pop(path, None)
+
+    def _wait_for(self, batch: int):
+        with self._cond:
+            while self._flushed < batch:
+                self._cond.wait()
+            error = self._errors.get(batch)
+        if error is not None:
+            raise error
+
+    # ---------- flushing ----------
+
+    def _after_fork(self):
+        # the flusher thread doesn't survive a fork; pending writes were flushed just before it
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._pending, self._inflight, self._sync = {}, {}, set()
+        self._callbacks = {}
+        self._thread = None
+
+    def _start(self):
+        if self._thread is None:
+            with self._cond:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not (self._pending or self._sync):
+                    self._cond.wait()
+            # let more writes join the batch
+            time.sleep(self.window if self.mode == "grouped" else self.interval)
+            self.flush()
+
+    def flush(self):
+        """Write everything pending now, in the calling thread."""
+        with self._flush_lock:
+            with self._cond:
+                batch, self._pending = self._pending, {}
+                sync, self._sync = self._sync, set()
+                callbacks, self._callbacks = self._callbacks, {}
+                self._inflight = batch
+                batch_no = self._batch
+                self._batch += 1
+
+            start = time.perf_counter()
+            error = None
+            try:
+                fsync = self.mode != "relaxed"
+                for path, raw in batch.items():
+                    _write_file(path, raw, fsync=fsync)
+                if fsync:
+                    for path in sync:
+                        _fsync_path(path)
+                    for folder in {p.parent for p in batch}:
+                        _fsync_path(folder)
+            except Exception as e:
+                error = e
+                print(f"[ERROR] Writing batch of {len(batch)} documents failed: {e}")
+            else:
+                # while the batch is still in flight, so readers see the new document until these ran
+                for path, fns in callbacks.items():
+                    for fn in fns:
+                        try:
+                            fn()
+                        except Exception as e:
+                            print(f"[WARN] After writing {path}: {e}")
+
+            if batch or sync:
+                self._record_batch(len(batch), time.perf_counter() - start)
+
+            with self._cond:
+                self._inflight = {}
+                if error is not None:
+                    if self.mode == "relaxed":
+                        # nobody is waiting on it, keep the documents for the next try
+                        for path, raw in batch.items():
+                            self._pending.setdefault(path, raw)
+                        for path, fns in callbacks.items():
+                            self._callbacks[path] = fns + self._callbacks.get(path, [])
+                    self._errors[batch_no] = error
+                    self._errors.pop(batch_no - 1000, None)
+                self._flushed = batch_no
+                self._cond.notify_all()
+
+    def _record_batch(self, docs: int, elapsed: float):
+        with self._cond:
+            self.batches += 1
+            self.batch_docs_total += docs
+            self.batch_docs_max = max(self.batch_docs_max, docs)
+            self.flush_ms_total += elapsed * 1000
+            self.flush_ms_max = max(self.flush_ms_max, elapsed * 1000)
+
+    def stats(self) -> dict:
+        """Batch sizes and flush latency, for /metrics."""
+        with self._cond:
+            return {
+                "mode": self.mode,
+                "writes": self.writes,
+                "coalesced": self.coalesced,
+                "pending": len(self._pending),
+                "batches": self.batches,
+                "avg_batch_docs": self.batch_docs_total / self.batches if self.batches else 0.0,
+                "max_batch_docs": self.batch_docs_max,
+                "avg_flush_ms": self.flush_ms_total / self.batches if self.batches else 0.0,
+                "max_flush_ms": self.flush_ms_max,
+            }
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> WriteBehind:
+    """Return the process-wide writer for DURABILITY_MODE."""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = WriteBehind()
+                atexit.register(_writer.flush)
+                if hasattr(os, "register_at_fork"):
+                    os.register_at_fork(before=_writer.flush, after_in_child=_writer._after_fork)
+    return _writer
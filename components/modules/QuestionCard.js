@@ -3,7 +3,8 @@
 import {Card, CardContent, CardHeader, CardTitle} from "@/components/ui/card";
 import {Input} from "@/components/ui/input";
 import {Button} from "@/components/ui/button";
-import {useState, useEffect} from "react";
+import {useState, useEffect, useRef} from "react";
+import {studentAPI} from "@/lib/api";
 
 export default function QuestionCard({ module, question, onAnswer, userid, classid, questionStartTsRef }) {
     const [answer, setAnswer] = useState("");
@@ -15,17 +16,45 @@ export default function QuestionCard({ module, question, onAnswer, userid, class
     const [showSolution, setShowSolution] = useState(false);
     const [hasViewedSolution, setHasViewedSolution] = useState(false);
     const [animate, setAnimate] = useState(false);
-
-    const unlockedHints = question.hints.slice(0, Math.min(wrongAttempts, question.hints.length));
-    const solutionAvailable = wrongAttempts > question.hints.length;
-
-    const handleShowHint = () => {
+    // themed questions get their hints and solution written the first time they're opened
+    const [hints, setHints] = useState(question.hints || []);
+    const [solutionFeedback, setSolutionFeedback] = useState(question.solutionFeedback);
+    const [hintsLoaded, setHintsLoaded] = useState(false);
+    const [solutionLoaded, setSolutionLoaded] = useState(false);
+    const questionIdRef = useRef(question.id);
+
+    const needsDetails = question.themed && !question.details;
+    const unlockedHints = hints.slice(0, Math.min(wrongAttempts, hints.length));
+    // gate on the hints the question came with, loading the written ones mustn't hide the button again
+    const solutionAvailable = wrongAttempts > (question.hints || []).length;
+
+    const detailsRequest = () => ({
+        userid,
+        class_id: classid,
+        lesson_id: module.id,
+        question_id: question.id,
+    });
+
+    const handleShowHint = async () => {
       setCurrentHintIndex(0);
       setShowHints(true);
+      if (!needsDetails || hintsLoaded) return;
+
+      const res = await studentAPI.getHint(detailsRequest());
+      // the student may have moved on meanwhile
+      if (res.success && res.question_id === questionIdRef.current && res.hints?.length) {
+          setHints(res.hints);
+          setHintsLoaded(true);
+      }
     };
 
     // Reset state when question changes
     useEffect(() => {
+        questionIdRef.current = question.id;
+        setHints(question.hints || []);
+        setSolutionFeedback(question.solutionFeedback);
+        setHintsLoaded(false);
+        setSolutionLoaded(false);
         setAnswer("");
         setStatus("unanswered");
         setFeedback("");
@@ -93,9 +122,17 @@ const handleShowSolution = async () => {
     setShowHints(false);
     setHasViewedSolution(true);
 
-    // Calculate time taken in seconds
+    // Calculate time taken in seconds, before waiting for the solution to be written
     const timeTakenSec = Math.floor((Date.now() - questionStartTsRef.current) / 1000);
 
+    if (needsDetails && !solutionLoaded) {
+        const res = await studentAPI.getSolution(detailsRequest());
+        if (res.success && res.question_id === questionIdRef.current) {
+            setSolutionFeedback(res.solution_feedback);
+            setSolutionLoaded(true);
+        }
+    }
+
     // Send solution viewed as "time taken" with correct=false
     try {
         await fetch("http://127.0.0.1:5000/student/update-question", {
@@ -186,7 +223,7 @@ const handleShowSolution = async () => {
                 {showSolution && (
                   <div className="mt-4 p-4 bg-blue-50 border rounded">
                     <strong>Solution:</strong>{" "}
-                    <p>{question.solutionFeedback || question.solution}</p>
+                    <p>{solutionFeedback || question.solution}</p>
                   </div>
                 )}
             </CardContent>
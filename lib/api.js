@@ -228,6 +228,43 @@ export const studentAPI = {
     });
   },
 
+  /**
+   * Get one lesson's questions and which of them are themed so far
+   * (poll while theming is "running")
+   * @param {string} userid
+   * @param {string} class_id
+   * @param {string} lesson_id
+   * @returns {Promise<{success: boolean, theming: string, themed: number, total: number, themed_ids: Array<string>, questions: Object}>}
+   */
+  getLessonQuestions: async (userid, class_id, lesson_id) => {
+    const params = new URLSearchParams({ userid, class_id, lesson_id });
+    return apiRequest(`/student/lesson-questions?${params}`);
+  },
+
+  /**
+   * Get the hints of a question (written on first request for themed questions)
+   * @param {Object} data - {userid, class_id, lesson_id, question_id}
+   * @returns {Promise<{success: boolean, question_id: string, hints: Array<string>}>}
+   */
+  getHint: async (data) => {
+    return apiRequest('/student/hint', {
+      method: 'POST',
+      body: JSON.stringify(data),
+    });
+  },
+
+  /**
+   * Get the step-by-step solution of a question (written on first request for themed questions)
+   * @param {Object} data - {userid, class_id, lesson_id, question_id}
+   * @returns {Promise<{success: boolean, question_id: string, solution: string, solution_feedback: string}>}
+   */
+  getSolution: async (data) => {
+    return apiRequest('/student/solution', {
+      method: 'POST',
+      body: JSON.stringify(data),
+    });
+  },
+
   /**
    * Complete a lesson
    * @param {string} userid
@@ -243,6 +280,20 @@ export const studentAPI = {
   },
 };
 
+/**
+ * Background job APIs
+ */
+export const jobsAPI = {
+  /**
+   * Poll a background job, e.g. the theming_job from completeLesson
+   * @param {string} job_id
+   * @returns {Promise<{success: boolean, job: {status: string, attempts: number, error: string|null}}>}
+   */
+  getJob: async (job_id) => {
+    return apiRequest(`/jobs/${encodeURIComponent(job_id)}`, { method: 'GET' });
+  },
+};
+
 /**
  * Lesson Content APIs
  */
@@ -260,6 +311,23 @@ export const lessonAPI = {
     });
   },
 
+  /**
+   * Get lesson HTML as text from the cacheable GET endpoint
+   * (compressed and revalidated with ETags by the browser)
+   * @param {string} class_id
+   * @param {string} lesson_id
+   * @returns {Promise<string>}
+   */
+  getLessonHtml: async (class_id, lesson_id) => {
+    const response = await fetch(
+      `${API_BASE_URL}/lesson-content/${encodeURIComponent(class_id)}/${encodeURIComponent(lesson_id)}`
+    );
+    if (!response.ok) {
+      throw new Error(`Lesson not found (${response.status})`);
+    }
+    return response.text();
+  },
+
   /**
    * Get available themes
    * @returns {Promise<Array<string>>}
@@ -344,4 +412,5 @@ export default {
   student: studentAPI,
   lesson: lessonAPI,
   teacher: teacherAPI,
+  jobs: jobsAPI,
 };